@@ -0,0 +1,335 @@
+""" Benchmark downloads and conversions against a local fake Google Drive service
+
+* `download_latency`: time to download one file of each size
+* `batch_throughput`: files and bytes per second of :obj:`gdoc_down.GDocDown.download_many` at each concurrency
+* `convert_latex`: time of :obj:`gdoc_down.GDocDown.convert_html_to_latex` for each size of document
+
+Each benchmark runs in its own process, which also reports its peak resident set size. The fake service serves
+synthetic exports of configurable size and waits for a configurable latency before responding to each request, so
+that the benchmarks don't require Google credentials or network access. The results are printed as a table and as
+JSON, which can be saved with `--output` for regression tracking.
+
+Usage::
+
+    python benchmarks/downloads.py [--sizes 100K,1M,10M] [--latency 0.02] [--docs 64] [--concurrency 1,4,16]
+        [--output results.json] [--quick]
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+from fake_drive import FakeDriveService
+from gdoc_down.core import GDocDown
+from gdoc_down.output import OutputLock
+from gdoc_down.retry import TokenBucket
+from gdoc_down.store import parse_size
+import argparse
+import datetime
+import gdoc_down
+import io
+import json
+import mock
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import zipfile
+
+BENCHMARKS = ('download_latency', 'batch_throughput', 'convert_latex')
+
+QUICK_ARGS = ['--sizes', '1K,10K', '--latency', '0', '--docs', '8', '--concurrency', '1,4', '--repeats', '2']
+
+
+def benchmark_download_latency(args, tmp_dir):
+    """ Measure the time to download one file of each size
+
+    Args:
+        args (:obj:`argparse.Namespace`): options
+        tmp_dir (:obj:`str`): directory for the stubs and downloaded files
+
+    Returns:
+        :obj:`list` of :obj:`dict`: size, median and 95th percentile time, and throughput for each size
+    """
+    results = []
+    for size in args.sizes:
+        service = FakeDriveService(latency=args.latency)
+        google_files = make_documents(service, tmp_dir, 1, size)
+        downloader = make_downloader(service, args)
+
+        # warm up, e.g., import the modules which are imported on first use
+        downloader.download(google_files[0], format='txt', out_path=tmp_dir, force=True)
+
+        times = []
+        for i_repeat in range(args.repeats):
+            start = time.perf_counter()
+            downloader.download(google_files[0], format='txt', out_path=tmp_dir, force=True)
+            times.append(time.perf_counter() - start)
+
+        results.append({
+            'size': size,
+            'median_s': statistics.median(times),
+            'p95_s': percentile(times, 0.95),
+            'mb_per_s': size / statistics.median(times) / 1e6,
+        })
+    return results
+
+
+def benchmark_batch_throughput(args, tmp_dir):
+    """ Measure the throughput of downloading a batch of files at each concurrency
+
+    Args:
+        args (:obj:`argparse.Namespace`): options
+        tmp_dir (:obj:`str`): directory for the stubs and downloaded files
+
+    Returns:
+        :obj:`list` of :obj:`dict`: concurrency, time, and file and byte throughput for each concurrency
+    """
+    size = args.sizes[0]
+    service = FakeDriveService(latency=args.latency)
+    google_files = make_documents(service, tmp_dir, args.docs, size)
+    out_dir = os.path.join(tmp_dir, 'out')
+    os.mkdir(out_dir)
+
+    # warm up, e.g., import the modules which are imported on first use
+    make_downloader(service, args).download(google_files[0], format='txt', out_path=out_dir, force=True)
+
+    results = []
+    for max_workers in args.concurrency:
+        downloader = make_downloader(service, args)
+        start = time.perf_counter()
+        download_results = downloader.download_many(google_files, format='txt', out_path=out_dir,
+                                                    max_workers=max_workers, force=True)
+        seconds = time.perf_counter() - start
+        errors = [result.error for result in download_results if not result.success]
+        if errors:
+            raise errors[0]
+
+        results.append({
+            'max_workers': max_workers,
+            'docs': args.docs,
+            'size': size,
+            'seconds': seconds,
+            'files_per_s': args.docs / seconds,
+            'mb_per_s': args.docs * size / seconds / 1e6,
+        })
+    return results
+
+
+def benchmark_convert_latex(args, tmp_dir):
+    """ Measure the time to convert a document exported as zipped HTML to LaTeX for each size of document
+
+    Args:
+        args (:obj:`argparse.Namespace`): options
+        tmp_dir (:obj:`str`): unused
+
+    Returns:
+        :obj:`list` of :obj:`dict`: size, median time, and throughput for each size
+    """
+    results = []
+    for size in args.sizes:
+        html_zip = make_html_zip(size)
+        times = []
+        for i_repeat in range(args.repeats):
+            start = time.perf_counter()
+            GDocDown.convert_html_to_latex(io.BytesIO(html_zip))
+            times.append(time.perf_counter() - start)
+
+        results.append({
+            'size': size,
+            'median_s': statistics.median(times),
+            'mb_per_s': size / statistics.median(times) / 1e6,
+        })
+    return results
+
+
+def make_documents(service, dirname, n_docs, size):
+    """ Add synthetic documents to a fake service and create stubs for them
+
+    Args:
+        service (:obj:`FakeDriveService`): fake service
+        dirname (:obj:`str`): directory to create the stubs in
+        n_docs (:obj:`int`): number of documents
+        size (:obj:`int`): size in bytes of the plain text export of each document
+
+    Returns:
+        :obj:`list` of :obj:`str`: paths to the stubs
+    """
+    google_files = []
+    for i_doc in range(n_docs):
+        doc_id = 'doc-{}'.format(i_doc)
+        line = 'document {} '.format(i_doc).encode('utf-8')
+        service.documents[doc_id] = {'text/plain': (line * (size // len(line) + 1))[0:size]}
+        google_file = os.path.join(dirname, '{}-{}.gdoc'.format(doc_id, size))
+        with open(google_file, 'w') as file:
+            json.dump({'doc_id': doc_id}, file)
+        google_files.append(google_file)
+    return google_files
+
+
+def make_downloader(service, args):
+    """ Make a downloader which uses a fake service and isn't rate limited
+
+    Args:
+        service (:obj:`FakeDriveService`): fake service
+        args (:obj:`argparse.Namespace`): options
+
+    Returns:
+        :obj:`GDocDown`: downloader
+    """
+    return GDocDown(credentials=mock.Mock(), service=service, chunk_size=args.chunk_size,
+                    rate_limiter=TokenBucket(1e9))
+
+
+def make_html_zip(size):
+    """ Make a synthetic Google document exported as zipped HTML
+
+    Args:
+        size (:obj:`int`): approximate size in bytes of the HTML
+
+    Returns:
+        :obj:`bytes`: zipped HTML
+    """
+    paragraph = ('<p class="c1"><span class="c0">Lorem ipsum &amp; dolor sit amet, consectetur &lt;adipiscing&gt; '
+                 'elit</span><span class="c2">&nbsp;&#8220;sed do&#8221;</span></p>')
+    html = ('<html><head><style>.c0{color:#000000}</style></head><body>'
+            + paragraph * max(1, size // len(paragraph))
+            + '</body></html>')
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, 'w') as zip:
+        zip.writestr('document.html', html)
+    return file.getvalue()
+
+
+def percentile(values, fraction):
+    """ Get a percentile of values
+
+    Args:
+        values (:obj:`list` of :obj:`float`): values
+        fraction (:obj:`float`): percentile as a fraction
+
+    Returns:
+        :obj:`float`: percentile
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def get_peak_rss():
+    """ Get the peak resident set size of this process
+
+    Returns:
+        :obj:`int`: peak resident set size in bytes, or :obj:`None` if it can't be measured on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def run_benchmark(name, args):
+    """ Run a benchmark in this process
+
+    Args:
+        name (:obj:`str`): name of the benchmark
+        args (:obj:`argparse.Namespace`): options
+
+    Returns:
+        :obj:`dict`: results and peak resident set size of the benchmark
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with mock.patch.object(GDocDown, 'MANIFEST_PATH', os.path.join(tmp_dir, 'manifest.json')), \
+                mock.patch.object(GDocDown, 'STUB_INDEX_PATH', os.path.join(tmp_dir, 'stubs.json')), \
+                mock.patch.object(OutputLock, 'DIRNAME', os.path.join(tmp_dir, 'locks')):
+            runs = globals()['benchmark_' + name](args, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return {'runs': runs, 'peak_rss_bytes': get_peak_rss()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmarks', type=str, default=','.join(BENCHMARKS),
+                        help='comma-separated list of benchmarks to run')
+    parser.add_argument('--sizes', type=str, default='100K,1M,10M',
+                        help='comma-separated sizes of the exports (the first size is used for batch throughput)')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds that the fake service waits before responding to each request')
+    parser.add_argument('--docs', type=int, default=64, help='number of files to download for batch throughput')
+    parser.add_argument('--concurrency', type=str, default='1,2,4,8,16',
+                        help='comma-separated numbers of concurrent downloads for batch throughput')
+    parser.add_argument('--chunk-size', type=str, default=None, help='number of bytes to download per request')
+    parser.add_argument('--repeats', type=int, default=5, help='number of times to repeat each measurement')
+    parser.add_argument('--output', type=str, default=None, help='path to save the results as JSON')
+    parser.add_argument('--quick', action='store_true', help='run small benchmarks, e.g., to check the suite')
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(QUICK_ARGS + argv if '--quick' in argv else argv)
+    args.benchmarks = args.benchmarks.split(',')
+    args.sizes = [parse_size(size) for size in args.sizes.split(',')]
+    args.concurrency = [int(max_workers) for max_workers in args.concurrency.split(',')]
+    args.chunk_size = parse_size(args.chunk_size) if args.chunk_size else None
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark "{}"'.format(name))
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if args.child:
+        # run one benchmark in this process and report the results to the parent
+        print(json.dumps(run_benchmark(args.child, args)))
+        return
+
+    results = {}
+    child_argv = ['--sizes', ','.join(str(size) for size in args.sizes), '--latency', str(args.latency),
+                  '--docs', str(args.docs), '--concurrency', ','.join(str(val) for val in args.concurrency),
+                  '--repeats', str(args.repeats)]
+    if args.chunk_size:
+        child_argv += ['--chunk-size', str(args.chunk_size)]
+    for name in args.benchmarks:
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name] + child_argv,
+                                 check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        results[name] = json.loads(process.stdout.strip().split('\n')[-1])
+
+        print('{} (peak RSS {:.1f} MB)'.format(name, (results[name]['peak_rss_bytes'] or 0) / 1e6), file=sys.stderr)
+        for run in results[name]['runs']:
+            print('  ' + '  '.join('{}={:.4g}'.format(key, val) for key, val in run.items()), file=sys.stderr)
+
+    report = {
+        'gdoc_down': gdoc_down.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'params': {
+            'sizes': args.sizes,
+            'latency': args.latency,
+            'docs': args.docs,
+            'concurrency': args.concurrency,
+            'chunk_size': args.chunk_size,
+            'repeats': args.repeats,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
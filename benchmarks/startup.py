@@ -0,0 +1,87 @@
+""" Benchmark the time to construct :obj:`gdoc_down.GDocDown` with each way of obtaining the Drive discovery document
+
+* `network`: download the discovery document (the behavior before discovery documents were cached)
+* `file_cache`: read the discovery document from the local file cache
+* `static`: read the discovery document bundled with the Google API client
+* `shared`: reuse the service built by another instance in the same process
+
+Usage::
+
+    python benchmarks/startup.py [--repeats N] [--network]
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from gdoc_down.core import GDocDown
+from gdoc_down.discovery_cache import DiscoveryCache
+import argparse
+import googleapiclient.discovery
+import googleapiclient.discovery_cache
+import json
+import mock
+import shutil
+import tempfile
+import time
+
+
+def time_construction(repeats, shared=False, **kwargs):
+    """ Measure the mean time to construct :obj:`GDocDown`
+
+    Args:
+        repeats (:obj:`int`): number of times to construct :obj:`GDocDown`
+        shared (:obj:`bool`, optional): if :obj:`True`, reuse the service built by the previous instance
+        **kwargs: options for :obj:`GDocDown`
+
+    Returns:
+        :obj:`float`: mean time in seconds
+    """
+    credentials = mock.Mock()
+    GDocDown(credentials=credentials, **kwargs)
+    total = 0.
+    for i_repeat in range(repeats):
+        if not shared:
+            GDocDown._services.clear()
+        start = time.perf_counter()
+        GDocDown(credentials=credentials, **kwargs)
+        total += time.perf_counter() - start
+    return total / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=20, help='number of times to construct GDocDown')
+    parser.add_argument('--network', action='store_true', help='also benchmark downloading the discovery document')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with mock.patch.object(GDocDown, 'DISCOVERY_CACHE_DIR', tmp_dir + '/discovery'), \
+                mock.patch.object(GDocDown, 'MANIFEST_PATH', tmp_dir + '/manifest.json'):
+            results = {}
+
+            if args.network:
+                with mock.patch.object(GDocDown, 'DISCOVERY_CACHE_TTL', -1.):
+                    results['network'] = time_construction(args.repeats)
+
+            # seed the file cache so that the benchmark doesn't require network access
+            cache = DiscoveryCache(GDocDown.DISCOVERY_CACHE_DIR, GDocDown.DISCOVERY_CACHE_TTL)
+            content = googleapiclient.discovery_cache.get_static_doc('drive', 'v3')
+            for url in [googleapiclient.discovery.DISCOVERY_URI, googleapiclient.discovery.V2_DISCOVERY_URI]:
+                cache.set(url.replace('{api}', 'drive').replace('{apiVersion}', 'v3'), content)
+
+            results['file_cache'] = time_construction(args.repeats)
+            results['static'] = time_construction(args.repeats, static_discovery=True)
+            results['shared'] = time_construction(args.repeats, shared=True)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for name, seconds in results.items():
+        print('{:<12}{:>10.2f} ms'.format(name, seconds * 1e3))
+    print(json.dumps({name: seconds for name, seconds in results.items()}))
+
+
+if __name__ == '__main__':
+    main()
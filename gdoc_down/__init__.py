@@ -2,4 +2,4 @@ from ._version import __version__
 # :obj:`str`: version
 
 # API
-from .core import GDocDown
\ No newline at end of file
+from .core import Format, GDocDown
\ No newline at end of file
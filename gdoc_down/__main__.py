@@ -9,28 +9,283 @@ formats.
 """
 
 from gdoc_down.core import GDocDown
+import argparse
 import cement
 import gdoc_down
+import glob
+
+STORE_ARGUMENTS = [
+    (['--cache'], dict(action='store_true', help='save files which were already exported from the cache of exports')),
+    (['--cache-dir'], dict(type=str, help='directory of the cache of exports (implies --cache)', default=None)),
+    (['--cache-size'], dict(type=str, help='maximum size of the cache of exports (e.g., 500M or 2G)', default=None)),
+    (['--fsync'], dict(action='store_true', help='flush saved files to disk so that they survive crashes')),
+]
+
+STATS_ARGUMENTS = [
+    (['--stats'], dict(action='store_true', help='print the number, duration, and size of each phase of the downloads')),
+    (['--stats-file'], dict(type=str, help='path to append the timing of each phase of each download to as JSON lines',
+                            default=None)),
+]
+
+
+def get_store(args):
+    """ Get the store of exports selected by the command line arguments
+
+    Args:
+        args (:obj:`argparse.Namespace`): parsed command line arguments
+
+    Returns:
+        :obj:`ExportStore`: store of exports, or :obj:`None` if the cache of exports shouldn't be used
+    """
+    if not (args.cache or args.cache_dir):
+        return None
+    from gdoc_down.store import ExportStore, parse_size
+    return ExportStore(args.cache_dir, max_size=parse_size(args.cache_size) if args.cache_size else None,
+                       fsync=args.fsync)
+
+
+def get_metrics(args):
+    """ Get the recorder of the phases of downloads selected by the command line arguments
+
+    Args:
+        args (:obj:`argparse.Namespace`): parsed command line arguments
+
+    Returns:
+        :obj:`Metrics`: recorder of the phases of downloads, or :obj:`None` if phases shouldn't be recorded
+    """
+    if not (args.stats or args.stats_file):
+        return None
+    from gdoc_down.metrics import Metrics
+    return Metrics(file=open(args.stats_file, 'a') if args.stats_file else None)
+
+
+def print_stats(metrics):
+    """ Print the number, total duration, and total size of each phase of downloads
+
+    Args:
+        metrics (:obj:`Metrics`): recorder of the phases of downloads
+    """
+    header = ('Phase', 'Count', 'Seconds', 'Bytes')
+    rows = [(event, str(total['count']), '{:.3f}'.format(total['seconds']), str(total['bytes']))
+            for event, total in sorted(metrics.totals.items())]
+    widths = [max(len(row[i_col]) for row in [header] + rows) for i_col in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(val.ljust(width) for val, width in zip(row, widths)).rstrip())
+
 
 class BaseController(cement.Controller):
     """ Base controller for command line application """
 
     class Meta:
         label = 'base'
-        description = "Download a Google document, presentation, or workbook to a local file"
+        description = ("Download Google documents, presentations, or workbooks to local files. "
+                       "If no command is given, the arguments are passed to the download command.")
         arguments = [
             (['-v', '--version'], dict(action='version', version=gdoc_down.__version__)),
-            (['google_file'], dict(type=str, help='path to Google document, presentation, or workbook')),
-            (['--format', '-f'], dict(type=str, help='output format (csv, docx, epub, html, odft, odp, ods, pdf, pptx, rtf, tsv, tex, txt, xlsx)', default='docx')),
-            (['--out_path', '-o'], dict(type=str, help='path where Google document, presentation, or workbook should be downloaded', default='.')),
-            (['--extension', '-e'], dict(type=str, help='output extension', default=None)),            
         ]
 
     @cement.ex(hide=True)
     def _default(self):
+        self._parser.print_help()
+
+    @cement.ex(
+        help='download Google documents, presentations, or workbooks',
+        arguments=[
+            (['google_files'], dict(type=str, nargs='+',
+                                    help='paths or glob patterns of Google documents, presentations, or workbooks')),
+            (['--format', '-f'], dict(type=str, help='output format (csv, csv.zip, docx, epub, html, odft, odp, ods, pdf, pptx, rtf, tsv, tsv.zip, tex, txt, xlsx)', default='docx')),
+            (['--out_path', '-o'], dict(type=str, help='path where Google document, presentation, or workbook should be downloaded', default='.')),
+            (['--extension', '-e'], dict(type=str, help='output extension', default=None)),
+            (['--max-workers', '-j'], dict(type=int, help='maximum number of files to download concurrently', default=None)),
+            (['--force'], dict(action='store_true', help='download files even if the local copies are up to date')),
+            (['--server'], dict(action='store_true', help='submit the downloads to a running `gdoc-down serve` process')),
+            (['--socket'], dict(type=str, help='path to the socket of the `gdoc-down serve` process', default=None)),
+        ] + STORE_ARGUMENTS + STATS_ARGUMENTS,
+    )
+    def download(self):
+        args = self.app.pargs
+
+        google_files = []
+        for pattern in args.google_files:
+            google_files.extend(sorted(glob.glob(pattern)) or [pattern])
+
+        if args.server:
+            # the store, flushing, and concurrency of the downloads are configured by the server
+            options = [option for option, value in [
+                ('--max-workers', args.max_workers is not None),
+                ('--cache', args.cache),
+                ('--cache-dir', args.cache_dir),
+                ('--cache-size', args.cache_size),
+                ('--fsync', args.fsync),
+                ('--stats', args.stats),
+                ('--stats-file', args.stats_file),
+            ] if value]
+            if options:
+                raise Exception('{} cannot be used with --server; configure the downloads of the server with the '
+                                'options of `gdoc-down serve`'.format(', '.join(options)))
+
+            from gdoc_down.server import GDocDownClient
+            results = GDocDownClient(socket_path=args.socket).download_many(
+                google_files, format=args.format, out_path=args.out_path, extension=args.extension, force=args.force)
+        else:
+            metrics = get_metrics(args)
+            try:
+                with GDocDown(credentials=self.app.credentials, store=get_store(args), fsync=args.fsync,
+                              metrics=metrics) as downloader:
+                    results = downloader.download_many(google_files, format=args.format, out_path=args.out_path,
+                                                       extension=args.extension, max_workers=args.max_workers,
+                                                       force=args.force)
+            finally:
+                if metrics is not None and metrics.file is not None:
+                    metrics.file.close()
+
+        for result in results:
+            if not result.success:
+                print('{}: failed: {}'.format(result.google_file, result.error))
+            elif result.up_to_date:
+                print('{}: {} is up to date'.format(result.google_file, result.out_file))
+            else:
+                print('{}: saved to {}'.format(result.google_file, result.out_file))
+        print('{} up to date (manifest hits), {} exported (manifest misses)'.format(
+            len([result for result in results if result.success and result.up_to_date]),
+            len([result for result in results if result.success and not result.up_to_date])))
+        if not args.server and downloader.store is not None:
+            print('{} saved from the cache'.format(downloader.store.hits))
+        if not args.server and (downloader.retry_policy.retries or downloader.rate_limiter.throttled):
+            print('{} requests retried, {} requests throttled ({:.1f} s)'.format(
+                downloader.retry_policy.retries, downloader.rate_limiter.throttled,
+                downloader.rate_limiter.throttled_time))
+        if not args.server and args.stats:
+            print_stats(metrics)
+
+        errors = [result.error for result in results if not result.success]
+        if len(results) == 1 and errors:
+            raise errors[0]
+        elif errors:
+            raise Exception('{} of {} files could not be downloaded'.format(len(errors), len(results)))
+
+    @cement.ex(
+        help='mirror a directory tree of Google documents, presentations, and workbooks into a directory tree of '
+             'local files',
+        arguments=[
+            (['src_dir'], dict(type=str, help='directory of Google documents, presentations, and workbooks')),
+            (['dst_dir'], dict(type=str, help='directory to save the local files')),
+            (['--format-map'], dict(type=str, help='output formats of each type of file (e.g., gdoc=docx+pdf,gsheet=xlsx,gslides=pptx)',
+                                    default=None)),
+            (['--max-workers', '-j'], dict(type=int, help='maximum number of files to download concurrently', default=None)),
+            (['--force'], dict(action='store_true', help='download files even if the local copies are up to date')),
+            (['--no-delete'], dict(action='store_true', help="don't remove the local files of deleted files")),
+            (['--incremental'], dict(action='store_true',
+                                     help='only check the files which have changed since the last incremental sync')),
+        ] + STORE_ARGUMENTS + STATS_ARGUMENTS,
+    )
+    def sync(self):
         args = self.app.pargs
 
-        GDocDown(credentials=self.app.credentials).download(args.google_file, format=args.format, out_path=args.out_path, extension=args.extension)
+        format_map = GDocDown.parse_format_map(args.format_map) if args.format_map else None
+        metrics = get_metrics(args)
+        try:
+            with GDocDown(credentials=self.app.credentials, store=get_store(args), fsync=args.fsync,
+                          metrics=metrics) as downloader:
+                results, removed = downloader.sync(args.src_dir, args.dst_dir, format_map=format_map,
+                                                   max_workers=args.max_workers, force=args.force,
+                                                   delete=not args.no_delete, incremental=args.incremental)
+        finally:
+            if metrics is not None and metrics.file is not None:
+                metrics.file.close()
+
+        for result in results:
+            if not result.success:
+                print('{}: failed: {}'.format(result.google_file, result.error))
+            elif not result.up_to_date:
+                print('{}: saved to {}'.format(result.google_file, result.out_file))
+        for out_file in removed:
+            print('{}: removed'.format(out_file))
+        print('{} up to date, {} exported, {} removed'.format(
+            len([result for result in results if result.success and result.up_to_date]),
+            len([result for result in results if result.success and not result.up_to_date]),
+            len(removed)))
+        if args.stats:
+            print_stats(metrics)
+
+        errors = [result.error for result in results if not result.success]
+        if errors:
+            raise Exception('{} of {} files could not be downloaded'.format(len(errors), len(results)))
+
+    @cement.ex(
+        help='list the output formats of each type of Google file',
+    )
+    def formats(self):
+        rows = [(format.stub_type, format.name, format.extension, format.export_type, format.description or '')
+                for format in GDocDown.get_formats()]
+        header = ('Type', 'Format', 'Extension', 'Export MIME type', 'Description')
+        widths = [max(len(row[i_col]) for row in [header] + rows) for i_col in range(len(header) - 1)]
+        for row in [header] + rows:
+            print('  '.join(val.ljust(width) for val, width in zip(row, widths)) + '  ' + row[-1])
+
+    @cement.ex(
+        help='keep an authenticated connection to Google Drive open and download files submitted with '
+             '`gdoc-down download --server`',
+        arguments=[
+            (['--socket'], dict(type=str, help='path to the socket to listen on', default=None)),
+            (['--max-workers', '-j'], dict(type=int, help='maximum number of files to download concurrently', default=None)),
+        ] + STORE_ARGUMENTS,
+    )
+    def serve(self):
+        from gdoc_down.server import GDocDownServer
+        args = self.app.pargs
+
+        downloader = GDocDown(credentials=self.app.credentials, store=get_store(args), fsync=args.fsync)
+        with GDocDownServer(downloader, socket_path=args.socket, max_workers=args.max_workers) as server:
+            print('Listening on {}'.format(server.socket_path))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+class CacheController(cement.Controller):
+    """ Controller for the commands which manage the cache of exports """
+
+    class Meta:
+        label = 'cache'
+        stacked_on = 'base'
+        stacked_type = 'nested'
+        help = 'manage the cache of exports'
+        description = 'Manage the cache of exports which is used by `gdoc-down download --cache`'
+
+    @cement.ex(hide=True)
+    def _default(self):
+        self._parser.print_help()
+
+    @cement.ex(
+        help='print statistics about the cache of exports',
+        arguments=[
+            (['--cache-dir'], dict(type=str, help='directory of the cache of exports', default=None)),
+        ],
+    )
+    def stats(self):
+        from gdoc_down.store import ExportStore
+        stats = ExportStore(self.app.pargs.cache_dir).get_stats()
+        print('Directory: {}'.format(stats['dirname']))
+        print('Entries: {}'.format(stats['entries']))
+        print('Files: {}'.format(stats['objects']))
+        print('Size: {} of {} bytes'.format(stats['size'], stats['max_size']))
+
+    @cement.ex(
+        help='evict the least recently used exports from the cache',
+        arguments=[
+            (['--cache-dir'], dict(type=str, help='directory of the cache of exports', default=None)),
+            (['--max-size'], dict(type=str, help='maximum size of the cache (e.g., 500M or 2G); 0 empties the cache',
+                                  default=None)),
+        ],
+    )
+    def prune(self):
+        from gdoc_down.store import ExportStore, parse_size
+        args = self.app.pargs
+        max_size = parse_size(args.max_size) if args.max_size is not None else None
+        n_evicted, n_bytes_evicted = ExportStore(args.cache_dir).prune(max_size=max_size)
+        print('Evicted {} files ({} bytes)'.format(n_evicted, n_bytes_evicted))
 
 
 class App(cement.App):
@@ -39,13 +294,33 @@ class App(cement.App):
     class Meta:
         label = 'gdoc-down'
         base_controller = 'base'
-        handlers = [BaseController]
+        handlers = [BaseController, CacheController]
+
+    DEFAULT_COMMAND = 'download'
 
     def __init__(self, credentials=None, **kwargs):
         super(App, self).__init__(**kwargs)
         self.credentials = credentials
 
+    def _parse_args(self):
+        """ Run the default command if the arguments don't start with a command, so that
+        `gdoc-down -f docx example.gdoc` is equivalent to `gdoc-down download -f docx example.gdoc` """
+        commands = set()
+        for action in self.args._actions:
+            if isinstance(action, argparse._SubParsersAction):
+                commands.update(action.choices.keys())
+
+        argv = self._meta.argv
+        i_arg = 0
+        while i_arg < len(argv) and argv[i_arg] in self.args._option_string_actions:
+            i_arg += 1
+        if i_arg < len(argv) and argv[i_arg] not in commands:
+            self._meta.argv = argv[:i_arg] + [self.DEFAULT_COMMAND] + argv[i_arg:]
+
+        super(App, self)._parse_args()
+
 
 def main():
     with App() as app:
         app.run()
+    return app.exit_code
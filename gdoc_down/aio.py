@@ -0,0 +1,459 @@
+"""
+Asynchronous client which downloads Google documents, presentations, and workbooks without blocking the event loop
+
+The client requires the optional `aiohttp` package (`pip install gdoc_down[async]`), unless an HTTP session is
+provided.
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from .core import GDocDown
+from .manifest import Manifest
+from .output import OutputLock, fsync_directory, fsync_file
+from .retry import RetryPolicy
+from .stub_index import StubIndex
+import asyncio
+import os
+import re
+import tempfile
+
+
+class AsyncGDocDown(object):
+    """ Downloads Google documents, presentations, and workbooks with an asynchronous HTTP client, such as from
+    an `aiohttp` service
+
+    The client follows the same format and path rules as :obj:`GDocDown`, records downloads in the same manifest, and
+    shares the rate limiter of :obj:`GDocDown`. Exports are downloaded in chunks of :obj:`chunk_size` bytes over a pool
+    of keep-alive connections. LaTeX conversion, and blocking disk I/O, such as reading stubs, checking and saving the
+    manifest, and saving files from the store, run in the default executor of the event loop.
+
+    Attributes:
+        credentials (:obj:`oauth2client.client.OAuth2Credentials`): Credentials object for OAuth 2.0.
+        session (:obj:`aiohttp.ClientSession`): HTTP session, or :obj:`None` to create a session on first use
+        max_workers (:obj:`int`): maximum number of files to download concurrently
+        manifest (:obj:`Manifest`): record of the Google Drive version of each downloaded file
+        chunk_size (:obj:`int`): number of bytes to download per request
+        retry_policy (:obj:`RetryPolicy`): policy for retrying requests which fail because of transient errors or
+            rate limits
+        rate_limiter (:obj:`TokenBucket`): rate limiter which each request draws a token from
+        store (:obj:`ExportStore`): store of exports which files are saved from instead of exporting them again, or
+            :obj:`None` to always export files
+        stub_index (:obj:`StubIndex`): index of the id of each stub
+        fsync (:obj:`bool`): if :obj:`True`, flush saved files to disk before they replace the previous versions
+    """
+
+    API_URL = 'https://www.googleapis.com/drive/v3/files'
+
+    def __init__(self, credentials=None, session=None, max_workers=None, manifest_path=None, chunk_size=None,
+                 retry_policy=None, rate_limiter=None, store=None, stub_index_path=None, fsync=False):
+        """
+        Args:
+            credentials (:obj:`oauth2client.client.OAuth2Credentials`, optional): Credentials object for OAuth 2.0.
+            session (:obj:`aiohttp.ClientSession`, optional): HTTP session; if :obj:`None`, a session with a pool of
+                :obj:`max_workers` connections is created on first use and closed by :obj:`close`
+            max_workers (:obj:`int`, optional): maximum number of files to download concurrently
+            manifest_path (:obj:`str`, optional): path to the manifest of downloaded files
+            chunk_size (:obj:`int`, optional): number of bytes to download per request
+            retry_policy (:obj:`RetryPolicy`, optional): policy for retrying failed requests
+            rate_limiter (:obj:`TokenBucket`, optional): rate limiter; defaults to the rate limiter shared by all
+                instances of :obj:`GDocDown` in the process
+            store (:obj:`ExportStore`, optional): store of exports which files are saved from instead of exporting
+                them again
+            stub_index_path (:obj:`str`, optional): path to the index of the ids of stubs
+            fsync (:obj:`bool`, optional): if :obj:`True`, flush saved files to disk before they replace the previous
+                versions, so that they survive crashes, at the cost of throughput
+        """
+        self.credentials = credentials or GDocDown.get_credentials()
+        self.session = session
+        self.max_workers = max_workers or GDocDown.MAX_WORKERS
+        self.manifest = Manifest(manifest_path or GDocDown.MANIFEST_PATH, fsync=fsync)
+        self.chunk_size = chunk_size or GDocDown.CHUNK_SIZE
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter or GDocDown.get_shared_rate_limiter()
+        self.store = store
+        self.stub_index = StubIndex(stub_index_path or GDocDown.STUB_INDEX_PATH, fsync=fsync)
+        self.fsync = fsync
+        self._own_session = session is None
+        self._token_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """ Close the HTTP session if it was created by this client """
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get_session(self):
+        """ Get the HTTP session, creating it if necessary
+
+        Returns:
+            :obj:`aiohttp.ClientSession`: HTTP session
+        """
+        if self.session is None:
+            import aiohttp
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_workers),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30., sock_read=60.))
+        return self.session
+
+    @staticmethod
+    def get_retryable_errors():
+        """ Get the types of connection errors of the HTTP client which should be retried
+
+        Returns:
+            :obj:`tuple` of :obj:`type`: types of errors
+        """
+        errors = (ConnectionError, asyncio.TimeoutError)
+        try:
+            import aiohttp
+        except ImportError:
+            # sessions provided by the caller don't require aiohttp
+            return errors
+        return errors + (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+    async def get_access_token(self, refresh=False):
+        """ Get an OAuth 2.0 access token, refreshing the credentials in the default executor if they have expired
+
+        Args:
+            refresh (:obj:`bool`, optional): if :obj:`True`, refresh the credentials even if they haven't expired,
+                e.g., because Google rejected the access token
+
+        Returns:
+            :obj:`str`: access token
+        """
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if refresh or not self.credentials.access_token or self.credentials.access_token_expired:
+                await asyncio.get_running_loop().run_in_executor(None, self.refresh_credentials)
+            return self.credentials.access_token
+
+    def refresh_credentials(self):
+        """ Refresh the credentials """
+        import httplib2
+        self.credentials.refresh(httplib2.Http())
+
+    async def request(self, url, params=None, headers=None):
+        """ Send a GET request within the rate limit, retrying it according to :obj:`retry_policy`
+
+        Args:
+            url (:obj:`str`): URL
+            params (:obj:`dict`, optional): query parameters
+            headers (:obj:`dict`, optional): HTTP headers
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`int`: HTTP status
+                * :obj:`dict`: HTTP headers of the response
+                * :obj:`bytes`: body of the response
+
+        Raises:
+            :obj:`AsyncHttpError`: if the request fails
+        """
+        async def attempt():
+            token = await self.get_access_token()
+            for refresh in [False, True]:
+                if refresh:
+                    token = await self.get_access_token(refresh=True)
+                request_headers = dict(headers or {}, Authorization='Bearer ' + token)
+                async with self.get_session().get(url, params=params, headers=request_headers) as response:
+                    content = await response.read()
+                    if response.status != 401:
+                        break
+            if response.status >= 300 and response.status != 416:
+                raise AsyncHttpError(response.status, response.headers, content)
+            return (response.status, response.headers, content)
+
+        return await self.retry_policy.call_async(attempt, rate_limiter=self.rate_limiter,
+                                                  retryable_errors=self.get_retryable_errors())
+
+    async def get_metadata(self, google_id):
+        """ Get the modification time and version of a Google document, presentation, or workbook
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+
+        Returns:
+            :obj:`dict`: `modifiedTime` and `version` of the Google document, presentation, or workbook
+        """
+        import json
+        _, _, content = await self.request('{}/{}'.format(self.API_URL, google_id),
+                                           params={'fields': GDocDown.METADATA_FIELDS})
+        return json.loads(content.decode('utf-8'))
+
+    async def export(self, google_id, export_type, file):
+        """ Export a Google document, presentation, or workbook to a file in chunks of :obj:`chunk_size` bytes,
+        retrying chunks which fail according to :obj:`retry_policy`
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            export_type (:obj:`str`): MIME type to export
+            file (:obj:`io.IOBase`): binary file-like object to write the export to
+        """
+        url = '{}/{}/export'.format(self.API_URL, google_id)
+        start = 0
+        while True:
+            status, headers, content = await self.request(url, params={'mimeType': export_type}, headers={
+                'Range': 'bytes={}-{}'.format(start, start + self.chunk_size - 1)})
+            if status == 416:
+                # the export is empty
+                break
+            file.write(content)
+            start += len(content)
+
+            match = re.match(r'^bytes \d+-\d+/(\d+)$', headers.get('content-range', ''))
+            if status != 206 or not content or (match and start >= int(match.group(1))):
+                break
+
+    async def download(self, google_file, format='docx', out_path='.', extension=None, force=False, formats=None):
+        """ Download a Google document, presentation, or workbook (see :obj:`GDocDown.download`)
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): path to save document, presentation, or workbook
+            extension (:obj:`str`, optional): extension to document, presentation, or workbook
+            force (:obj:`bool`, optional): if :obj:`True`, download the file even if the local copy is up to date
+            formats (:obj:`list` of :obj:`str`, optional): several desired output formats, which are used instead
+                of :obj:`format`
+
+        Returns:
+            :obj:`str`: path to the downloaded file, or if :obj:`formats` is specified, :obj:`list` of :obj:`str`:
+                path to the downloaded file for each unique format
+        """
+        try:
+            if formats is None:
+                results = await self._download_formats(google_file, [format], out_path=out_path,
+                                                       extension=extension, force=force)
+                return results[0][0]
+            results = await self._download_formats(google_file, formats, out_path=out_path, extension=extension,
+                                                   force=force)
+            return [out_file for out_file, _ in results]
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, self.save_records)
+
+    async def download_many(self, google_files, format='docx', out_path='.', extension=None, max_workers=None,
+                            force=False):
+        """ Concurrently download several Google documents, presentations, and/or workbooks
+        (see :obj:`GDocDown.download_many`)
+
+        Args:
+            google_files (:obj:`list` of :obj:`str`): paths to Google documents, presentations, and/or workbooks
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): directory to save documents, presentations, and workbooks
+            extension (:obj:`str`, optional): extension to documents, presentations, and workbooks
+            max_workers (:obj:`int`, optional): maximum number of files to download concurrently
+            force (:obj:`bool`, optional): if :obj:`True`, download files even if the local copies are up to date
+
+        Returns:
+            :obj:`list` of :obj:`DownloadResult`: result of each download, in the same order as :obj:`google_files`;
+                duplicate paths are downloaded once
+
+        Raises:
+            obj:`Exception`: if several files are downloaded and the output path isn't a directory
+        """
+        if len(google_files) > 1 and not os.path.isdir(out_path):
+            raise Exception('Output path must be a directory to download multiple files')
+
+        results, pending = GDocDown.plan_jobs([
+            dict(google_file=google_file, format=format, out_path=out_path, extension=extension, force=force)
+            for google_file in google_files])
+
+        semaphore = asyncio.Semaphore(max_workers or self.max_workers)
+
+        async def run_job(job, result):
+            async with semaphore:
+                try:
+                    (_, downloaded), = await self._download_formats(
+                        job['google_file'], [job['format']], out_path=job['out_path'], extension=job['extension'],
+                        force=job['force'])
+                    result.up_to_date = not downloaded
+                except Exception as error:
+                    result.error = error
+                    result.out_file = None
+
+        await asyncio.gather(*[run_job(job, result) for job, result in pending])
+        await asyncio.get_running_loop().run_in_executor(None, self.save_records)
+        return results
+
+    async def _download_formats(self, google_file, formats, out_path='.', extension=None, force=False):
+        """ Download a Google document, presentation, or workbook in one or more formats, skipping the formats whose
+        local copies are up to date, and exporting each MIME type at most once (see :obj:`GDocDown._download_formats`)
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            formats (:obj:`list` of :obj:`str`): desired output formats (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): path to save document, presentation, or workbook
+            extension (:obj:`str`, optional): extension to document, presentation, or workbook
+            force (:obj:`bool`, optional): if :obj:`True`, download the file even if the local copies are up to date
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: for each unique format
+
+                * :obj:`str`: path to the downloaded file
+                * :obj:`bool`: :obj:`True` if the file was exported, :obj:`False` if the local copy was up to date
+        """
+        formats = list(dict.fromkeys(formats))
+        if len(formats) > 1 and not os.path.isdir(out_path):
+            raise Exception('Output path must be a directory to download multiple formats')
+        if len(formats) > 1 and extension is not None:
+            raise Exception('Extension cannot be specified to download multiple formats')
+
+        output_formats = {format: GDocDown.get_format(google_file, format) for format in formats}
+        for output_format in output_formats.values():
+            if output_format.exporter is not None:
+                raise Exception('Format "{}" can only be downloaded with GDocDown'.format(output_format.name))
+        out_files = [GDocDown.get_out_file(google_file, format=format, out_path=out_path, extension=extension)
+                     for format in formats]
+        loop = asyncio.get_running_loop()
+        google_id = await loop.run_in_executor(None, self.stub_index.get_google_id, google_file)
+        metadata = await self.get_metadata(google_id)
+
+        saved_formats = set()
+        export_formats = {}
+        for format, out_file in zip(formats, out_files):
+            if force or not await loop.run_in_executor(None, self.manifest.is_current,
+                                                       google_id, format, out_file, metadata):
+                saved_formats.add(format)
+                if force or not await loop.run_in_executor(None, self.materialize,
+                                                           google_id, format, metadata, out_file):
+                    export_formats.setdefault(output_formats[format].export_type, []).append((format, out_file))
+
+        for export_type, format_out_files in export_formats.items():
+            if len(format_out_files) == 1 and output_formats[format_out_files[0][0]].converter is None \
+                    and self.store is None:
+                # stream file from Google into the output file
+                format, out_file = format_out_files[0]
+                await self.export_atomically(google_id, output_formats[format], out_file)
+                await loop.run_in_executor(None, self.manifest.set, google_id, format, out_file, metadata)
+            else:
+                # export the file once, then derive each format from the export in the default executor
+                with tempfile.TemporaryFile() as payload:
+                    await self.export(google_id, export_type, payload)
+                    for format, out_file in format_out_files:
+                        payload.seek(0)
+                        await loop.run_in_executor(None, self.save, google_id, format, metadata, out_file,
+                                                   lambda file: output_formats[format].convert(payload, file))
+
+        return [(out_file, format in saved_formats) for format, out_file in zip(formats, out_files)]
+
+    async def export_atomically(self, google_id, format, out_file):
+        """ Stream the export of a Google document, presentation, or workbook into a temporary file next to the output
+        file, and then atomically replace the output file in the default executor, serializing the replacement with
+        other writes to the output file with an :obj:`OutputLock`
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`Format`): output format
+            out_file (:obj:`str`): path to save the file
+        """
+        tmp_file = GDocDown.get_temp_path(out_file)
+        try:
+            with open(tmp_file, 'xb') as file:
+                if format.writer is not None:
+                    writer = format.writer(file)
+                    await self.export(google_id, format.export_type, writer)
+                    writer.flush()
+                else:
+                    await self.export(google_id, format.export_type, file)
+                if self.fsync:
+                    fsync_file(file)
+            await asyncio.get_running_loop().run_in_executor(None, self.replace, tmp_file, out_file)
+        except BaseException:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    def replace(self, tmp_file, out_file):
+        """ Atomically replace an output file with a temporary file
+
+        Args:
+            tmp_file (:obj:`str`): path to the temporary file
+            out_file (:obj:`str`): path to the output file
+        """
+        with OutputLock(out_file):
+            os.replace(tmp_file, out_file)
+        if self.fsync:
+            fsync_directory(os.path.dirname(out_file))
+
+    def materialize(self, google_id, format, metadata, out_file):
+        """ Save a version of a Google document, presentation, or workbook in a format from :obj:`store`, if it is in
+        the store, and record it in :obj:`manifest`
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+            out_file (:obj:`str`): path to save the file
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the file was saved from the store
+        """
+        if self.store is None or not self.store.materialize(google_id, format, metadata, out_file):
+            return False
+        self.manifest.set(google_id, format, out_file, metadata)
+        return True
+
+    def save_records(self):
+        """ Save :obj:`stub_index` and :obj:`manifest` """
+        self.stub_index.save()
+        self.manifest.save()
+
+    def save(self, google_id, format, metadata, out_file, write):
+        """ Save a version of a Google document, presentation, or workbook in a format, add it to :obj:`store`, and
+        record it in :obj:`manifest`
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+            out_file (:obj:`str`): path to save the file
+            write (:obj:`callable`): function which writes the content of the file to a binary file object
+        """
+        if self.store is None:
+            GDocDown.write_atomically(out_file, write, fsync=self.fsync)
+        else:
+            self.store.link(self.store.put(google_id, format, metadata, write), out_file)
+        self.manifest.set(google_id, format, out_file, metadata)
+
+
+class AsyncHttpError(Exception):
+    """ Error response of the Google Drive API to a request of :obj:`AsyncGDocDown`
+
+    The attributes mirror those of :obj:`googleapiclient.errors.HttpError` so that :obj:`RetryPolicy` can classify
+    both.
+
+    Attributes:
+        resp (:obj:`dict`): HTTP headers of the response, with its status as the `status` attribute
+        content (:obj:`bytes`): body of the response
+    """
+
+    def __init__(self, status, headers, content):
+        """
+        Args:
+            status (:obj:`int`): HTTP status
+            headers (:obj:`dict`): HTTP headers
+            content (:obj:`bytes`): body of the response
+        """
+        self.resp = ResponseHeaders((key.lower(), value) for key, value in headers.items())
+        self.resp.status = status
+        self.content = content
+        super(AsyncHttpError, self).__init__('HTTP {}: {}'.format(status, content.decode('utf-8', 'replace')))
+
+
+class ResponseHeaders(dict):
+    """ HTTP headers of a response, with lower case names
+
+    Attributes:
+        status (:obj:`int`): HTTP status
+    """
+    status = None
@@ -7,17 +7,25 @@ Save the content of a Google document, presentation, or workbook to a local file
 :License: MIT
 """
 
-from bs4 import BeautifulSoup
-from xml.etree import ElementTree
-import apiclient
-import argparse
+from .manifest import Manifest
+from .metrics import Metrics
+from .output import OutputLock, get_temp_path, write_atomically
+from .retry import RetryPolicy, TokenBucket
+from .stub_index import StubIndex
+from .transport import HttpPool
+import contextlib
+import html.entities
+import html.parser
 import io
 import json
 import re
-import oauth2client.file
-import oauth2client.tools
 import os
-import zipfile
+import shutil
+import tempfile
+import threading
+
+# the Google API client libraries, :obj:`concurrent.futures`, and :obj:`zipfile` are imported by the methods
+# which use them so that the command line program starts quickly
 
 
 class GDocDown(object):
@@ -48,9 +56,33 @@ class GDocDown(object):
     The first time the program is called, the program will request access to the user's Google
     account. This will create a client.json file.
 
+    Multiple files can be downloaded concurrently with :obj:`download_many`. Files are only exported again if
+    they have changed in Google Drive since they were last downloaded (see :obj:`Manifest`).
+
     Attributes:
         credentials (:obj:`oauth2client.client.OAuth2Credentials`): Credentials object for OAuth 2.0.
         service (:obj:`apiclient.discovery.Resource`): A Resource object with methods for interacting with the service
+        sheets_service (:obj:`apiclient.discovery.Resource`): Google Sheets service which is used to list the sheets
+            of workbooks, or :obj:`None` if it hasn't been built yet
+        max_workers (:obj:`int`): maximum number of files to download concurrently
+        manifest (:obj:`Manifest`): record of the Google Drive version of each downloaded file
+        chunk_size (:obj:`int`): number of bytes to download per request
+        static_discovery (:obj:`bool`): if :obj:`True`, build the service from the discovery document bundled with
+            the Google API client
+        retry_policy (:obj:`RetryPolicy`): policy for retrying requests which fail because of transient errors or
+            rate limits; its `retries` attribute counts the retried requests
+        rate_limiter (:obj:`TokenBucket`): rate limiter which each request draws a token from; its `throttled` and
+            `throttled_time` attributes count the requests which were delayed to stay within the rate limit
+        store (:obj:`ExportStore`): store of exports which files are saved from instead of exporting them again, or
+            :obj:`None` to always export files
+        stub_index (:obj:`StubIndex`): index of the id of each stub, which stubs are only read again when they
+            change
+        fsync (:obj:`bool`): if :obj:`True`, flush saved files to disk before they replace the previous versions
+        metrics (:obj:`Metrics`): recorder of the duration of each phase of each download, such as exporting and
+            converting files
+        http_pool (:obj:`HttpPool`): pool of the HTTP transports of the threads which use the instance, or
+            :obj:`None` if the instance uses the transport of a service which was passed to it
+        convert_workers (:obj:`int`): number of processes to run the CPU-bound conversions of batches on
     """
 
     APPLICATION_NAME = 'gdoc_down'
@@ -59,6 +91,39 @@ class GDocDown(object):
 
     CREDENTIAL_PATH = os.path.join(os.path.expanduser('~'), '.gdoc_down', 'auth.json')
 
+    MANIFEST_PATH = os.path.join(os.path.expanduser('~'), '.gdoc_down', 'manifest.json')
+
+    STUB_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.gdoc_down', 'stubs.json')
+
+    METADATA_FIELDS = 'modifiedTime,version'
+
+    # reason of the errors of exports of files which are larger than the Drive API can export
+    EXPORT_SIZE_LIMIT_REASON = 'exportSizeLimitExceeded'
+
+    # version of each Google API which is used
+    API_VERSIONS = {
+        'drive': 'v3',
+        'sheets': 'v4',
+    }
+
+    SHEET_FIELDS = 'sheets.properties(sheetId,title,index)'
+
+    # URL of the export of one sheet of a workbook, which the Drive API can't export
+    SHEET_EXPORT_URL = 'https://docs.google.com/spreadsheets/d/{}/export?format={}&gid={}'
+
+    # formats of the export URL of each MIME type which sheets can be exported to
+    SHEET_EXPORT_FORMATS = {
+        'text/csv': 'csv',
+        'text/tab-separated-values': 'tsv',
+    }
+
+    # maximum number of metadata requests per batch request, which is the limit of the Google Drive API
+    METADATA_BATCH_SIZE = 100
+
+    DISCOVERY_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.gdoc_down', 'discovery')
+
+    DISCOVERY_CACHE_TTL = 24 * 60 * 60.
+
     SCOPES = (
         'https://www.googleapis.com/auth/drive',
         'https://www.googleapis.com/auth/drive.file',
@@ -66,141 +131,1216 @@ class GDocDown(object):
         'https://www.googleapis.com/auth/drive.readonly',
     )
 
-    def __init__(self, credentials=None, service=None):
+    MAX_WORKERS = 8
+
+    # registry of the output formats of each type of Google document, presentation, and workbook, keyed by the
+    # extension of the stub and the name of the format (see :obj:`register_format`)
+    FORMATS = {}
+
+    # default output format of each type of Google Drive stub for :obj:`sync`
+    FORMAT_MAP = {
+        '.gdoc': ['docx'],
+        '.gsheet': ['xlsx'],
+        '.gslides': ['pptx'],
+    }
+
+    SYNC_STATE_FILENAME = '.gdoc_down_sync.json'
+
+    # number of changes to list per request of an incremental sync
+    CHANGES_PAGE_SIZE = 1000
+
+    CHUNK_SIZE = 10 * 1024 * 1024
+
+    # default number of requests per second and burst size of the rate limiter shared by all instances, which keeps
+    # the requests of concurrent downloads within the Google Drive quota
+    RATE_LIMIT = 50.
+    RATE_LIMIT_BURST = 100.
+
+    _rate_limiter = None
+
+    # number of seconds before the user's token expires to refresh it
+    TOKEN_REFRESH_MARGIN = 5 * 60.
+
+    # credentials shared by all instances and their refreshers, keyed by the path of the stored credentials
+    _credentials = {}
+    _credentials_lock = threading.Lock()
+
+    # services shared by all instances, keyed by the id of their credentials and the discovery mode
+    _services = {}
+    _services_lock = threading.Lock()
+
+    def __init__(self, credentials=None, service=None, max_workers=None, manifest_path=None, chunk_size=None,
+                 static_discovery=False, retry_policy=None, rate_limiter=None, store=None, stub_index_path=None,
+                 fsync=False, metrics=None, http_pool_size=None, http_timeout=None, http_keep_alive=None,
+                 sheets_service=None, convert_workers=None):
         """
         Arguments:
             credentials (:obj:`oauth2client.client.OAuth2Credentials`, optional): Credentials object for OAuth 2.0.
             service (:obj:`apiclient.discovery.Resource`, optional): A Resource object with methods for interacting with the service
+            max_workers (:obj:`int`, optional): maximum number of files to download concurrently
+            manifest_path (:obj:`str`, optional): path to the manifest of downloaded files
+            chunk_size (:obj:`int`, optional): number of bytes to download per request
+            static_discovery (:obj:`bool`, optional): if :obj:`True`, build the service from the discovery
+                document bundled with the Google API client rather than the latest discovery document
+            retry_policy (:obj:`RetryPolicy`, optional): policy for retrying failed requests
+            rate_limiter (:obj:`TokenBucket`, optional): rate limiter; defaults to a rate limiter shared by all
+                instances in the process
+            store (:obj:`ExportStore`, optional): store of exports which files are saved from instead of exporting
+                them again, e.g., a store shared by several checkout directories
+            stub_index_path (:obj:`str`, optional): path to the index of the ids of stubs
+            fsync (:obj:`bool`, optional): if :obj:`True`, flush saved files to disk before they replace the previous
+                versions, so that they survive crashes, at the cost of throughput
+            metrics (:obj:`Metrics`, optional): recorder of the duration of each phase of each download; defaults to
+                not recording phases
+            http_pool_size (:obj:`int`, optional): maximum number of idle HTTP transports to keep for reuse; defaults
+                to :obj:`max_workers`
+            http_timeout (:obj:`float`, optional): timeout in seconds of each socket operation of the HTTP transports
+            http_keep_alive (:obj:`float`, optional): number of seconds to keep idle connections open
+            sheets_service (:obj:`apiclient.discovery.Resource`, optional): Google Sheets service; defaults to a
+                service which is built when it is first used
+            convert_workers (:obj:`int`, optional): number of processes to run the CPU-bound conversions of
+                :obj:`download_many` and :obj:`sync` on; defaults to the number of CPUs; `0` runs conversions on the
+                download threads. The processes are started by the first batch which needs them, and are reused by
+                later batches until :obj:`close` is called.
         """
+        self.metrics = metrics or Metrics(enabled=False)
+        self.static_discovery = static_discovery
+
         if credentials is None:
-            credentials = self.get_credentials()
+            with self.metrics.phase('get_credentials'):
+                credentials = self.get_credentials()
 
+        # :obj:`httplib2.Http` isn't thread-safe; if the service is built here, give each thread its own transport
+        # from a pool
+        self.max_workers = max_workers or self.MAX_WORKERS
         if service is None:
-            service = self.authenticate(credentials)
+            with self.metrics.phase('authenticate'):
+                service = self.authenticate(credentials)
+            self.http_pool = HttpPool(credentials, size=http_pool_size or self.max_workers, timeout=http_timeout,
+                                      keep_alive=http_keep_alive)
+        else:
+            self.http_pool = None
 
         self.credentials = credentials
         self.service = service
+        self.sheets_service = sheets_service
+        self.manifest = Manifest(manifest_path or self.MANIFEST_PATH, fsync=fsync)
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter or self.get_shared_rate_limiter()
+        self.store = store
+        self.stub_index = StubIndex(stub_index_path or self.STUB_INDEX_PATH, fsync=fsync)
+        self.fsync = fsync
+        self.convert_workers = (os.cpu_count() or 1) if convert_workers is None else convert_workers
+        self._convert_executor = None
+        self._convert_executor_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Stop the processes which run CPU-bound conversions, and close the idle connections to Google Drive """
+        with self._convert_executor_lock:
+            convert_executor, self._convert_executor = self._convert_executor, None
+        if convert_executor is not None:
+            convert_executor.shutdown()
+        if self.http_pool is not None:
+            self.http_pool.close()
 
-    def get_credentials(self):
+    @classmethod
+    def get_shared_rate_limiter(cls):
+        """ Get the rate limiter shared by all instances in the process
+
+        Returns:
+            :obj:`TokenBucket`: rate limiter
+        """
+        with cls._services_lock:
+            if GDocDown._rate_limiter is None:
+                GDocDown._rate_limiter = TokenBucket(cls.RATE_LIMIT, cls.RATE_LIMIT_BURST)
+            return GDocDown._rate_limiter
+
+    @classmethod
+    def get_credentials(cls):
         """ Get and save user credentials from Google. If credentials haven't already been
         stored, or if the stored credentials are invalid, obtain the new credentials.
 
+        The credentials are shared by all instances in the process, and are refreshed in the background
+        :obj:`TOKEN_REFRESH_MARGIN` seconds before their token expires (see :obj:`TokenRefresher`). The stored
+        credentials are shared by processes, which refresh them under a lock, so that when several processes need
+        a new token, only one process requests it (see :obj:`TokenStorage`).
+
         Retuns:
             :obj:`oauth2client.client.OAuth2Credentials`: Credentials object for OAuth 2.0.
         """
-        if not os.path.isdir(os.path.dirname(self.CREDENTIAL_PATH)):
-            os.makedirs(os.path.dirname(self.CREDENTIAL_PATH))
-        store = oauth2client.file.Storage(self.CREDENTIAL_PATH)
-        credentials = store.get()
-        if not credentials or credentials.invalid:
-            flow = oauth2client.client.flow_from_clientsecrets(self.CLIENT_SECRET_PATH, self.SCOPES)
-            flow.user_agent = self.APPLICATION_NAME
-            parser = argparse.ArgumentParser(
-                description=__doc__,
-                formatter_class=argparse.RawDescriptionHelpFormatter,
-                parents=[oauth2client.tools.argparser])
-            flags = parser.parse_args([])
-            credentials = oauth2client.tools.run_flow(flow, store, flags)
+        from .token_cache import TokenRefresher, TokenStorage
+
+        with cls._credentials_lock:
+            credentials, _ = cls._credentials.get(cls.CREDENTIAL_PATH, (None, None))
+            if credentials is not None and not credentials.invalid:
+                return credentials
+
+            if not os.path.isdir(os.path.dirname(cls.CREDENTIAL_PATH)):
+                os.makedirs(os.path.dirname(cls.CREDENTIAL_PATH))
+            store = TokenStorage(cls.CREDENTIAL_PATH)
+            credentials = store.get()
+            if not credentials or credentials.invalid:
+                import argparse
+                import oauth2client.client
+                import oauth2client.tools
+
+                flow = oauth2client.client.flow_from_clientsecrets(cls.CLIENT_SECRET_PATH, cls.SCOPES)
+                flow.user_agent = cls.APPLICATION_NAME
+                parser = argparse.ArgumentParser(
+                    description=__doc__,
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    parents=[oauth2client.tools.argparser])
+                flags = parser.parse_args([])
+                credentials = oauth2client.tools.run_flow(flow, store, flags)
+
+            _, refresher = cls._credentials.get(cls.CREDENTIAL_PATH, (None, None))
+            if refresher is not None:
+                refresher.stop()
+            refresher = TokenRefresher(credentials, margin=cls.TOKEN_REFRESH_MARGIN).start()
+            cls._credentials[cls.CREDENTIAL_PATH] = (credentials, refresher)
 
         return credentials
 
-    def authenticate(self, credentials):
+    def authenticate(self, credentials, api='drive'):
         """ Authenticate with Google server
 
+        The service is shared by all instances in the process which use the same credentials.
+
+        Args:
+            credentials (:obj:`oauth2client.client.OAuth2Credentials`): Credentials object for OAuth 2.0.
+            api (:obj:`str`, optional): name of the API (`drive` or `sheets`)
+
         Returns:
             :obj:`apiclient.discovery.Resource`: A Resource object with methods for interacting with the service
         """
-        return apiclient.discovery.build('drive', 'v3', credentials=credentials)
+        key = (id(credentials), self.static_discovery, api)
+        with self._services_lock:
+            cached_credentials, service = self._services.get(key, (None, None))
+            if cached_credentials is not credentials:
+                service = self.build_service(credentials, api=api)
+                self._services[key] = (credentials, service)
+        return service
 
-    def download(self, google_file, format='docx', out_path='.', extension=None):
+    def build_service(self, credentials, api='drive'):
+        """ Build a service from the latest discovery document, which is cached in :obj:`DISCOVERY_CACHE_DIR` for
+        :obj:`DISCOVERY_CACHE_TTL` seconds, or from the discovery document bundled with the Google API client if
+        :obj:`static_discovery` is :obj:`True`
+
+        If the latest discovery document can't be retrieved, e.g., because the discovery service is unavailable, the
+        service is built from the expired cached discovery document, or if none is cached, from the bundled document.
+
+        Args:
+            credentials (:obj:`oauth2client.client.OAuth2Credentials`): Credentials object for OAuth 2.0.
+            api (:obj:`str`, optional): name of the API (`drive` or `sheets`)
+
+        Returns:
+            :obj:`apiclient.discovery.Resource`: A Resource object with methods for interacting with the service
+        """
+        from .discovery_cache import DiscoveryCache
+        import apiclient.discovery
+        import googleapiclient.errors
+        import httplib2
+
+        version = self.API_VERSIONS[api]
+        if self.static_discovery:
+            return apiclient.discovery.build(api, version, credentials=credentials,
+                                             cache_discovery=False, static_discovery=True)
+
+        try:
+            return apiclient.discovery.build(api, version, credentials=credentials,
+                                             cache=DiscoveryCache(self.DISCOVERY_CACHE_DIR, self.DISCOVERY_CACHE_TTL),
+                                             static_discovery=False)
+        except (httplib2.HttpLib2Error, googleapiclient.errors.HttpError, OSError):
+            pass
+
+        # the client reads the expired document from the cache if it is cached, and otherwise the bundled document
+        return apiclient.discovery.build(api, version, credentials=credentials,
+                                         cache=DiscoveryCache(self.DISCOVERY_CACHE_DIR, None), static_discovery=True)
+
+    def get_sheets_service(self):
+        """ Get the Google Sheets service, building it if it hasn't been built yet
+
+        Returns:
+            :obj:`apiclient.discovery.Resource`: Google Sheets service
+        """
+        if self.sheets_service is None:
+            self.sheets_service = self.authenticate(self.credentials, api='sheets')
+        return self.sheets_service
+
+    def get_http(self):
+        """ Get the authorized HTTP transport of the current thread from :obj:`http_pool`
+
+        Returns:
+            :obj:`httplib2.Http`: authorized HTTP transport, or :obj:`None` to use the transport of :obj:`service`
+        """
+        if self.http_pool is None:
+            return None
+        return self.http_pool.get()
+
+    def get_metadata(self, google_id):
+        """ Get the modification time and version of a Google document, presentation, or workbook
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+
+        Returns:
+            :obj:`dict`: `modifiedTime` and `version` of the Google document, presentation, or workbook
+        """
+        return self.execute(self.service.files().get(fileId=google_id, fields=self.METADATA_FIELDS))
+
+    def get_metadata_many(self, google_ids):
+        """ Get the modification times and versions of several Google documents, presentations, and workbooks with
+        batch requests of up to :obj:`METADATA_BATCH_SIZE` requests each
+
+        Files whose metadata couldn't be retrieved, e.g., because they don't exist, are omitted, so that the errors
+        can be reported by :obj:`get_metadata`.
+
+        Args:
+            google_ids (:obj:`list` of :obj:`str`): ids of Google documents, presentations, and workbooks
+
+        Returns:
+            :obj:`dict`: dictionary which maps the id of each file to its `modifiedTime` and `version`
+        """
+        google_ids = list(dict.fromkeys(google_ids))
+        metadata = {}
+
+        def callback(request_id, response, error):
+            if error is None:
+                metadata[google_ids[int(request_id)]] = response
+
+        for i_start in range(0, len(google_ids), self.METADATA_BATCH_SIZE):
+            batch_ids = google_ids[i_start:i_start + self.METADATA_BATCH_SIZE]
+            batch = self.service.new_batch_http_request(callback=callback)
+            for i_id, google_id in enumerate(batch_ids):
+                batch.add(self.service.files().get(fileId=google_id, fields=self.METADATA_FIELDS),
+                          request_id=str(i_start + i_id))
+            try:
+                self.retry_policy.call(lambda: batch.execute(http=self.get_http()), rate_limiter=self.rate_limiter,
+                                       tokens=len(batch_ids))
+            except Exception:
+                # leave the metadata of the batch to be requested file by file
+                pass
+
+        return metadata
+
+    def execute(self, request):
+        """ Execute a Google API request within the rate limit, retrying it according to :obj:`retry_policy`
+
+        Args:
+            request (:obj:`apiclient.http.HttpRequest`): request
+
+        Returns:
+            :obj:`object`: response
+        """
+        return self.retry_policy.call(lambda: request.execute(http=self.get_http()), rate_limiter=self.rate_limiter)
+
+    def download(self, google_file, format='docx', out_path='.', extension=None, force=False, formats=None):
         """
         Args:
             google_file (:obj:`str`): path to Google document, presentation, or workbook
             format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
             out_path (:obj:`str`, optional): path to save document, presentation, or workbook
             extension (:obj:`str`, optional): extension to document, presentation, or workbook
+            force (:obj:`bool`, optional): if :obj:`True`, download the file even if the local copy is up to date
+            formats (:obj:`list` of :obj:`str`, optional): several desired output formats, which are used instead
+                of :obj:`format`. Each MIME type is exported once, and each format is derived from the export of
+                its MIME type (e.g., `tex` and `html.zip` are both derived from one export of the HTML bundle).
+
+        Returns:
+            :obj:`str`: path to the downloaded file, or if :obj:`formats` is specified, :obj:`list` of :obj:`str`:
+                path to the downloaded file for each unique format
 
         Raises:
             obj:`Exception`: if format unknown or if ouput file path and extension cannot both be specified
         """
+        try:
+            if formats is None:
+                return self._download(google_file, format=format, out_path=out_path, extension=extension,
+                                      force=force)[0]
+            results = self._download_formats(google_file, formats, out_path=out_path, extension=extension, force=force)
+            return [out_file for out_file, _ in results]
+        finally:
+            self.stub_index.save()
+            self.manifest.save()
 
-        _, google_file_ext = os.path.splitext(google_file)
-        if google_file_ext == '.gdoc':
-            if format == 'docx':
-                export_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            elif format == 'epub':
-                export_type = 'application/epub+zip'
-            elif format == 'html':
-                export_type = 'text/html'
-            elif format == 'odt':
-                export_type = 'application/vnd.oasis.opendocument.text'
-            elif format == 'pdf':
-                export_type = 'application/pdf'
-            elif format == 'rtf':
-                export_type = 'application/rtf'
-            elif format == 'tex':
-                export_type = 'application/zip'
-            elif format == 'txt':
-                export_type = 'text/plain'
-            elif format == 'html.zip':
-                export_type = 'application/zip'
-            else:
-                raise Exception('Unknown format "{}"'.format(format))
-        elif google_file_ext == '.gsheet':
-            if format == 'csv':
-                export_type = 'text/csv'
-            elif format == 'html.zip':
-                export_type = 'application/zip'
-            elif format == 'ods':
-                export_type = 'application/x-vnd.oasis.opendocument.spreadsheet'
-            elif format == 'pdf':
-                export_type = 'application/pdf'
-            elif format == 'tsv':
-                export_type = 'text/tab-separated-values'
-            elif format == 'xlsx':
-                export_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            else:
-                raise Exception('Unknown format "{}"'.format(format))
-        elif google_file_ext == '.gslides':
-            if format == 'odp':
-                export_type = 'application/vnd.oasis.opendocument.presentation'
-            elif format == 'pdf':
-                export_type = 'application/pdf'
-            elif format == 'pptx':
-                export_type = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
-            elif format == 'txt':
-                export_type = 'text/plain'
+    def _download(self, google_file, format='docx', out_path='.', extension=None, force=False, metadata=None,
+                  convert_executor=None):
+        """ Download a Google document, presentation, or workbook unless the local copy is up to date
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): path to save document, presentation, or workbook
+            extension (:obj:`str`, optional): extension to document, presentation, or workbook
+            force (:obj:`bool`, optional): if :obj:`True`, download the file even if the local copy is up to date
+            metadata (:obj:`dict`, optional): metadata of the file, e.g., from :obj:`get_metadata_many`; if
+                :obj:`None`, the metadata is requested
+            convert_executor (:obj:`concurrent.futures.ProcessPoolExecutor`, optional): pool of processes to run
+                CPU-bound conversions on
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`str`: path to the downloaded file
+                * :obj:`bool`: :obj:`True` if the file was exported, :obj:`False` if the local copy was up to date
+        """
+        return self._download_formats(google_file, [format], out_path=out_path, extension=extension, force=force,
+                                      metadata=metadata, convert_executor=convert_executor)[0]
+
+    def _download_formats(self, google_file, formats, out_path='.', extension=None, force=False, metadata=None,
+                          convert_executor=None):
+        """ Download a Google document, presentation, or workbook in one or more formats, skipping the formats whose
+        local copies are up to date, and exporting each MIME type at most once
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            formats (:obj:`list` of :obj:`str`): desired output formats (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): path to save document, presentation, or workbook
+            extension (:obj:`str`, optional): extension to document, presentation, or workbook
+            force (:obj:`bool`, optional): if :obj:`True`, download the file even if the local copies are up to date
+            metadata (:obj:`dict`, optional): metadata of the file, e.g., from :obj:`get_metadata_many`; if
+                :obj:`None`, the metadata is requested
+            convert_executor (:obj:`concurrent.futures.ProcessPoolExecutor`, optional): pool of processes to run
+                CPU-bound conversions on; if :obj:`None`, conversions run on the calling thread
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: for each unique format
+
+                * :obj:`str`: path to the downloaded file
+                * :obj:`bool`: :obj:`True` if the file was exported, :obj:`False` if the local copy was up to date
+
+        Raises:
+            obj:`Exception`: if a format is unknown, if several formats are downloaded and the output path isn't a
+                directory or an extension is specified, or if ouput file path and extension cannot both be specified
+        """
+        with self.metrics.phase('download', google_file=google_file, formats=formats) as record:
+            formats = list(dict.fromkeys(formats))
+            if len(formats) > 1 and not os.path.isdir(out_path):
+                raise Exception('Output path must be a directory to download multiple formats')
+            if len(formats) > 1 and extension is not None:
+                raise Exception('Extension cannot be specified to download multiple formats')
+
+            output_formats = {format: self.get_format(google_file, format) for format in formats}
+            out_files = [self.get_out_file(google_file, format=format, out_path=out_path, extension=extension)
+                         for format in formats]
+
+            # get google document id
+            with self.metrics.phase('stub', google_file=google_file):
+                google_id = self.stub_index.get_google_id(google_file)
+            record['google_id'] = google_id
+
+            # skip files which haven't changed since they were last downloaded
+            if metadata is None:
+                with self.metrics.phase('metadata', google_id=google_id):
+                    metadata = self.get_metadata(google_id)
+            saved_formats = set()
+            export_formats = {}
+            exporter_formats = []
+            for format, out_file in zip(formats, out_files):
+                if force or not self.manifest.is_current(google_id, format, out_file, metadata):
+                    saved_formats.add(format)
+
+                    # save files which were already exported, e.g., into another directory, from the store
+                    if not force and self.store is not None \
+                            and self.store.materialize(google_id, format, metadata, out_file):
+                        self.manifest.set(google_id, format, out_file, metadata)
+                    elif output_formats[format].exporter is not None:
+                        exporter_formats.append((format, out_file))
+                    else:
+                        export_formats.setdefault(output_formats[format].export_type, []).append((format, out_file))
+
+            for format, out_file in exporter_formats:
+                # export the format with several requests, e.g., one request per sheet
+                self.save(google_id, format, metadata, out_file,
+                          lambda file: output_formats[format].exporter(self, google_id, output_formats[format], file))
+
+            for export_type, format_out_files in export_formats.items():
+                if len(format_out_files) == 1 and output_formats[format_out_files[0][0]].converter is None:
+                    # stream file from Google into the output file
+                    format, out_file = format_out_files[0]
+                    self.save(google_id, format, metadata, out_file,
+                              lambda file: self.export_format(google_id, output_formats[format], file))
+                else:
+                    # export the file once, then derive each format from the export; the export is saved to a named
+                    # file if worker processes will read it
+                    if convert_executor is not None \
+                            and any(output_formats[format].cpu_bound for format, _ in format_out_files):
+                        payload_file = self.named_temporary_file()
+                    else:
+                        payload_file = tempfile.TemporaryFile()
+                    with payload_file as payload:
+                        self.export(google_id, export_type, payload)
+                        for format, out_file in format_out_files:
+                            payload.seek(0)
+                            self.save(google_id, format, metadata, out_file,
+                                      lambda file: self.convert(google_id, output_formats[format], payload, file,
+                                                                executor=convert_executor))
+
+            record['exported'] = sorted(saved_formats)
+            return [(out_file, format in saved_formats) for format, out_file in zip(formats, out_files)]
+
+    def save(self, google_id, format, metadata, out_file, write):
+        """ Save a version of a Google document, presentation, or workbook in a format, add it to :obj:`store`, and
+        record it in :obj:`manifest`
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+            out_file (:obj:`str`): path to save the file
+            write (:obj:`callable`): function which writes the content of the file to a binary file object
+        """
+        with self.metrics.phase('save', google_id=google_id, format=format, out_file=out_file) as record:
+            if self.store is None:
+                self.write_atomically(out_file, write, fsync=self.fsync)
             else:
-                raise Exception('Unknown format "{}"'.format(format))
+                self.store.link(self.store.put(google_id, format, metadata, write), out_file)
+            self.manifest.set(google_id, format, out_file, metadata)
+            if self.metrics.enabled:
+                record['bytes'] = os.path.getsize(out_file)
+
+    def convert(self, google_id, format, payload, file, executor=None):
+        """ Derive a format of a Google document, presentation, or workbook from its export
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`Format`): output format
+            payload (:obj:`io.IOBase`): seekable binary file object which contains the export
+            file (:obj:`io.IOBase`): binary file object to write the output to
+            executor (:obj:`concurrent.futures.ProcessPoolExecutor`, optional): pool of processes to run the
+                conversion on if the format is CPU-bound and the export is saved in a named file; the worker reads the
+                export from its file and writes the output to a temporary file, so that neither is sent through the
+                pipes of the pool
+        """
+        with self.metrics.phase('convert', google_id=google_id, format=format.name) as record:
+            if executor is None or not format.cpu_bound or not isinstance(getattr(payload, 'name', None), str):
+                format.convert(payload, file)
+                return
+
+            record['process'] = True
+            payload.flush()
+            with self.named_temporary_file() as output:
+                executor.submit(self.convert_file, format, payload.name, output.name).result()
+                shutil.copyfileobj(output, file)
+
+    @staticmethod
+    def convert_file(format, payload_filename, out_filename):
+        """ Derive a format from an export saved in a file, e.g., in a worker process
+
+        Args:
+            format (:obj:`Format`): output format
+            payload_filename (:obj:`str`): path to the export
+            out_filename (:obj:`str`): path to write the output to
+        """
+        with open(payload_filename, 'rb') as payload:
+            with open(out_filename, 'wb') as file:
+                format.convert(payload, file)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def named_temporary_file():
+        """ Create a temporary file which other processes can open by its name, including on Windows, where
+        :obj:`tempfile.NamedTemporaryFile` can't be opened again while it is open
+
+        Yields:
+            :obj:`io.BufferedRandom`: binary file object opened for reading and writing
+        """
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            with open(filename, 'w+b') as file:
+                yield file
+        finally:
+            os.remove(filename)
+
+    def get_convert_executor(self):
+        """ Get the pool of :obj:`convert_workers` processes to run CPU-bound conversions on, starting it if it hasn't
+        been started yet
+
+        The pool is shared by all of the batches of downloads of this downloader, e.g., by all of the requests of a
+        server, and is stopped by :obj:`close`. On platforms which support it, the workers are forked from a
+        single-threaded server process, rather than from this process, whose download threads could hold locks when
+        they are forked.
+
+        Returns:
+            :obj:`concurrent.futures.ProcessPoolExecutor`: pool of processes
+        """
+        with self._convert_executor_lock:
+            if self._convert_executor is None:
+                import concurrent.futures
+                import multiprocessing
+
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                else:
+                    context = multiprocessing.get_context()
+                self._convert_executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.convert_workers,
+                                                                                mp_context=context)
+            return self._convert_executor
+
+    @classmethod
+    def register_format(cls, format):
+        """ Register an output format of a type of Google document, presentation, or workbook, e.g., to add a format
+        or to replace the post-processor of a built-in format
+
+        Args:
+            format (:obj:`Format`): format
+        """
+        cls.FORMATS[(format.stub_type, format.name)] = format
+
+    @classmethod
+    def get_format(cls, google_file, format='docx'):
+        """ Get an output format of a Google document, presentation, or workbook
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+
+        Returns:
+            :obj:`Format`: format
+
+        Raises:
+            obj:`Exception`: if the format or the type of the Google document, presentation, or workbook is unknown
+        """
+        _, google_file_ext = os.path.splitext(google_file)
+        registered_format = cls.FORMATS.get((google_file_ext, format), None)
+        if registered_format is not None:
+            return registered_format
+        if any(stub_type == google_file_ext for stub_type, _ in cls.FORMATS):
+            raise Exception('Unknown format "{}"'.format(format))
+        raise Exception('Unknown Google document extension "{}"'.format(google_file_ext))
+
+    @classmethod
+    def get_formats(cls):
+        """ Get the registered output formats
+
+        Returns:
+            :obj:`list` of :obj:`Format`: formats, sorted by the type of Google document, presentation, or workbook
+                and name
+        """
+        return [cls.FORMATS[key] for key in sorted(cls.FORMATS.keys())]
+
+    @classmethod
+    def get_export_type(cls, google_file, format='docx'):
+        """ Get the MIME type to export a Google document, presentation, or workbook in order to save it in a format
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+
+        Returns:
+            :obj:`str`: MIME type
+
+        Raises:
+            obj:`Exception`: if the format or the type of the Google document, presentation, or workbook is unknown
+        """
+        return cls.get_format(google_file, format).export_type
+
+    @classmethod
+    def write_atomically(cls, out_file, write, fsync=False):
+        """ Write a file into a temporary file next to it, and then atomically replace the file, so that the file is
+        never partially written and is left unchanged if writing fails
+
+        Concurrent writes to the file, by threads or by processes, are serialized with an :obj:`OutputLock`.
+
+        Args:
+            out_file (:obj:`str`): path to the file
+            write (:obj:`callable`): function which writes the content of the file to a binary file object
+            fsync (:obj:`bool`, optional): if :obj:`True`, flush the file and its directory to disk
+        """
+        with OutputLock(out_file):
+            write_atomically(out_file, write, fsync=fsync)
+
+    def export_format(self, google_id, format, file):
+        """ Stream the export of a Google document, presentation, or workbook into a file in a format which can be
+        written as it is downloaded
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`Format`): output format
+            file (:obj:`io.IOBase`): binary file object to write the content to
+        """
+        if format.writer is not None:
+            writer = format.writer(file)
+            self.export(google_id, format.export_type, writer)
+            writer.flush()
         else:
-            raise Exception('Unknown Google document extension "{}"'.format(google_file_ext))
+            self.export(google_id, format.export_type, file)
+
+    @classmethod
+    def write_latex(cls, payload, file):
+        """ Convert a Google document exported as zipped HTML to LaTeX
+
+        Args:
+            payload (:obj:`io.IOBase`): seekable binary file object which contains the export
+            file (:obj:`io.IOBase`): binary file object to write the LaTeX to
+        """
+        file.write(cls.convert_html_to_latex(payload))
+
+    @classmethod
+    def get_out_file(cls, google_file, format='docx', out_path='.', extension=None):
+        """ Get the path where a Google document, presentation, or workbook will be saved
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): path to save document, presentation, or workbook
+            extension (:obj:`str`, optional): extension to document, presentation, or workbook
+
+        Returns:
+            :obj:`str`: path to save document, presentation, or workbook
 
+        Raises:
+            obj:`Exception`: if ouput file path and extension cannot both be specified
+        """
         if os.path.isdir(out_path):
             if extension is None:
-                extension = format
+                registered_format = cls.FORMATS.get((os.path.splitext(google_file)[1], format), None)
+                extension = registered_format.extension if registered_format is not None else format
             root, _ = os.path.splitext(os.path.basename(google_file))
-            out_file = os.path.join(out_path, root + "." + extension)
+            return os.path.join(out_path, root + "." + extension)
         else:
             if extension is None or extension == os.path.splitext(out_path)[1][1:]:
-                out_file = out_path
+                return out_path
             else:
                 raise Exception('Ouput file path and extension cannot both be specified')
 
-        # get google document id
-        google_id = self.get_google_id(google_file)
+    def export(self, google_id, export_type, file):
+        """ Export a Google document, presentation, or workbook to a file in chunks of :obj:`chunk_size` bytes, retrying
+        chunks which fail according to :obj:`retry_policy`
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            export_type (:obj:`str`): MIME type to export
+            file (:obj:`io.IOBase`): binary file-like object to write the export to
+
+        Returns:
+            :obj:`int`: number of bytes exported
+        """
+        with self.metrics.phase('export', google_id=google_id, export_type=export_type) as record:
+            request = self.service.files().export_media(fileId=google_id, mimeType=export_type)
+            http = self.get_http()
+            if http is not None:
+                request.http = http
+            try:
+                n_bytes = self.download_media(request, file)
+            except Exception as error:
+                if not self.is_export_size_limit_error(error):
+                    raise
+                # the export is rejected before any of it is written
+                record['fallback'] = True
+                n_bytes = self.export_large(google_id, export_type, file)
+            record['bytes'] = n_bytes
+        return n_bytes
+
+    @classmethod
+    def is_export_size_limit_error(cls, error):
+        """ Determine whether an export failed because the file is larger than Google Drive can export
+
+        Args:
+            error (:obj:`Exception`): error
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the file is too large to export
+        """
+        return RetryPolicy.get_status(error) == 403 and RetryPolicy.get_reason(error) == cls.EXPORT_SIZE_LIMIT_REASON
+
+    def export_large(self, google_id, export_type, file):
+        """ Export a Google document, presentation, or workbook which is too large for the Drive API to export
+
+        CSV and TSV exports, which contain the first sheet of a workbook, are exported sheet by sheet (see
+        :obj:`export_sheet`). Other exports are downloaded in chunks from the export link of the file for the MIME
+        type, which isn't limited by the size limit of the Drive API.
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            export_type (:obj:`str`): MIME type to export
+            file (:obj:`io.IOBase`): binary file-like object to write the export to
+
+        Returns:
+            :obj:`int`: number of bytes exported
+
+        Raises:
+            :obj:`Exception`: if the file has no export link for the MIME type
+        """
+        import apiclient.http
+
+        if export_type in self.SHEET_EXPORT_FORMATS:
+            sheets = self.get_sheets(google_id)
+            if sheets:
+                return self.export_sheet(google_id, sheets[0]['sheetId'], export_type, file)
+
+        export_links = self.execute(self.service.files().get(fileId=google_id, fields='exportLinks'))
+        export_link = export_links.get('exportLinks', {}).get(export_type, None)
+        if export_link is None:
+            raise Exception('File "{}" is too large to export to {}'.format(google_id, export_type))
+
+        request = apiclient.http.HttpRequest(self.get_http() or self.service._http, None, export_link, headers={})
+        return self.download_media(request, file)
+
+    def download_media(self, request, file):
+        """ Download the media of a request to a file in chunks of :obj:`chunk_size` bytes, retrying chunks which fail
+        according to :obj:`retry_policy`
 
-        # download file from Google
-        content = self.service.files().export(fileId=google_id, mimeType=export_type).execute()
+        Args:
+            request (:obj:`apiclient.http.HttpRequest`): request
+            file (:obj:`io.IOBase`): binary file-like object to write the media to
+
+        Returns:
+            :obj:`int`: number of bytes downloaded
+        """
+        import apiclient.http
+
+        downloader = apiclient.http.MediaIoBaseDownload(file, request, chunksize=self.chunk_size)
+        n_bytes = 0
+        done = False
+        while not done:
+            status, done = self.retry_policy.call(downloader.next_chunk, rate_limiter=self.rate_limiter)
+            n_bytes = status.resumable_progress
+        return n_bytes
+
+    def get_sheets(self, google_id):
+        """ Get the sheets of a Google workbook
+
+        Args:
+            google_id (:obj:`str`): id of Google workbook
+
+        Returns:
+            :obj:`list` of :obj:`dict`: id (`sheetId`), `title`, and `index` of each sheet, in the order of the sheets
+        """
+        with self.metrics.phase('sheets', google_id=google_id):
+            response = self.execute(self.get_sheets_service().spreadsheets().get(
+                spreadsheetId=google_id, fields=self.SHEET_FIELDS))
+        sheets = [sheet['properties'] for sheet in response.get('sheets', [])]
+        return sorted(sheets, key=lambda sheet: sheet.get('index', 0))
+
+    def export_sheet(self, google_id, sheet_id, export_type, file):
+        """ Export one sheet of a Google workbook to a file
+
+        Args:
+            google_id (:obj:`str`): id of Google workbook
+            sheet_id (:obj:`int`): id of the sheet
+            export_type (:obj:`str`): MIME type to export (`text/csv` or `text/tab-separated-values`)
+            file (:obj:`io.IOBase`): binary file-like object to write the export to
+
+        Returns:
+            :obj:`int`: number of bytes exported
+        """
+        import apiclient.http
+
+        with self.metrics.phase('export', google_id=google_id, sheet_id=sheet_id, export_type=export_type) as record:
+            uri = self.SHEET_EXPORT_URL.format(google_id, self.SHEET_EXPORT_FORMATS[export_type], sheet_id)
+            http = self.get_http() or self.get_sheets_service()._http
+            request = apiclient.http.HttpRequest(http, None, uri, headers={})
+            record['bytes'] = n_bytes = self.download_media(request, file)
+        return n_bytes
+
+    def export_sheets(self, google_id, format, file):
+        """ Concurrently export each sheet of a Google workbook, and write the sheets to a zip archive with one member
+        per sheet, so that the time to export a workbook is bounded by the time to export its largest sheet
+
+        Args:
+            google_id (:obj:`str`): id of Google workbook
+            format (:obj:`Format`): output format, whose MIME type is the MIME type to export each sheet to
+            file (:obj:`io.IOBase`): binary file-like object to write the archive to
+        """
+        import concurrent.futures
+        import zipfile
+
+        sheets = self.get_sheets(google_id)
+        extension = '.' + self.SHEET_EXPORT_FORMATS[format.export_type]
+
+        payloads = [tempfile.TemporaryFile() for sheet in sheets]
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(sheets), self.max_workers))) \
+                    as executor:
+                futures = [executor.submit(self.export_sheet, google_id, sheet['sheetId'], format.export_type, payload)
+                           for sheet, payload in zip(sheets, payloads)]
+
+                with zipfile.ZipFile(file, 'w') as archive:
+                    names = set()
+                    for sheet, future, payload in zip(sheets, futures, payloads):
+                        future.result()
+                        name = self.get_sheet_filename(sheet, extension, names)
+                        names.add(name)
+
+                        # fix the time of each member so that the archive only changes when the sheets change
+                        info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                        info.file_size = os.fstat(payload.fileno()).st_size
+                        payload.seek(0)
+                        with archive.open(info, 'w') as member:
+                            shutil.copyfileobj(payload, member)
+        finally:
+            for payload in payloads:
+                payload.close()
+
+    @staticmethod
+    def get_sheet_filename(sheet, extension, names=()):
+        """ Get a unique filename for a sheet of a workbook
+
+        Args:
+            sheet (:obj:`dict`): id (`sheetId`) and `title` of the sheet
+            extension (:obj:`str`): extension, e.g., `.csv`
+            names (:obj:`set` of :obj:`str`, optional): filenames of the other sheets
+
+        Returns:
+            :obj:`str`: filename
+        """
+        title = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', sheet.get('title', '')).strip('. ') or 'sheet'
+        name = title + extension
+        if name in names:
+            name = '{} ({}){}'.format(title, sheet['sheetId'], extension)
+        return name
+
+    @staticmethod
+    def get_temp_path(path):
+        """ Get a unique path for a temporary file in the same directory as a file
+
+        Args:
+            path (:obj:`str`): path to file
+
+        Returns:
+            :obj:`str`: path to temporary file
+        """
+        return get_temp_path(path)
+
+    def download_many(self, google_files, format='docx', out_path='.', extension=None, max_workers=None, force=False,
+                      executor=None):
+        """ Concurrently download several Google documents, presentations, and/or workbooks
+
+        Args:
+            google_files (:obj:`list` of :obj:`str`): paths to Google documents, presentations, and/or workbooks
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): directory to save documents, presentations, and workbooks
+            extension (:obj:`str`, optional): extension to documents, presentations, and workbooks
+            max_workers (:obj:`int`, optional): maximum number of files to download concurrently
+            force (:obj:`bool`, optional): if :obj:`True`, download files even if the local copies are up to date
+            executor (:obj:`concurrent.futures.Executor`, optional): executor to run the downloads on instead of
+                a new pool of :obj:`max_workers` threads
+
+        Returns:
+            :obj:`list` of :obj:`DownloadResult`: result of each download, in the same order as :obj:`google_files`;
+                duplicate paths are downloaded once
+
+        Raises:
+            obj:`Exception`: if several files are downloaded and the output path isn't a directory
+        """
+        if len(google_files) > 1 and not os.path.isdir(out_path):
+            raise Exception('Output path must be a directory to download multiple files')
+
+        jobs = [dict(google_file=google_file, format=format, out_path=out_path, extension=extension, force=force)
+                for google_file in google_files]
+        return self.run_jobs(jobs, max_workers=max_workers, executor=executor)
+
+    def run_jobs(self, jobs, max_workers=None, executor=None):
+        """ Run download jobs on a bounded pool of worker threads
+
+        The output path of each job is resolved before any job is started. Jobs which are exact duplicates
+        of earlier jobs are dropped, and jobs which would overwrite the output of an earlier job are reported
+        as errors rather than run. The metadata of the files is requested once for the run, with batch requests.
+
+        Args:
+            jobs (:obj:`list` of :obj:`dict`): keyword arguments to :obj:`download` for each job
+            max_workers (:obj:`int`, optional): maximum number of files to download concurrently
+            executor (:obj:`concurrent.futures.Executor`, optional): executor to run the jobs on instead of
+                a new pool of :obj:`max_workers` threads, such as a long-lived pool whose threads keep their
+                HTTP connections open between calls
+
+        Returns:
+            :obj:`list` of :obj:`DownloadResult`: result of each unique job, in the same order as :obj:`jobs`
+        """
+        results, pending = self.plan_jobs(jobs)
+
+        # get the metadata of the files with a few batch requests, rather than one request per file
+        google_ids = {}
+        for job, _ in pending:
+            try:
+                google_ids[job['google_file']] = self.stub_index.get_google_id(job['google_file'])
+            except Exception:
+                pass
+        self.stub_index.save()
+        if len(set(google_ids.values())) > 1:
+            metadata = self.get_metadata_many(list(google_ids.values()))
+        else:
+            metadata = {}
 
-        # convert content as requested
-        if format == 'txt':
-            content = content[3:]
-        elif format == 'tex':
-            content = self.convert_html_to_latex(content)
+        # pipeline CPU-bound conversions, such as conversions to LaTeX, to a pool of processes, so that they don't
+        # hold the GIL while the threads download the other files
+        convert_executor = None
+        if len(pending) > 1 and self.convert_workers:
+            for job, _ in pending:
+                try:
+                    cpu_bound = self.get_format(job['google_file'], job['format']).cpu_bound
+                except Exception:
+                    cpu_bound = False
+                if cpu_bound:
+                    convert_executor = self.get_convert_executor()
+                    break
 
-        # save content to local file
-        with open(out_file, "wb") as file:
-            file.write(content)
+        def run_job(job_result):
+            job, result = job_result
+            try:
+                _, downloaded = self._download(metadata=metadata.get(google_ids.get(job['google_file'], None), None),
+                                               convert_executor=convert_executor, **job)
+                result.up_to_date = not downloaded
+            except Exception as error:
+                result.error = error
+                result.out_file = None
+
+        try:
+            if pending and executor:
+                list(executor.map(run_job, pending))
+            elif pending:
+                import concurrent.futures
+                max_workers = max(1, min(max_workers or self.max_workers, len(pending)))
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    list(executor.map(run_job, pending))
+        finally:
+            self.manifest.save()
+
+        return results
+
+    def sync(self, src_dir, dst_dir, format_map=None, max_workers=None, force=False, delete=True, incremental=False):
+        """ Mirror a directory tree of Google documents, presentations, and workbooks (e.g., a Google Drive for desktop
+        folder) into a directory tree of local files
+
+        The source tree is walked once, and the stubs are downloaded concurrently into the same relative directories of
+        the destination. Files which are up to date are skipped. The outputs of each sync are recorded in the
+        destination, so that outputs whose stubs have since been deleted can be removed. Files in the destination
+        which weren't created by a sync are never removed.
+
+        An incremental sync also records a Google Drive changes page token. Subsequent incremental syncs list the
+        changes since the token, and only check the files which have changed, or whose stubs are new, for updates,
+        rather than requesting the metadata of every file.
+
+        Args:
+            src_dir (:obj:`str`): directory of Google documents, presentations, and workbooks
+            dst_dir (:obj:`str`): directory to save the local files
+            format_map (:obj:`dict`, optional): dictionary which maps stub extensions (e.g., `.gdoc`) to lists of
+                output formats; stubs with other extensions are ignored; defaults to :obj:`FORMAT_MAP`
+            max_workers (:obj:`int`, optional): maximum number of files to download concurrently
+            force (:obj:`bool`, optional): if :obj:`True`, download files even if the local copies are up to date
+            delete (:obj:`bool`, optional): if :obj:`True`, remove outputs whose stubs have been deleted
+            incremental (:obj:`bool`, optional): if :obj:`True`, only check the files which have changed since the
+                last incremental sync
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`list` of :obj:`DownloadResult`: result of each download
+                * :obj:`list` of :obj:`str`: paths of the removed outputs
+        """
+        format_map = format_map or self.FORMAT_MAP
+        if not os.path.isdir(src_dir):
+            raise Exception('Source directory "{}" does not exist'.format(src_dir))
+        os.makedirs(dst_dir, exist_ok=True)
+        real_dst_dir = os.path.realpath(dst_dir)
+
+        # walk the source tree once, skipping the destination if it is inside the source
+        jobs = []
+        for dirname, sub_dirnames, filenames in os.walk(src_dir):
+            sub_dirnames[:] = sorted(sub_dirname for sub_dirname in sub_dirnames
+                                     if os.path.realpath(os.path.join(dirname, sub_dirname)) != real_dst_dir)
+            out_path = os.path.join(dst_dir, os.path.relpath(dirname, src_dir))
+            for filename in sorted(filenames):
+                for format in format_map.get(os.path.splitext(filename)[1], []):
+                    jobs.append(dict(google_file=os.path.join(dirname, filename), format=format, out_path=out_path,
+                                     extension=None, force=force))
+
+        for out_path in set(job['out_path'] for job in jobs):
+            os.makedirs(out_path, exist_ok=True)
+
+        state_path = os.path.join(dst_dir, self.SYNC_STATE_FILENAME)
+        if os.path.isfile(state_path):
+            with open(state_path, 'r') as file:
+                state = json.load(file)
+        else:
+            state = {}
+        src_key = os.path.realpath(src_dir)
+        src_state = state.get(src_key, {})
+
+        # get the changes since the last incremental sync before downloading, so that files which change during the
+        # sync are checked again by the next sync
+        google_ids = {}
+        changed_ids = None
+        page_token = None
+        if incremental:
+            for job in jobs:
+                if job['google_file'] not in google_ids:
+                    try:
+                        google_ids[job['google_file']] = self.stub_index.get_google_id(job['google_file'])
+                    except Exception:
+                        google_ids[job['google_file']] = None
+            if src_state.get('page_token'):
+                changed_ids, page_token = self.list_changes(src_state['page_token'])
+            else:
+                page_token = self.get_start_page_token()
+
+        # skip the files which haven't changed since the last incremental sync, unless their outputs are missing or
+        # also the outputs of other files
+        out_files = [self.get_out_file(job['google_file'], format=job['format'], out_path=job['out_path'])
+                     for job in jobs]
+        n_out_file_jobs = {}
+        for out_file in out_files:
+            n_out_file_jobs[out_file] = n_out_file_jobs.get(out_file, 0) + 1
+        known_ids = src_state.get('google_ids', {}) if changed_ids is not None and not force else {}
+
+        skipped_results = []
+        pending_jobs = []
+        for job, out_file in zip(jobs, out_files):
+            google_id = google_ids.get(job['google_file'], None)
+            if google_id is not None \
+                    and known_ids.get(os.path.relpath(job['google_file'], src_dir), None) == google_id \
+                    and google_id not in changed_ids \
+                    and n_out_file_jobs[out_file] == 1 \
+                    and os.path.isfile(out_file):
+                skipped_results.append(DownloadResult(job['google_file'], out_file=out_file, up_to_date=True))
+            else:
+                pending_jobs.append(job)
+
+        results = skipped_results + self.run_jobs(pending_jobs, max_workers=max_workers)
+
+        # remove the outputs of deleted stubs
+        outputs = set(os.path.relpath(out_file, dst_dir) for out_file in out_files)
+        removed = []
+        if delete:
+            for output in sorted(set(src_state.get('outputs', [])) - outputs):
+                out_file = os.path.join(dst_dir, output)
+                if os.path.isfile(out_file):
+                    os.remove(out_file)
+                    removed.append(out_file)
+                    self.remove_empty_dirs(os.path.dirname(out_file), dst_dir)
+        else:
+            outputs.update(src_state.get('outputs', []))
+
+        src_state = {'outputs': sorted(outputs)}
+        if incremental:
+            # files which couldn't be downloaded are checked again by the next sync
+            failed_files = set(result.google_file for result in results if not result.success)
+            src_state['page_token'] = page_token
+            src_state['google_ids'] = {os.path.relpath(google_file, src_dir): google_id
+                                       for google_file, google_id in google_ids.items()
+                                       if google_id is not None and google_file not in failed_files}
+        state[src_key] = src_state
+        self.write_atomically(state_path, lambda file: file.write(json.dumps(state, indent=2).encode('utf-8')),
+                              fsync=self.fsync)
+
+        return (results, removed)
+
+    def get_start_page_token(self):
+        """ Get a Google Drive changes page token which points to the current state of the user's files
+
+        Returns:
+            :obj:`str`: page token
+        """
+        return self.execute(self.service.changes().getStartPageToken(supportsAllDrives=True))['startPageToken']
+
+    def list_changes(self, page_token):
+        """ List the ids of the files which have changed since a Google Drive changes page token
+
+        Args:
+            page_token (:obj:`str`): page token, e.g., from :obj:`get_start_page_token`
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`set` of :obj:`str`: ids of the changed files
+                * :obj:`str`: page token which points to the current state of the user's files
+        """
+        changed_ids = set()
+        while True:
+            response = self.execute(self.service.changes().list(
+                pageToken=page_token, pageSize=self.CHANGES_PAGE_SIZE, includeItemsFromAllDrives=True,
+                supportsAllDrives=True, fields='nextPageToken,newStartPageToken,changes(fileId)'))
+            changed_ids.update(change['fileId'] for change in response.get('changes', []) if change.get('fileId'))
+            if 'newStartPageToken' in response:
+                return (changed_ids, response['newStartPageToken'])
+            page_token = response['nextPageToken']
+
+    @staticmethod
+    def remove_empty_dirs(dirname, root_dirname):
+        """ Remove a directory and its ancestors, up to but excluding a root directory, while they are empty
+
+        Args:
+            dirname (:obj:`str`): directory
+            root_dirname (:obj:`str`): root directory
+        """
+        root_dirname = os.path.realpath(root_dirname)
+        dirname = os.path.realpath(dirname)
+        while dirname != root_dirname and dirname.startswith(root_dirname + os.sep) and not os.listdir(dirname):
+            os.rmdir(dirname)
+            dirname = os.path.dirname(dirname)
+
+    @classmethod
+    def parse_format_map(cls, value):
+        """ Parse a map from stub types to output formats such as `gdoc=docx+pdf,gsheet=xlsx`
+
+        Args:
+            value (:obj:`str`): comma-separated list of stub types (with or without the leading `.`) and
+                `+`-separated lists of output formats
+
+        Returns:
+            :obj:`dict`: dictionary which maps stub extensions to lists of output formats
+
+        Raises:
+            :obj:`Exception`: if the map isn't valid
+        """
+        format_map = {}
+        for item in value.split(','):
+            stub_type, _, formats = item.strip().partition('=')
+            if not stub_type or not formats:
+                raise Exception('Invalid format map "{}"; expected, e.g., "gdoc=docx,gsheet=xlsx"'.format(value))
+            format_map['.' + stub_type.lstrip('.')] = [format.strip() for format in formats.split('+')]
+        return format_map
+
+    @classmethod
+    def plan_jobs(cls, jobs):
+        """ Resolve the output path of each download job, drop jobs which are exact duplicates of earlier jobs, and
+        report jobs which would overwrite the output of an earlier job as errors
+
+        Args:
+            jobs (:obj:`list` of :obj:`dict`): keyword arguments to :obj:`download` for each job
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`list` of :obj:`DownloadResult`: result of each unique job, in the same order as :obj:`jobs`
+                * :obj:`list` of :obj:`tuple`: each job which should be run and its result
+        """
+        results = []
+        pending = []
+        out_file_jobs = {}
+        for job in jobs:
+            try:
+                out_file = cls.get_out_file(job['google_file'], format=job.get('format', 'docx'),
+                                            out_path=job.get('out_path', '.'), extension=job.get('extension', None))
+            except Exception as error:
+                results.append(DownloadResult(job['google_file'], error=error))
+                continue
+
+            key = os.path.realpath(out_file)
+            other_job = out_file_jobs.get(key, None)
+            if other_job is None:
+                out_file_jobs[key] = job
+                result = DownloadResult(job['google_file'], out_file=out_file)
+                results.append(result)
+                pending.append((job, result))
+            elif os.path.realpath(other_job['google_file']) == os.path.realpath(job['google_file']) \
+                    and other_job.get('format', 'docx') == job.get('format', 'docx'):
+                continue
+            else:
+                results.append(DownloadResult(job['google_file'], error=Exception(
+                    'Output file "{}" is also the output of "{}"'.format(out_file, other_job['google_file']))))
+
+        return (results, pending)
 
     @classmethod
     def get_google_id(cls, google_file):
@@ -212,10 +1352,7 @@ class GDocDown(object):
         Returns:
             :obj:`str`: id of Google document, presentation, or workbook
         """
-
-        with open(google_file) as data_file:
-            data = json.load(data_file)
-        return data['doc_id']
+        return StubIndex.read_google_id(google_file)
 
     @classmethod
     def convert_html_to_latex(cls, html_zip_content):
@@ -225,90 +1362,413 @@ class GDocDown(object):
         * Remove images
         * Replace comments with PDF comments (using `pdfcomment` package)
 
+        The HTML is converted in a single pass with :obj:`HtmlToLatexParser`.
+
         Args:
-            html_zip_content (:obj:`bytes`): HTML version of Google document
+            html_zip_content (:obj:`bytes` or :obj:`io.IOBase`): HTML version of Google document, or a binary
+                file-like object which contains it
 
         Returns:
             :obj:`bytes`: formatted LaTeX
         """
 
+        import zipfile
+
         # recode html from zip file
-        zip = zipfile.ZipFile(io.BytesIO(html_zip_content), 'r')
+        if isinstance(html_zip_content, bytes):
+            html_zip_content = io.BytesIO(html_zip_content)
+        zip = zipfile.ZipFile(html_zip_content, 'r')
         filename = next(filename for filename in zip.namelist() if os.path.splitext(filename)[1] == '.html')
-        html_content = zip.read(filename)
 
-        # decode content
-        html_content = html_content.decode('utf-8')
+        # comments are no longer exported by Google Drive
+
+        # collect body text
+        parser = HtmlToLatexParser()
+        with zip.open(filename, 'r') as html_file:
+            for html_content in io.TextIOWrapper(html_file, encoding='utf-8', newline=''):
+                parser.feed(html_content)
+        parser.close()
 
-        """ remove unnecessary content """
-        # head
-        pattern = re.compile('<head>.*</head>')
-        html_content = pattern.sub('', html_content)
+        """ return formatted LaTeX """
+        return ''.join(parser.tex_content).encode('utf-8')
 
-        # style
-        pattern = re.compile(' style=".*?"')
-        html_content = pattern.sub('', html_content)
+    @classmethod
+    def get_element_text(cls, element):
+        """ Get all of the text underneath an XML element
 
-        # horizontal and break lines
-        html_content = html_content \
-            .replace('<hr style="page-break-before:always;display:none;">', '') \
-            .replace("<br>",  "\n")
+        Args:
+            el (:obj:`xml.etree.ElementTree.Element`): XML element
 
-        # images
-        pattern = re.compile('<img.*?>')
-        html_content = pattern.sub('', html_content)
+        Returns:
+            :obj:`str`: element's text
+        """
+        return ''.join(cls.iter_element_text(element))
 
-        """ substitute character entities """
-        html_content = html_content.replace('&nbsp;', ' ')
-        html_content = str(BeautifulSoup(html_content, 'html.parser'))
+    @classmethod
+    def iter_element_text(cls, element):
+        """ Iterate over the text of an XML element and its descendants in document order, without
+        recursion. As with :obj:`get_element_text`, the text which follows each element (its tail) is
+        excluded.
 
-        """ replace comments with PDF comments (using `pdfcomment` package) """
-        # parse html content
-        root = ElementTree.fromstring(html_content)
+        Args:
+            el (:obj:`xml.etree.ElementTree.Element`): XML element
 
-        # find and replace comments: no longer exported by Google Drive
+        Yields:
+            :obj:`str`: text of the element and each of its descendants
         """
-        comment_id = 0
-        while True:
-            comment_id = comment_id + 1
-            comment_anchor = root.find(".//a[@id='cmnt{}']".format(comment_id))
-            if comment_anchor is None:
-                break
-            comment_parent = root.find(".//a[@id='cmnt{}']/..".format(comment_id))
-            comment = root.find(".//a[@id='cmnt{}']/../span".format(comment_id))
-            comment_grandparent = root.find(".//a[@id='cmnt{}']/../..".format(comment_id))
+        stack = [iter((element,))]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            if child.text:
+                yield child.text
+            stack.append(iter(child))
+
+
+class HtmlToLatexParser(html.parser.HTMLParser):
+    """ Incremental parser which collects the text of each top-level element of the body of a Google document
+    exported to HTML
+
+    * The head, styles, and images are ignored.
+    * `<br>` tags are converted to new lines.
+    * Non-breaking spaces are converted to spaces.
+    * Whitespace-only text is collapsed to a single space or new line.
+    * The text of each top-level element of the body is followed by a blank line. Only the text which
+      precedes the first child of each element, and not the text which follows its children, is collected.
+
+    Attributes:
+        tex_content (:obj:`list` of :obj:`str`): fragments of the LaTeX content
+    """
+
+    VOID_ELEMENTS = frozenset([
+        'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame', 'hr', 'image', 'img',
+        'input', 'isindex', 'keygen', 'link', 'menuitem', 'meta', 'nextid', 'param', 'source', 'spacer', 'track',
+        'wbr',
+    ])
+
+    WHITESPACE_PRESERVING_ELEMENTS = frozenset(['pre', 'textarea'])
+
+    ASCII_WHITESPACE = ' \n\t\x0c\r'
+
+    STYLE_PATTERN = re.compile(' style=".*?"')
+
+    def __init__(self):
+        super(HtmlToLatexParser, self).__init__(convert_charrefs=False)
+        self.tex_content = []
+        self._in_body = False
+        self._body_closed = False
+        self._stack = []
+        self._capture = False
+        self._text = []
+        self._node = []
+        self._closed_void_elements = []
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, False)
 
-            # remove comment
-            comment_grandparent.remove(comment_parent)
+    def handle_startendtag(self, tag, attrs):
+        if not self.get_starttag_text().startswith('<img'):
+            self._start(tag, True)
+            self._end(tag)
 
-            # replace superscript with PDF comment
-            ref = root.find(".//a[@id='cmnt_ref{}']".format(comment_id))
-            ref_parent = root.find(".//a[@id='cmnt_ref{}']/..".format(comment_id))
-            ref_parent.remove(ref)
-            ref_parent.text = '\pdfcomment{{{}}}'.format(cls.get_element_text(comment))
+    def handle_endtag(self, tag):
+        # ignore the redundant end tags of void elements
+        if tag in self._closed_void_elements:
+            self._closed_void_elements.remove(tag)
+        else:
+            self._end(tag)
+
+    def _start(self, tag, self_closing):
+        """ Handle the start of an element
+
+        Args:
+            tag (:obj:`str`): name of the element
+            self_closing (:obj:`bool`): :obj:`True` if the element was written as `<tag/>`
         """
+        start_tag = self.get_starttag_text()
 
-        # collect body text
-        tex_content = ''
-        for child in list(root.find('./body')):
-            tex_content = tex_content + cls.get_element_text(child)
-            tex_content = tex_content + "\n\n"
+        # ignore images
+        if start_tag.startswith('<img'):
+            return
 
-        """ return formatted LaTeX """
-        return tex_content.encode('utf-8')
+        # convert line breaks to new lines
+        if self.STYLE_PATTERN.sub('', start_tag) == '<br>':
+            self._text.append('\n')
+            return
 
-    @classmethod
-    def get_element_text(cls, element):
-        """ Get all of the text underneath an XML element
+        self._end_node()
+        if tag in self.VOID_ELEMENTS and not self_closing:
+            self._closed_void_elements.append(tag)
+
+        if not self._in_body:
+            if tag == 'body' and not self._body_closed:
+                self._in_body = True
+        elif tag in self.VOID_ELEMENTS:
+            if not self._stack:
+                self.tex_content.append('\n\n')
+            self._capture = False
+        else:
+            self._stack.append(tag)
+            self._capture = True
+
+    def _end(self, tag):
+        """ Handle the end of an element
 
         Args:
-            el (:obj:`xml.etree.ElementTree.Element`): XML element
+            tag (:obj:`str`): name of the element
+        """
+        if not self._in_body or (tag not in ('body', 'html') and tag not in self._stack):
+            self._end_text()
+            return
+
+        self._end_node()
+        if tag in ('body', 'html'):
+            if self._stack:
+                self.tex_content.append('\n\n')
+            self._stack = []
+            self._in_body = False
+            self._body_closed = True
+        else:
+            while self._stack.pop() != tag:
+                pass
+            if not self._stack:
+                self.tex_content.append('\n\n')
+            self._capture = False
+
+    def handle_data(self, data):
+        self._text.append(data)
+
+    def handle_entityref(self, name):
+        if name == 'nbsp':
+            self._text.append(' ')
+        else:
+            self._text.append(html.entities.html5.get(name + ';', '&' + name))
+
+    def handle_charref(self, name):
+        self._text.append(html.unescape('&#{};'.format(name)))
+
+    def handle_comment(self, data):
+        self._end_node()
+
+    def handle_decl(self, decl):
+        self._end_node()
+
+    def handle_pi(self, data):
+        self._end_node()
+
+    def unknown_decl(self, data):
+        self._end_node()
+
+    def close(self):
+        super(HtmlToLatexParser, self).close()
+        self._end_node()
+        if self._stack:
+            self.tex_content.append('\n\n')
+        self._stack = []
+
+    def _end_text(self):
+        """ Collect the text since the previous tag or comment if it is the leading text of an element inside the body """
+        if not self._text:
+            return
+        text = ''.join(self._text)
+        self._text = []
+
+        if not (self._in_body and self._stack and self._capture):
+            return
+
+        if not self.WHITESPACE_PRESERVING_ELEMENTS.intersection(self._stack) and not text.strip(self.ASCII_WHITESPACE):
+            text = '\n' if '\n' in text else ' '
+        self._node.append(text)
+
+    def _end_node(self):
+        """ Collect the text since the previous opened or closed element or comment, normalizing its line endings """
+        self._end_text()
+        if self._node:
+            self.tex_content.append(''.join(self._node).replace('\r\n', '\n').replace('\r', '\n'))
+            self._node = []
+
+
+class Format(object):
+    """ Output format of a type of Google document, presentation, or workbook
+
+    Each format is exported by Google Drive to a MIME type. The export is saved as is, filtered by a writer as it is
+    downloaded, or converted by a post-processor once it has been downloaded. Formats which are filtered or saved as is
+    are streamed into the output files. Formats which can't be exported by one export, such as the sheets of a
+    workbook, are exported by an exporter.
+
+    Attributes:
+        stub_type (:obj:`str`): extension of the stubs of the type of Google file, e.g., `.gdoc`
+        name (:obj:`str`): name of the format, e.g., `docx`
+        export_type (:obj:`str`): MIME type to export
+        extension (:obj:`str`): default extension of the output files
+        writer (:obj:`callable`): function which wraps a binary file object into a file-like object with `write` and
+            `flush` methods which filters the export as it is written (e.g., :obj:`BomStrippingWriter`), or
+            :obj:`None`
+        converter (:obj:`callable`): function which converts the complete export, given as a seekable binary file
+            object, and writes the output to a binary file object, or :obj:`None`
+        exporter (:obj:`callable`): function which exports the format with several requests instead of one export of
+            :obj:`export_type` (e.g., :obj:`GDocDown.export_sheets`), given the downloader, the id of the file, the
+            format, and a binary file object to write the output to, or :obj:`None`
+        cpu_bound (:obj:`bool`): if :obj:`True`, the converter is CPU-bound, and the conversions of batches are run in
+            worker processes; the format must then be picklable, e.g., its converter must be a module-level function
+            or a method of a module-level class
+        description (:obj:`str`): description of the format
+    """
+
+    def __init__(self, stub_type, name, export_type, extension=None, writer=None, converter=None, exporter=None,
+                 cpu_bound=False, description=None):
+        """
+        Args:
+            stub_type (:obj:`str`): extension of the stubs of the type of Google file, e.g., `.gdoc`
+            name (:obj:`str`): name of the format, e.g., `docx`
+            export_type (:obj:`str`): MIME type to export
+            extension (:obj:`str`, optional): default extension of the output files; defaults to :obj:`name`
+            writer (:obj:`callable`, optional): function which wraps a binary file object into a file-like object
+                which filters the export as it is written
+            converter (:obj:`callable`, optional): function which converts the complete export and writes the
+                output to a binary file object
+            exporter (:obj:`callable`, optional): function which exports the format with several requests
+            cpu_bound (:obj:`bool`, optional): if :obj:`True`, the converter is CPU-bound
+            description (:obj:`str`, optional): description of the format
+        """
+        self.stub_type = stub_type
+        self.name = name
+        self.export_type = export_type
+        self.extension = extension or name
+        self.writer = writer
+        self.converter = converter
+        self.exporter = exporter
+        self.cpu_bound = cpu_bound
+        self.description = description
+
+    def convert(self, payload, file):
+        """ Derive the format from its export
+
+        Args:
+            payload (:obj:`io.IOBase`): seekable binary file object which contains the export
+            file (:obj:`io.IOBase`): binary file object to write the output to
+        """
+        if self.converter is not None:
+            self.converter(payload, file)
+        elif self.writer is not None:
+            writer = self.writer(file)
+            shutil.copyfileobj(payload, writer)
+            writer.flush()
+        else:
+            shutil.copyfileobj(payload, file)
+
+
+class BomStrippingWriter(object):
+    """ Binary file-like object which removes the UTF-8 byte order mark from the start of the content
+    written to another file
+
+    Attributes:
+        file (:obj:`io.IOBase`): file to write content to
+    """
+
+    BOM = b'\xef\xbb\xbf'
+
+    def __init__(self, file):
+        """
+        Args:
+            file (:obj:`io.IOBase`): file to write content to
+        """
+        self.file = file
+        self._head = b''
+
+    def write(self, data):
+        """ Write content, holding back the first bytes until it can be determined whether they are a byte order mark
+
+        Args:
+            data (:obj:`bytes`): content
 
         Returns:
-            :obj:`str`: element's text
+            :obj:`int`: number of bytes consumed
+        """
+        if self._head is None:
+            return self.file.write(data)
+
+        head = self._head + data
+        if len(head) < len(self.BOM) and self.BOM.startswith(head):
+            self._head = head
+        else:
+            self._head = None
+            if head.startswith(self.BOM):
+                head = head[len(self.BOM):]
+            self.file.write(head)
+        return len(data)
+
+    def flush(self):
+        """ Write any content which is being held back """
+        if self._head:
+            self.file.write(self._head)
+        self._head = None
+
+
+class DownloadResult(object):
+    """ Result of downloading a Google document, presentation, or workbook
+
+    Attributes:
+        google_file (:obj:`str`): path to Google document, presentation, or workbook
+        out_file (:obj:`str`): path to the downloaded file
+        up_to_date (:obj:`bool`): :obj:`True` if the file wasn't exported because the local copy was up to date
+        error (:obj:`Exception`): error raised while downloading the file, or :obj:`None` if the download succeeded
+    """
+
+    def __init__(self, google_file, out_file=None, up_to_date=False, error=None):
+        """
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+            out_file (:obj:`str`, optional): path to the downloaded file
+            up_to_date (:obj:`bool`, optional): :obj:`True` if the local copy was up to date
+            error (:obj:`Exception`, optional): error raised while downloading the file
         """
+        self.google_file = google_file
+        self.out_file = out_file
+        self.up_to_date = up_to_date
+        self.error = error
+
+    @property
+    def success(self):
+        """ Get whether the download succeeded
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the download succeeded
+        """
+        return self.error is None
+
+
+# built-in formats, which are registered when the module is imported
+BUILTIN_FORMATS = [
+    Format('.gdoc', 'docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+           description='Word document'),
+    Format('.gdoc', 'epub', 'application/epub+zip', description='EPUB'),
+    Format('.gdoc', 'html', 'text/html', description='HTML'),
+    Format('.gdoc', 'html.zip', 'application/zip', description='zipped HTML'),
+    Format('.gdoc', 'odt', 'application/vnd.oasis.opendocument.text', description='Open Office document'),
+    Format('.gdoc', 'pdf', 'application/pdf', description='Portable document format'),
+    Format('.gdoc', 'rtf', 'application/rtf', description='Rich text document'),
+    Format('.gdoc', 'tex', 'application/zip', converter=GDocDown.write_latex, cpu_bound=True, description='LaTeX'),
+    Format('.gdoc', 'txt', 'text/plain', writer=BomStrippingWriter, description='Plain text file'),
+    Format('.gsheet', 'csv', 'text/csv', description='CSV (first sheet)'),
+    Format('.gsheet', 'csv.zip', 'text/csv', exporter=GDocDown.export_sheets, description='zipped CSV of each sheet'),
+    Format('.gsheet', 'html.zip', 'application/zip', description='zipped HTML'),
+    Format('.gsheet', 'ods', 'application/x-vnd.oasis.opendocument.spreadsheet', description='Open Office workbook'),
+    Format('.gsheet', 'pdf', 'application/pdf', description='Portable document format'),
+    Format('.gsheet', 'tsv', 'text/tab-separated-values', description='TSV (first sheet)'),
+    Format('.gsheet', 'tsv.zip', 'text/tab-separated-values', exporter=GDocDown.export_sheets,
+           description='zipped TSV of each sheet'),
+    Format('.gsheet', 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+           description='Excel workbook'),
+    Format('.gslides', 'odp', 'application/vnd.oasis.opendocument.presentation',
+           description='Open Office presentation'),
+    Format('.gslides', 'pdf', 'application/pdf', description='Portable document format'),
+    Format('.gslides', 'pptx', 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+           description='Powerpoint presentation'),
+    Format('.gslides', 'txt', 'text/plain', writer=BomStrippingWriter, description='Plain text file'),
+]
 
-        text = element.text or ''
-        for child in list(element):
-            text = text + cls.get_element_text(child)
-        return text
+for builtin_format in BUILTIN_FORMATS:
+    GDocDown.register_format(builtin_format)
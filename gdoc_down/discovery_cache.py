@@ -0,0 +1,75 @@
+"""
+Persistent cache of Google API discovery documents
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from .output import write_atomically
+import googleapiclient.discovery_cache.base
+import hashlib
+import os
+import time
+
+
+class DiscoveryCache(googleapiclient.discovery_cache.base.Cache):
+    """ Cache of Google API discovery documents backed by local files, so that the discovery documents
+    don't have to be downloaded each time the command line program is run
+
+    Attributes:
+        dirname (:obj:`str`): directory to store discovery documents
+        ttl (:obj:`float`): number of seconds that cached discovery documents are valid, or :obj:`None` if they don't
+            expire
+    """
+
+    def __init__(self, dirname, ttl):
+        """
+        Args:
+            dirname (:obj:`str`): directory to store discovery documents
+            ttl (:obj:`float`): number of seconds that cached discovery documents are valid, or :obj:`None` if they
+                don't expire
+        """
+        self.dirname = dirname
+        self.ttl = ttl
+
+    def get(self, url):
+        """ Get a cached discovery document
+
+        Args:
+            url (:obj:`str`): URL of the discovery document
+
+        Returns:
+            :obj:`str`: discovery document, or :obj:`None` if the document isn't cached or has expired
+        """
+        filename = self.get_filename(url)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(filename) > self.ttl:
+                return None
+            with open(filename, 'r') as file:
+                return file.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, url, content):
+        """ Cache a discovery document
+
+        Args:
+            url (:obj:`str`): URL of the discovery document
+            content (:obj:`str`): discovery document
+        """
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname, exist_ok=True)
+        write_atomically(self.get_filename(url), lambda file: file.write(content.encode('utf-8')))
+
+    def get_filename(self, url):
+        """ Get the path where a discovery document is cached
+
+        Args:
+            url (:obj:`str`): URL of the discovery document
+
+        Returns:
+            :obj:`str`: path to the cached discovery document
+        """
+        return os.path.join(self.dirname, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
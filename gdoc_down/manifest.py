@@ -0,0 +1,144 @@
+"""
+Manifest of the Google Drive versions of previously downloaded documents, presentations, and workbooks
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from .output import OutputLock, write_atomically
+import json
+import os
+import threading
+
+
+class Manifest(object):
+    """ On-disk record of the Google Drive version of each downloaded file, which is used to skip
+    exporting files which haven't changed since they were last downloaded
+
+    Each entry is keyed by the id of the Google document, presentation, or workbook, the output format, and the
+    path of the local file, and records the `modifiedTime` and `version` reported by Google Drive as well as
+    the size and modification time of the local file.
+
+    Entries are recorded in memory, and saved once per run with :obj:`save`. Processes which share the manifest,
+    e.g., a server and the command line program, each merge their entries into the latest version of the file, so
+    that they don't discard each other's entries.
+
+    Attributes:
+        path (:obj:`str`): path to the manifest
+        entries (:obj:`dict`): dictionary which maps ids to dictionaries which map formats to dictionaries
+            which map local paths to the recorded metadata
+        hits (:obj:`int`): number of downloads which were skipped because the local file was up to date
+        misses (:obj:`int`): number of downloads which weren't up to date
+        fsync (:obj:`bool`): if :obj:`True`, flush the manifest to disk when it is saved
+    """
+
+    def __init__(self, path, fsync=False):
+        """
+        Args:
+            path (:obj:`str`): path to the manifest
+            fsync (:obj:`bool`, optional): if :obj:`True`, flush the manifest to disk when it is saved
+        """
+        self.path = path
+        self.fsync = fsync
+        self.hits = 0
+        self.misses = 0
+        self._changes = {}
+        self._lock = threading.Lock()
+        self.entries = self.read()
+
+    def read(self):
+        """ Read the manifest from disk
+
+        Returns:
+            :obj:`dict`: entries of the manifest, or an empty dictionary if the manifest doesn't exist or is corrupt
+        """
+        try:
+            with open(self.path, 'r') as file:
+                entries = json.load(file)
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def is_current(self, google_id, format, out_file, metadata):
+        """ Determine whether a local file is an up to date copy of a Google document, presentation, or workbook,
+        and count the result as a hit or miss
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            out_file (:obj:`str`): path to the local file
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the local file is up to date
+        """
+        with self._lock:
+            entry = self.entries.get(google_id, {}).get(format, {}).get(os.path.realpath(out_file), None)
+            current = entry is not None \
+                and entry['modifiedTime'] == metadata.get('modifiedTime', None) \
+                and entry['version'] == metadata.get('version', None) \
+                and self._stat(out_file) == (entry['size'], entry['mtime'])
+            if current:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return current
+
+    def set(self, google_id, format, out_file, metadata):
+        """ Record that a local file is a copy of a version of a Google document, presentation, or workbook
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            out_file (:obj:`str`): path to the local file
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+        """
+        size, mtime = self._stat(out_file)
+        key = (google_id, format, os.path.realpath(out_file))
+        entry = {
+            'modifiedTime': metadata.get('modifiedTime', None),
+            'version': metadata.get('version', None),
+            'size': size,
+            'mtime': mtime,
+        }
+        with self._lock:
+            self.entries.setdefault(google_id, {}).setdefault(format, {})[key[2]] = entry
+            self._changes[key] = entry
+
+    def save(self):
+        """ Merge the entries which were recorded since the manifest was loaded or last saved into the latest version
+        of the manifest on disk, if any were recorded """
+        with self._lock:
+            if not self._changes:
+                return
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with OutputLock(self.path):
+                entries = self.read()
+                for (google_id, format, out_file), entry in self._changes.items():
+                    entries.setdefault(google_id, {}).setdefault(format, {})[out_file] = entry
+                write_atomically(self.path, lambda file: file.write(json.dumps(entries).encode('utf-8')),
+                                 fsync=self.fsync)
+            self.entries = entries
+            self._changes = {}
+
+    @staticmethod
+    def _stat(out_file):
+        """ Get the size and modification time of a local file
+
+        Args:
+            out_file (:obj:`str`): path to the local file
+
+        Returns:
+            :obj:`tuple`: size and modification time (ns) of the file, or :obj:`None` if the file doesn't exist
+        """
+        try:
+            stat = os.stat(out_file)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
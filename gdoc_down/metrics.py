@@ -0,0 +1,102 @@
+"""
+Timing of the phases of downloads, such as authentication, parsing stubs, exporting, converting, and saving files
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+
+class Metrics(object):
+    """ Recorder of the duration of each phase of each download
+
+    Each phase is recorded as a dictionary with the name of the phase (`event`), its start time (`time`, seconds since
+    the epoch), its duration (`seconds`), the error which it raised, if any (`error`), and fields which describe the
+    phase, such as the path of the stub (`google_file`), the id of the file (`google_id`), the output format
+    (`format`), and the number of bytes exported, converted, or saved (`bytes`). The records are written as JSON
+    lines to :obj:`file`, passed to each callback, and summed by phase.
+
+    The phases are
+
+    * `get_credentials`: load or obtain the user's credentials
+    * `authenticate`: build the Google Drive service
+    * `download`: download a file in one or more formats, including the following phases
+    * `stub`: read the id of the file from its stub
+    * `metadata`: get the version of the file
+    * `sheets`: list the sheets of a workbook
+    * `export`: export the file from Google Drive
+    * `convert`: derive a format from an export, e.g., convert a document to LaTeX
+    * `save`: write a file, including streaming an export into the file, and replace the previous version
+
+    Attributes:
+        enabled (:obj:`bool`): if :obj:`False`, phases aren't timed or recorded
+        file (:obj:`io.TextIOBase`): text file to write each record to as a JSON line, or :obj:`None`
+        callbacks (:obj:`list` of :obj:`callable`): functions to call with each record
+        totals (:obj:`dict`): dictionary which maps the name of each phase to the number of times it ran, its total
+            duration, and the total number of bytes it processed
+    """
+
+    def __init__(self, file=None, callbacks=None, enabled=True):
+        """
+        Args:
+            file (:obj:`io.TextIOBase`, optional): text file to write each record to as a JSON line
+            callbacks (:obj:`list` of :obj:`callable`, optional): functions to call with each record
+            enabled (:obj:`bool`, optional): if :obj:`False`, don't time or record phases
+        """
+        self.enabled = enabled
+        self.file = file
+        self.callbacks = list(callbacks or [])
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, event, **fields):
+        """ Time a phase
+
+        Args:
+            event (:obj:`str`): name of the phase
+            **fields: fields which describe the phase
+
+        Yields:
+            :obj:`dict`: record of the phase, to which fields such as `bytes` can be added while the phase runs
+        """
+        record = dict(fields)
+        if not self.enabled:
+            yield record
+            return
+
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as error:
+            record['error'] = str(error) or error.__class__.__name__
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['time'] = start_time
+            record['event'] = event
+            self.record(record)
+
+    def record(self, record):
+        """ Record a phase
+
+        Args:
+            record (:obj:`dict`): record of the phase
+        """
+        with self._lock:
+            total = self.totals.setdefault(record['event'], {'count': 0, 'seconds': 0., 'bytes': 0})
+            total['count'] += 1
+            total['seconds'] += record['seconds']
+            total['bytes'] += record.get('bytes', 0) or 0
+            if self.file is not None:
+                self.file.write(json.dumps(record, sort_keys=True) + '\n')
+                self.file.flush()
+        for callback in self.callbacks:
+            callback(record)
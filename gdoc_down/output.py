@@ -0,0 +1,205 @@
+"""
+Locking and flushing of output files, so that concurrent downloads of a file never clobber each other and saved files
+survive crashes
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+import hashlib
+import os
+import threading
+
+
+class OutputLock(object):
+    """ Exclusive lock on an output file, which serializes the writes to the file by the threads of a process and,
+    on platforms which support `fcntl`, by processes
+
+    Threads are serialized by a lock per output file. Processes are serialized by an advisory lock on a lock file
+    in :obj:`DIRNAME`, rather than on the output file itself, because output files are atomically replaced, and
+    rather than next to the output file, so that output directories aren't cluttered with lock files.
+
+    Each output file is hashed into one of :obj:`N_STRIPES` lock files, so that the number of lock files is bounded
+    regardless of how many files are written. Writes of different files in the same stripe by different processes
+    are therefore also serialized. Within a process, the threads which write files of the same stripe share one
+    lock on the stripe, which is held until the last of them finishes, so that threads which hold several output
+    locks never wait for a stripe which their own process holds.
+
+    Attributes:
+        path (:obj:`str`): real path to the output file
+        lock_path (:obj:`str`): path to the lock file of the stripe of the output file
+    """
+
+    DIRNAME = os.path.join(os.path.expanduser('~'), '.gdoc_down', 'locks')
+
+    N_STRIPES = 256
+
+    # locks of the output files which threads of this process hold or wait for, and the number of such threads
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    # locks of the stripes which threads of this process hold
+    _stripes = {}
+
+    def __init__(self, path):
+        """
+        Args:
+            path (:obj:`str`): path to the output file
+        """
+        self.path = os.path.realpath(path)
+        stripe = int(hashlib.sha1(self.path.encode('utf-8')).hexdigest(), 16) % self.N_STRIPES
+        self.lock_path = os.path.join(self.DIRNAME, '{:03d}.lock'.format(stripe))
+        self._stripe = None
+
+    def __enter__(self):
+        with self._thread_locks_lock:
+            thread_lock = self._thread_locks.setdefault(self.path, [threading.Lock(), 0])
+            thread_lock[1] += 1
+            stripe = self._stripes.setdefault(self.lock_path, _Stripe())
+        thread_lock[0].acquire()
+
+        try:
+            stripe.acquire(self.DIRNAME, self.lock_path)
+        except BaseException:
+            self._release()
+            raise
+        self._stripe = stripe
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+
+    def _release(self):
+        """ Release the lock among processes and then among the threads of this process """
+        if self._stripe is not None:
+            self._stripe.release()
+            self._stripe = None
+        with self._thread_locks_lock:
+            thread_lock = self._thread_locks[self.path]
+            thread_lock[0].release()
+            thread_lock[1] -= 1
+            if thread_lock[1] == 0:
+                self._thread_locks.pop(self.path)
+
+
+class _Stripe(object):
+    """ Advisory lock on the lock file of a stripe of output files, which is shared by the threads of a process
+
+    Attributes:
+        holders (:obj:`int`): number of threads of this process which hold the lock
+    """
+
+    def __init__(self):
+        self.holders = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, dirname, lock_path):
+        """ Acquire the lock, if no other thread of this process holds it
+
+        Args:
+            dirname (:obj:`str`): directory of the lock file
+            lock_path (:obj:`str`): path to the lock file
+        """
+        with self._lock:
+            if self.holders == 0:
+                try:
+                    import fcntl
+                except ImportError:
+                    fcntl = None
+                if fcntl is not None:
+                    os.makedirs(dirname, exist_ok=True)
+                    file = open(lock_path, 'a')
+                    try:
+                        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+                    except BaseException:
+                        file.close()
+                        raise
+                    self._file = file
+            self.holders += 1
+
+    def release(self):
+        """ Release the lock, if no other thread of this process holds it """
+        with self._lock:
+            self.holders -= 1
+            if self.holders == 0 and self._file is not None:
+                # closing the lock file releases the lock
+                self._file.close()
+                self._file = None
+
+
+def get_temp_path(path, dirname=None):
+    """ Get a unique path for a temporary file in the same directory as a file
+
+    Args:
+        path (:obj:`str`): path to file
+        dirname (:obj:`str`, optional): directory of the temporary file, if not the directory of the file; must be on
+            the same file system as the file
+
+    Returns:
+        :obj:`str`: path to temporary file
+    """
+    path_dirname, basename = os.path.split(path)
+    return os.path.join(path_dirname if dirname is None else dirname,
+                        '.{}.{}.{}.tmp'.format(basename, os.getpid(), threading.get_ident()))
+
+
+def write_atomically(path, write, fsync=False, mode=0o666, tmp_dirname=None):
+    """ Write a file into a temporary file, and then atomically replace the file, so that the file is never partially
+    written and is left unchanged if writing fails
+
+    Concurrent writes to the file aren't serialized; callers which need to serialize them should hold an
+    :obj:`OutputLock` on the file.
+
+    Args:
+        path (:obj:`str`): path to the file
+        write (:obj:`callable`): function which writes the content of the file to a binary file object
+        fsync (:obj:`bool`, optional): if :obj:`True`, flush the file and its directory to disk
+        mode (:obj:`int`, optional): permissions of the file, before the umask is applied
+        tmp_dirname (:obj:`str`, optional): directory of the temporary file, if not the directory of the file
+    """
+    tmp_path = get_temp_path(path, dirname=tmp_dirname)
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), mode)
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+            if fsync:
+                fsync_file(file)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fsync:
+        fsync_directory(os.path.dirname(path))
+
+
+def fsync_file(file):
+    """ Flush a file to disk
+
+    Args:
+        file (:obj:`io.IOBase`): file object
+    """
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def fsync_directory(dirname):
+    """ Flush a directory to disk, e.g., so that a file which was renamed into it survives a crash
+
+    Args:
+        dirname (:obj:`str`): directory
+    """
+    try:
+        fd = os.open(dirname or '.', os.O_RDONLY)
+    except OSError:
+        # directories can't be opened on some platforms, such as Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,299 @@
+"""
+Retrying of failed Google API requests and limiting of the rate of Google API requests
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """ Policy for retrying Google API requests which failed because of transient errors or rate limits
+
+    Requests are retried after exponentially increasing delays with full jitter (a random delay between zero and the
+    exponential delay), or after the delay requested by the `Retry-After` header of the response, whichever is longer.
+
+    Attributes:
+        max_retries (:obj:`int`): maximum number of times to retry each request
+        initial_delay (:obj:`float`): maximum delay in seconds before the first retry
+        max_delay (:obj:`float`): maximum delay in seconds before each retry, excluding delays requested by
+            `Retry-After` headers
+        multiplier (:obj:`float`): factor by which the maximum delay increases after each retry
+        retries (:obj:`int`): number of requests which have been retried
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+    def __init__(self, max_retries=5, initial_delay=1., max_delay=32., multiplier=2.):
+        """
+        Args:
+            max_retries (:obj:`int`, optional): maximum number of times to retry each request
+            initial_delay (:obj:`float`, optional): maximum delay in seconds before the first retry
+            max_delay (:obj:`float`, optional): maximum delay in seconds before each retry, excluding delays
+                requested by `Retry-After` headers
+            multiplier (:obj:`float`, optional): factor by which the maximum delay increases after each retry
+        """
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, rate_limiter=None, tokens=1.):
+        """ Call a function which makes a Google API request, retrying it if it fails with a transient error
+
+        Args:
+            func (:obj:`callable`): function which makes the request
+            rate_limiter (:obj:`TokenBucket`, optional): rate limiter to acquire a token from before each attempt; when
+                a request is rate limited, the rate limiter is paused so that concurrent requests also back off
+            tokens (:obj:`float`, optional): number of tokens to acquire before each attempt, e.g., the number of
+                requests in a batch request
+
+        Returns:
+            :obj:`object`: return value of :obj:`func`
+        """
+        i_attempt = 0
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire(tokens)
+            try:
+                return func()
+            except Exception as error:
+                delay = self.get_retry_delay(error, i_attempt, rate_limiter=rate_limiter)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                i_attempt += 1
+
+    async def call_async(self, func, rate_limiter=None, retryable_errors=()):
+        """ Await a coroutine function which makes a Google API request, retrying it if it fails with a transient
+        error, without blocking the event loop
+
+        Args:
+            func (:obj:`callable`): coroutine function which makes the request
+            rate_limiter (:obj:`TokenBucket`, optional): rate limiter to take a token from before each attempt
+            retryable_errors (:obj:`tuple` of :obj:`type`, optional): additional types of errors to retry, such as the
+                connection errors of an asynchronous HTTP client
+
+        Returns:
+            :obj:`object`: return value of :obj:`func`
+        """
+        import asyncio
+
+        i_attempt = 0
+        while True:
+            if rate_limiter is not None:
+                wait = rate_limiter.reserve()
+                if wait > 0.:
+                    await asyncio.sleep(wait)
+            try:
+                return await func()
+            except Exception as error:
+                delay = self.get_retry_delay(error, i_attempt, rate_limiter=rate_limiter,
+                                             retryable_errors=retryable_errors)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                i_attempt += 1
+
+    def get_retry_delay(self, error, i_attempt, rate_limiter=None, retryable_errors=()):
+        """ Decide whether to retry a failed request, and if so count the retry, pause the rate limiter if the request
+        was rate limited, and get the delay before retrying the request
+
+        Args:
+            error (:obj:`Exception`): error
+            i_attempt (:obj:`int`): number of times the request has already been retried
+            rate_limiter (:obj:`TokenBucket`, optional): rate limiter
+            retryable_errors (:obj:`tuple` of :obj:`type`, optional): additional types of errors to retry
+
+        Returns:
+            :obj:`float`: delay in seconds, or :obj:`None` if the request shouldn't be retried
+        """
+        if i_attempt >= self.max_retries or not (isinstance(error, retryable_errors) or self.is_retryable(error)):
+            return None
+        delay = self.get_delay(i_attempt, self.get_retry_after(error))
+        with self._lock:
+            self.retries += 1
+        if rate_limiter is not None and self.is_rate_limited(error):
+            rate_limiter.pause(delay)
+        return delay
+
+    def get_delay(self, i_attempt, retry_after=None):
+        """ Get the delay before retrying a request
+
+        Args:
+            i_attempt (:obj:`int`): number of times the request has already been retried
+            retry_after (:obj:`float`, optional): delay in seconds requested by the `Retry-After` header
+
+        Returns:
+            :obj:`float`: delay in seconds
+        """
+        delay = random.uniform(0., min(self.max_delay, self.initial_delay * self.multiplier ** i_attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @classmethod
+    def is_retryable(cls, error):
+        """ Determine whether a request which failed with an error should be retried
+
+        Args:
+            error (:obj:`Exception`): error
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the request should be retried
+        """
+        if isinstance(error, (ConnectionError, socket.timeout)):
+            return True
+        return cls.get_status(error) in cls.RETRY_STATUSES or cls.is_rate_limited(error)
+
+    @classmethod
+    def is_rate_limited(cls, error):
+        """ Determine whether a request failed because a rate limit was exceeded
+
+        Args:
+            error (:obj:`Exception`): error
+
+        Returns:
+            :obj:`bool`: :obj:`True` if a rate limit was exceeded
+        """
+        status = cls.get_status(error)
+        return status == 429 or (status == 403 and cls.get_reason(error) in cls.RATE_LIMIT_REASONS)
+
+    @staticmethod
+    def get_status(error):
+        """ Get the HTTP status of the response of a failed request
+
+        Args:
+            error (:obj:`Exception`): error, such as a :obj:`googleapiclient.errors.HttpError`
+
+        Returns:
+            :obj:`int`: HTTP status, or :obj:`None` if the request didn't receive a response
+        """
+        status = getattr(getattr(error, 'resp', None), 'status', None)
+        return int(status) if status is not None else None
+
+    @staticmethod
+    def get_reason(error):
+        """ Get the reason that the Google API reported for a failed request
+
+        Args:
+            error (:obj:`Exception`): error, such as a :obj:`googleapiclient.errors.HttpError`
+
+        Returns:
+            :obj:`str`: reason, such as `userRateLimitExceeded`, or :obj:`None` if no reason was reported
+        """
+        content = getattr(error, 'content', None)
+        try:
+            return json.loads(content.decode('utf-8') if isinstance(content, bytes) else content)['error']['errors'][0]['reason']
+        except (TypeError, ValueError, KeyError, IndexError):
+            return None
+
+    @staticmethod
+    def get_retry_after(error):
+        """ Get the delay requested by the `Retry-After` header of the response of a failed request
+
+        Args:
+            error (:obj:`Exception`): error, such as a :obj:`googleapiclient.errors.HttpError`
+
+        Returns:
+            :obj:`float`: delay in seconds, or :obj:`None` if the response didn't have a `Retry-After` header
+        """
+        resp = getattr(error, 'resp', None)
+        value = resp.get('retry-after', None) if hasattr(resp, 'get') else None
+        if value is None:
+            return None
+        try:
+            return max(0., float(value))
+        except ValueError:
+            pass
+        import email.utils
+        try:
+            return max(0., email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenBucket(object):
+    """ Token bucket which limits the rate of requests that threads make
+
+    Each request takes one token. Tokens are added at a constant rate, up to the capacity of the bucket. Requests
+    which arrive when the bucket is empty wait for the next token.
+
+    Attributes:
+        rate (:obj:`float`): number of tokens added per second
+        capacity (:obj:`float`): maximum number of tokens, i.e., the maximum number of requests in a burst
+        throttled (:obj:`int`): number of requests which had to wait for a token
+        throttled_time (:obj:`float`): total seconds that requests waited for tokens
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (:obj:`float`): number of tokens added per second
+            capacity (:obj:`float`, optional): maximum number of tokens; defaults to :obj:`rate`
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.throttled = 0
+        self.throttled_time = 0.
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.):
+        """ Take a token, waiting until one is available
+
+        Args:
+            tokens (:obj:`float`, optional): number of tokens to take, e.g., the number of requests in a batch request
+
+        Returns:
+            :obj:`float`: seconds waited
+        """
+        wait = self.reserve(tokens)
+        if wait > 0.:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self, tokens=1.):
+        """ Take a token without waiting for it, e.g., so that a coroutine can wait for the token without blocking
+        the event loop
+
+        Args:
+            tokens (:obj:`float`, optional): number of tokens to take
+
+        Returns:
+            :obj:`float`: seconds to wait before the token is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # reserve a token, so that waiting threads are served in the order they arrive
+            self._tokens -= tokens
+            wait = max(-self._tokens / self.rate, self._paused_until - now)
+            if wait > 0.:
+                self.throttled += 1
+                self.throttled_time += wait
+            return max(wait, 0.)
+
+    def pause(self, seconds):
+        """ Stop handing out tokens for a time, e.g., because Google reported that a rate limit was exceeded
+
+        Args:
+            seconds (:obj:`float`): seconds to pause
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
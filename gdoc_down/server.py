@@ -0,0 +1,272 @@
+"""
+Long-running server which keeps an authenticated :obj:`GDocDown` and its HTTP connections open between downloads,
+and a client which submits downloads to the server
+
+The server listens on a Unix socket which is only accessible to the user who started the server.
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from .core import DownloadResult
+import http.client
+import http.server
+import json
+import os
+import socket
+import socketserver
+
+
+class GDocDownServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Server which downloads Google documents, presentations, and workbooks on behalf of clients
+
+    The downloads of all clients run on one pool of worker threads. Because the threads live as long as the server,
+    the HTTP connection that each thread opens to Google Drive is reused by subsequent downloads.
+
+    Attributes:
+        socket_path (:obj:`str`): path to the Unix socket that the server listens on
+        downloader (:obj:`GDocDown`): downloader
+        executor (:obj:`concurrent.futures.ThreadPoolExecutor`): pool of threads which run the downloads
+    """
+
+    SOCKET_PATH = os.path.expanduser('~/.gdoc_down/server.sock')
+
+    daemon_threads = True
+
+    def __init__(self, downloader, socket_path=None, max_workers=None):
+        """
+        Args:
+            downloader (:obj:`GDocDown`): downloader
+            socket_path (:obj:`str`, optional): path to the Unix socket that the server should listen on
+            max_workers (:obj:`int`, optional): maximum number of files to download concurrently
+
+        Raises:
+            :obj:`Exception`: if another server is already listening on the socket
+        """
+        import concurrent.futures
+
+        self.socket_path = socket_path or self.SOCKET_PATH
+        self.downloader = downloader
+
+        dirname = os.path.dirname(self.socket_path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.remove_stale_socket(self.socket_path)
+
+        umask = os.umask(0o077)
+        try:
+            super(GDocDownServer, self).__init__(self.socket_path, GDocDownRequestHandler)
+        finally:
+            os.umask(umask)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or downloader.max_workers)
+
+    def server_close(self):
+        """ Stop listening, wait for the running downloads to finish, close the downloader, and remove the socket """
+        super(GDocDownServer, self).server_close()
+        self.executor.shutdown()
+        self.downloader.close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def remove_stale_socket(socket_path):
+        """ Remove a socket left behind by a server which is no longer running
+
+        Args:
+            socket_path (:obj:`str`): path to the socket
+
+        Raises:
+            :obj:`Exception`: if a server is listening on the socket
+        """
+        if not os.path.exists(socket_path):
+            return
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)
+        else:
+            raise Exception('A server is already listening on "{}"'.format(socket_path))
+        finally:
+            sock.close()
+
+
+class GDocDownRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Handler for the requests of :obj:`GDocDownClient`
+
+    * `GET /status`: get the number of manifest hits and misses, retried requests, and throttled requests of the server
+    * `POST /download`: download files and return the result of each download
+    """
+
+    def do_GET(self):
+        if self.path == '/status':
+            downloader = self.server.downloader
+            self.send_json(200, {
+                'pid': os.getpid(),
+                'hits': downloader.manifest.hits,
+                'misses': downloader.manifest.misses,
+                'retries': downloader.retry_policy.retries,
+                'throttled': downloader.rate_limiter.throttled,
+                'throttled_time': downloader.rate_limiter.throttled_time,
+            })
+        else:
+            self.send_json(404, {'error': 'Unknown path "{}"'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/download':
+            self.send_json(404, {'error': 'Unknown path "{}"'.format(self.path)})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            results = self.server.downloader.download_many(
+                body['google_files'], format=body.get('format', 'docx'), out_path=body.get('out_path', '.'),
+                extension=body.get('extension', None), force=body.get('force', False), executor=self.server.executor)
+        except Exception as error:
+            self.send_json(400, {'error': str(error)})
+            return
+
+        self.send_json(200, {'results': [{
+            'google_file': result.google_file,
+            'out_file': result.out_file,
+            'up_to_date': result.up_to_date,
+            'error': None if result.success else str(result.error),
+        } for result in results]})
+
+    def send_json(self, status, body):
+        """ Send a JSON response
+
+        Args:
+            status (:obj:`int`): HTTP status code
+            body (:obj:`dict`): body of the response
+        """
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        return self.server.socket_path
+
+
+class GDocDownClient(object):
+    """ Client which submits downloads to a :obj:`GDocDownServer`
+
+    Attributes:
+        socket_path (:obj:`str`): path to the Unix socket that the server listens on
+        timeout (:obj:`float`): seconds to wait for the server to respond, or :obj:`None` to wait indefinitely
+    """
+
+    def __init__(self, socket_path=None, timeout=None):
+        """
+        Args:
+            socket_path (:obj:`str`, optional): path to the Unix socket that the server listens on
+            timeout (:obj:`float`, optional): seconds to wait for the server to respond
+        """
+        self.socket_path = socket_path or GDocDownServer.SOCKET_PATH
+        self.timeout = timeout
+
+    def download_many(self, google_files, format='docx', out_path='.', extension=None, force=False):
+        """ Download several Google documents, presentations, and/or workbooks with the server
+
+        Relative paths are resolved against the working directory of the client.
+
+        Args:
+            google_files (:obj:`list` of :obj:`str`): paths to Google documents, presentations, and/or workbooks
+            format (:obj:`str`, optional): desired output format (docx, html, odt, pdf, rtf, tex, txt, etc)
+            out_path (:obj:`str`, optional): directory to save documents, presentations, and workbooks
+            extension (:obj:`str`, optional): extension to documents, presentations, and workbooks
+            force (:obj:`bool`, optional): if :obj:`True`, download files even if the local copies are up to date
+
+        Returns:
+            :obj:`list` of :obj:`DownloadResult`: result of each download, in the same order as :obj:`google_files`;
+                duplicate paths are downloaded once
+
+        Raises:
+            :obj:`Exception`: if the server rejects the downloads
+        """
+        abs_google_files = {}
+        for google_file in google_files:
+            abs_google_files.setdefault(os.path.abspath(google_file), google_file)
+
+        response = self.request('POST', '/download', {
+            'google_files': [os.path.abspath(google_file) for google_file in google_files],
+            'format': format,
+            'out_path': os.path.abspath(out_path),
+            'extension': extension,
+            'force': force,
+        })
+
+        return [DownloadResult(abs_google_files.get(result['google_file'], result['google_file']),
+                               out_file=result['out_file'], up_to_date=result['up_to_date'],
+                               error=Exception(result['error']) if result['error'] is not None else None)
+                for result in response['results']]
+
+    def status(self):
+        """ Get the status of the server
+
+        Returns:
+            :obj:`dict`: process id, number of manifest hits and misses, number of retried requests, and number
+                and total delay of throttled requests of the server
+        """
+        return self.request('GET', '/status')
+
+    def request(self, method, path, body=None):
+        """ Send a request to the server
+
+        Args:
+            method (:obj:`str`): HTTP method
+            path (:obj:`str`): path of the request
+            body (:obj:`dict`, optional): body of the request
+
+        Returns:
+            :obj:`dict`: body of the response
+
+        Raises:
+            :obj:`Exception`: if the server responds with an error
+        """
+        connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        try:
+            if body is None:
+                connection.request(method, path)
+            else:
+                connection.request(method, path, body=json.dumps(body).encode('utf-8'),
+                                   headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            content = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise Exception(content['error'])
+        return content
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTP connection over a Unix socket
+
+    Attributes:
+        socket_path (:obj:`str`): path to the Unix socket
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        """
+        Args:
+            socket_path (:obj:`str`): path to the Unix socket
+            timeout (:obj:`float`, optional): seconds to wait for the server to respond
+        """
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
@@ -0,0 +1,451 @@
+"""
+Content-addressed store of exports of Google documents, presentations, and workbooks which can be shared by several
+output directories
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from .output import OutputLock, fsync_directory, fsync_file, write_atomically
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import threading
+
+
+class ExportStore(object):
+    """ Store of exports of Google documents, presentations, and workbooks, which is used to save a file in a format
+    without exporting it again if the same version of the file was already saved in the format, e.g., into another
+    checkout directory
+
+    The content of each export is stored once under its SHA-256 hash (`objects/`), and each version of each
+    Google document, presentation, and workbook in each format is recorded by an entry which points to the content
+    (`entries/`). Files are saved from the store by reflinking, hardlinking, or copying the content, in that order of
+    preference. Because several files may be hardlinked to the same content, the content is read-only.
+
+    The total size of the content is limited by evicting the least recently used content. The time that an entry was
+    last used is recorded by the modification time of the entry.
+
+    Attributes:
+        dirname (:obj:`str`): directory of the store
+        max_size (:obj:`int`): maximum total size in bytes of the content of the store
+        link_modes (:obj:`tuple` of :obj:`str`): methods to try, in order, to save files from the store
+            (`reflink`, `hardlink`, and/or `copy`)
+        fsync (:obj:`bool`): if :obj:`True`, flush content and saved files to disk before they are renamed into place
+        hits (:obj:`int`): number of files which were saved from the store
+        misses (:obj:`int`): number of files which weren't in the store
+    """
+
+    DIRNAME = os.path.join(os.path.expanduser('~'), '.gdoc_down', 'store')
+
+    MAX_SIZE = 1024 ** 3
+
+    LINK_MODES = ('reflink', 'hardlink', 'copy')
+
+    # fraction of the maximum size to evict down to when the maximum size is exceeded
+    PRUNE_FRACTION = 0.9
+
+    # ioctl request to clone a file on Linux file systems which support copy-on-write, such as Btrfs and XFS
+    FICLONE = 0x40049409
+
+    def __init__(self, dirname=None, max_size=None, link_modes=None, fsync=False):
+        """
+        Args:
+            dirname (:obj:`str`, optional): directory of the store
+            max_size (:obj:`int`, optional): maximum total size in bytes of the content of the store
+            link_modes (:obj:`tuple` of :obj:`str`, optional): methods to try, in order, to save files from the store
+            fsync (:obj:`bool`, optional): if :obj:`True`, flush content and saved files to disk, so that they survive
+                crashes, at the cost of throughput
+        """
+        self.dirname = dirname or self.DIRNAME
+        self.max_size = max_size or self.MAX_SIZE
+        self.link_modes = link_modes or self.LINK_MODES
+        self.fsync = fsync
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+        for sub_dirname in ['objects', 'entries', 'tmp']:
+            os.makedirs(os.path.join(self.dirname, sub_dirname), exist_ok=True)
+
+    def get(self, google_id, format, metadata):
+        """ Get the path to the content of a version of a Google document, presentation, or workbook in a format
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+
+        Returns:
+            :obj:`str`: path to the content, or :obj:`None` if the version isn't in the store
+        """
+        entry_path = self.get_entry_path(google_id, format, metadata)
+        if entry_path is None:
+            return None
+        try:
+            with open(entry_path, 'r') as file:
+                entry = json.load(file)
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+        object_path = self.get_object_path(entry['hash'])
+        return object_path if os.path.isfile(object_path) else None
+
+    def materialize(self, google_id, format, metadata, out_file):
+        """ Save a version of a Google document, presentation, or workbook in a format from the store
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+            out_file (:obj:`str`): path to save the file
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the file was saved, :obj:`False` if the version isn't in the store
+        """
+        object_path = self.get(google_id, format, metadata)
+        saved = False
+        if object_path is not None:
+            try:
+                self.link(object_path, out_file)
+                saved = True
+            except FileNotFoundError:
+                # the content was evicted by another process
+                pass
+
+        with self._lock:
+            if saved:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return saved
+
+    def put(self, google_id, format, metadata, write):
+        """ Add a version of a Google document, presentation, or workbook in a format to the store
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+            write (:obj:`callable`): function which writes the content to a binary file object
+
+        Returns:
+            :obj:`str`: path to the content
+        """
+        tmp_path = os.path.join(self.dirname, 'tmp', '{}.{}.tmp'.format(os.getpid(), threading.get_ident()))
+        try:
+            with open(tmp_path, 'xb') as file:
+                writer = HashingWriter(file)
+                write(writer)
+                if self.fsync:
+                    fsync_file(file)
+            object_path = self.get_object_path(writer.hash.hexdigest())
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            if os.path.isfile(object_path):
+                os.remove(tmp_path)
+                new_size = 0
+            else:
+                os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(tmp_path, object_path)
+                if self.fsync:
+                    fsync_directory(os.path.dirname(object_path))
+                new_size = writer.size
+        except Exception:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        entry_path = self.get_entry_path(google_id, format, metadata)
+        if entry_path is not None:
+            self.write_json(entry_path, {
+                'google_id': google_id,
+                'format': format,
+                'modifiedTime': metadata.get('modifiedTime', None),
+                'version': metadata.get('version', None),
+                'hash': writer.hash.hexdigest(),
+                'size': writer.size,
+            })
+
+        with self._lock:
+            if self._size is None:
+                self._size = self.get_size()
+            else:
+                self._size += new_size
+            over_max_size = self._size > self.max_size
+        if over_max_size:
+            # evict down to a lower size so that the store isn't scanned each time content is added
+            self.prune(max_size=int(self.PRUNE_FRACTION * self.max_size), keep=object_path)
+
+        return object_path
+
+    def link(self, object_path, out_file):
+        """ Atomically save a file from the content of the store
+
+        Concurrent writes to the file, by threads or by processes, are serialized with an :obj:`OutputLock`.
+
+        Args:
+            object_path (:obj:`str`): path to the content
+            out_file (:obj:`str`): path to save the file
+        """
+        tmp_file = os.path.join(os.path.dirname(out_file), '.{}.{}.{}.tmp'.format(
+            os.path.basename(out_file), os.getpid(), threading.get_ident()))
+        with OutputLock(out_file):
+            try:
+                for link_mode in self.link_modes:
+                    try:
+                        if link_mode == 'reflink':
+                            self.reflink(object_path, tmp_file)
+                        elif link_mode == 'hardlink':
+                            os.link(object_path, tmp_file)
+                        elif link_mode == 'copy':
+                            shutil.copyfile(object_path, tmp_file)
+                        else:
+                            raise Exception('Unknown link mode "{}"'.format(link_mode))
+                        break
+                    except FileNotFoundError:
+                        raise
+                    except OSError:
+                        if os.path.isfile(tmp_file):
+                            os.remove(tmp_file)
+                        if link_mode == self.link_modes[-1]:
+                            raise
+                if self.fsync and link_mode != 'hardlink':
+                    with open(tmp_file, 'rb') as file:
+                        fsync_file(file)
+                os.replace(tmp_file, out_file)
+            except Exception:
+                if os.path.isfile(tmp_file):
+                    os.remove(tmp_file)
+                raise
+        if self.fsync:
+            fsync_directory(os.path.dirname(out_file))
+
+    @classmethod
+    def reflink(cls, src, dst):
+        """ Clone a file into a new file which shares its storage until either file is modified
+
+        Args:
+            src (:obj:`str`): path to the file
+            dst (:obj:`str`): path to the clone
+
+        Raises:
+            :obj:`OSError`: if the file system doesn't support cloning files
+        """
+        try:
+            import fcntl
+        except ImportError:
+            raise OSError('Files cannot be cloned on this platform')
+        with open(src, 'rb') as src_file:
+            with open(dst, 'xb') as dst_file:
+                fcntl.ioctl(dst_file.fileno(), cls.FICLONE, src_file.fileno())
+
+    def prune(self, max_size=None, keep=None):
+        """ Evict the least recently used content until the total size of the content is at most :obj:`max_size`
+
+        Args:
+            max_size (:obj:`int`, optional): maximum total size in bytes; defaults to the maximum size of the store
+            keep (:obj:`str`, optional): path to content which shouldn't be evicted
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`int`: number of evicted content files
+                * :obj:`int`: number of bytes evicted
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        # determine when each content file was last used
+        objects = {}
+        for object_path, size in self.iter_objects():
+            objects[object_path] = {'size': size, 'last_used': 0., 'entry_paths': []}
+        for entry_path, entry, last_used in self.iter_entries():
+            obj = objects.get(self.get_object_path(entry['hash']), None)
+            if obj is None:
+                os.remove(entry_path)
+            else:
+                obj['last_used'] = max(obj['last_used'], last_used)
+                obj['entry_paths'].append(entry_path)
+
+        size = sum(obj['size'] for obj in objects.values())
+        n_evicted = 0
+        n_bytes_evicted = 0
+        for object_path, obj in sorted(objects.items(), key=lambda item: item[1]['last_used']):
+            if size <= max_size:
+                break
+            if object_path == keep:
+                continue
+            for entry_path in obj['entry_paths']:
+                self.remove(entry_path)
+            self.remove(object_path)
+            size -= obj['size']
+            n_evicted += 1
+            n_bytes_evicted += obj['size']
+
+        with self._lock:
+            self._size = size
+        return (n_evicted, n_bytes_evicted)
+
+    def get_stats(self):
+        """ Get statistics about the store
+
+        Returns:
+            :obj:`dict`: number of entries, number and total size of the content files, maximum size, and number of
+                hits and misses
+        """
+        objects = list(self.iter_objects())
+        return {
+            'dirname': self.dirname,
+            'entries': len(list(self.iter_entries())),
+            'objects': len(objects),
+            'size': sum(size for _, size in objects),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def get_size(self):
+        """ Get the total size of the content of the store
+
+        Returns:
+            :obj:`int`: total size in bytes
+        """
+        return sum(size for _, size in self.iter_objects())
+
+    def iter_objects(self):
+        """ Iterate over the content files of the store
+
+        Yields:
+            :obj:`tuple`: path and size of each content file
+        """
+        objects_dirname = os.path.join(self.dirname, 'objects')
+        for sub_dirname in os.listdir(objects_dirname):
+            for entry in os.scandir(os.path.join(objects_dirname, sub_dirname)):
+                try:
+                    yield (entry.path, entry.stat().st_size)
+                except FileNotFoundError:
+                    pass
+
+    def iter_entries(self):
+        """ Iterate over the entries of the store
+
+        Yields:
+            :obj:`tuple`: path, content, and time of last use of each entry
+        """
+        for dir_entry in os.scandir(os.path.join(self.dirname, 'entries')):
+            try:
+                last_used = dir_entry.stat().st_mtime
+                with open(dir_entry.path, 'r') as file:
+                    entry = json.load(file)
+            except (OSError, ValueError):
+                continue
+            yield (dir_entry.path, entry, last_used)
+
+    def get_entry_path(self, google_id, format, metadata):
+        """ Get the path to the entry for a version of a Google document, presentation, or workbook in a format
+
+        Args:
+            google_id (:obj:`str`): id of Google document, presentation, or workbook
+            format (:obj:`str`): output format
+            metadata (:obj:`dict`): `modifiedTime` and `version` of the Google document, presentation, or workbook
+
+        Returns:
+            :obj:`str`: path to the entry, or :obj:`None` if the metadata doesn't identify the version
+        """
+        if metadata.get('version', None) is None:
+            return None
+        key = json.dumps([google_id, format, metadata.get('modifiedTime', None), metadata['version']])
+        return os.path.join(self.dirname, 'entries', hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get_object_path(self, hash):
+        """ Get the path to content
+
+        Args:
+            hash (:obj:`str`): SHA-256 hash of the content
+
+        Returns:
+            :obj:`str`: path to the content
+        """
+        return os.path.join(self.dirname, 'objects', hash[0:2], hash)
+
+    def write_json(self, path, value):
+        """ Atomically write a JSON file
+
+        Args:
+            path (:obj:`str`): path to the file
+            value (:obj:`object`): value to write
+        """
+        write_atomically(path, lambda file: file.write(json.dumps(value).encode('utf-8')), fsync=self.fsync,
+                         tmp_dirname=os.path.join(self.dirname, 'tmp'))
+
+    @staticmethod
+    def remove(path):
+        """ Remove a file which may have already been removed by another process
+
+        Args:
+            path (:obj:`str`): path to the file
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class HashingWriter(object):
+    """ Binary file-like object which computes the SHA-256 hash and size of the data written to it
+
+    Attributes:
+        file (:obj:`io.IOBase`): binary file object to write the data to
+        hash (:obj:`hashlib.sha256`): hash of the data
+        size (:obj:`int`): number of bytes written
+    """
+
+    def __init__(self, file):
+        """
+        Args:
+            file (:obj:`io.IOBase`): binary file object to write the data to
+        """
+        self.file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        """ Write data
+
+        Args:
+            data (:obj:`bytes`): data
+
+        Returns:
+            :obj:`int`: number of bytes written
+        """
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        """ Flush the file """
+        self.file.flush()
+
+
+def parse_size(size):
+    """ Parse a size such as `500M` or `2G` into a number of bytes
+
+    Args:
+        size (:obj:`str`): size, optionally with a suffix of `K`, `M`, `G`, or `T` (powers of 1024)
+
+    Returns:
+        :obj:`int`: number of bytes
+
+    Raises:
+        :obj:`Exception`: if the size isn't valid
+    """
+    match = re.match(r'^(\d+(\.\d+)?)\s*([KMGT]?)i?B?$', size.strip(), re.IGNORECASE)
+    if not match:
+        raise Exception('Invalid size "{}"'.format(size))
+    return int(float(match.group(1)) * 1024 ** ' KMGT'.index(match.group(3).upper() or ' '))
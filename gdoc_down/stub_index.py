@@ -0,0 +1,107 @@
+"""
+Index of the ids of the Google documents, presentations, and workbooks that local stub files point to
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from .output import write_atomically
+import json
+import os
+import threading
+
+
+class StubIndex(object):
+    """ On-disk cache of the id of each stub file (e.g., `.gdoc` file), which is used to resolve the ids of large trees
+    of stubs by only reading the size and modification time of each stub
+
+    Each entry is keyed by the real path of the stub, and records the id that the stub points to and the size and
+    modification time of the stub when it was read. Stubs whose size or modification time have changed are read
+    again.
+
+    Attributes:
+        path (:obj:`str`): path to the index
+        entries (:obj:`dict`): dictionary which maps the path of each stub to its id, size, and modification time
+        hits (:obj:`int`): number of ids which were resolved from the index
+        misses (:obj:`int`): number of ids which were read from stubs
+        fsync (:obj:`bool`): if :obj:`True`, flush the index to disk when it is saved
+    """
+
+    def __init__(self, path, fsync=False):
+        """
+        Args:
+            path (:obj:`str`): path to the index
+            fsync (:obj:`bool`, optional): if :obj:`True`, flush the index to disk when it is saved
+        """
+        self.path = path
+        self.fsync = fsync
+        self.hits = 0
+        self.misses = 0
+        self._changed = False
+        self._lock = threading.Lock()
+
+        try:
+            with open(path, 'r') as file:
+                self.entries = json.load(file)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get_google_id(self, google_file):
+        """ Get the id of the Google document, presentation, or workbook that a stub points to, reading the stub only
+        if it has changed since it was last read
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+
+        Returns:
+            :obj:`str`: id of Google document, presentation, or workbook
+        """
+        key = os.path.realpath(google_file)
+        try:
+            stat = os.stat(key)
+        except OSError:
+            with self._lock:
+                if self.entries.pop(key, None) is not None:
+                    self._changed = True
+            raise
+
+        with self._lock:
+            entry = self.entries.get(key, None)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                self.hits += 1
+                return entry['doc_id']
+
+        google_id = self.read_google_id(google_file)
+        with self._lock:
+            self.misses += 1
+            self.entries[key] = {'doc_id': google_id, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+            self._changed = True
+        return google_id
+
+    @staticmethod
+    def read_google_id(google_file):
+        """ Read the id of the Google document, presentation, or workbook that a stub points to
+
+        Args:
+            google_file (:obj:`str`): path to Google document, presentation, or workbook
+
+        Returns:
+            :obj:`str`: id of Google document, presentation, or workbook
+        """
+        with open(google_file) as data_file:
+            data = json.load(data_file)
+        return data['doc_id']
+
+    def save(self):
+        """ Save the index to disk if it has changed since it was loaded or last saved """
+        with self._lock:
+            if not self._changed:
+                return
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            entries = json.dumps(self.entries).encode('utf-8')
+            write_atomically(self.path, lambda file: file.write(entries), fsync=self.fsync)
+            self._changed = False
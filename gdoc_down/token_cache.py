@@ -0,0 +1,143 @@
+"""
+Cache of the user's OAuth 2.0 token which is shared by processes, and which is refreshed before it expires
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+from .output import OutputLock, write_atomically
+import datetime
+import oauth2client.file
+import threading
+
+
+class TokenStorage(oauth2client.file.Storage):
+    """ Storage of credentials in a file, which threads and processes access under an :obj:`OutputLock`
+
+    :obj:`oauth2client` holds the lock of the storage while it refreshes credentials, and first reads the storage
+    to check whether another process has already refreshed them. Therefore, when several processes need to
+    refresh the same credentials, one process refreshes them and the others reuse its token without refreshing it
+    again. The file is written atomically, so that processes never read a partially written file.
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename (:obj:`str`): path to the credentials
+        """
+        super(TokenStorage, self).__init__(filename)
+        self._output_lock = None
+
+    def acquire_lock(self):
+        output_lock = OutputLock(self._filename)
+        output_lock.__enter__()
+        self._output_lock = output_lock
+
+    def release_lock(self):
+        output_lock, self._output_lock = self._output_lock, None
+        output_lock.__exit__(None, None, None)
+
+    def locked_put(self, credentials):
+        """ Atomically write credentials to the file, and flush it to disk, so that the user doesn't have to authorize
+        access again after a crash
+
+        Args:
+            credentials (:obj:`oauth2client.client.Credentials`): credentials
+        """
+        write_atomically(self._filename, lambda file: file.write(credentials.to_json().encode('utf-8')),
+                         fsync=True, mode=0o600)
+
+
+class TokenRefresher(object):
+    """ Refreshes credentials in a background thread :obj:`margin` seconds before their access token expires, so
+    that downloads never wait for the token to be refreshed, and never send a request with an expired token
+
+    Credentials should be stored in a :obj:`TokenStorage`, so that when several processes refresh the same
+    credentials, only the first process requests a new token.
+
+    Attributes:
+        credentials (:obj:`oauth2client.client.OAuth2Credentials`): credentials
+        margin (:obj:`float`): number of seconds before the token expires to refresh it
+        retry_interval (:obj:`float`): number of seconds to wait to try again after a refresh fails
+        refreshes (:obj:`int`): number of times the credentials were refreshed
+        error (:obj:`Exception`): error of the last refresh which failed, or :obj:`None`
+    """
+
+    MARGIN = 5 * 60.
+
+    RETRY_INTERVAL = 30.
+
+    def __init__(self, credentials, margin=None, retry_interval=None):
+        """
+        Args:
+            credentials (:obj:`oauth2client.client.OAuth2Credentials`): credentials
+            margin (:obj:`float`, optional): number of seconds before the token expires to refresh it
+            retry_interval (:obj:`float`, optional): number of seconds to wait to try again after a refresh fails
+        """
+        self.credentials = credentials
+        self.margin = self.MARGIN if margin is None else margin
+        self.retry_interval = self.RETRY_INTERVAL if retry_interval is None else retry_interval
+        self.refreshes = 0
+        self.error = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def get_time_to_refresh(self):
+        """ Get the number of seconds until the token should be refreshed
+
+        Returns:
+            :obj:`float`: number of seconds until the token should be refreshed, or :obj:`None` if the token doesn't
+                expire
+        """
+        if self.credentials.token_expiry is None:
+            return None
+        return (self.credentials.token_expiry - datetime.datetime.utcnow()).total_seconds() - self.margin
+
+    def refresh_if_expiring(self):
+        """ Refresh the credentials if their token expires within :obj:`margin` seconds
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the credentials were refreshed, or updated with a token which another process
+                refreshed
+        """
+        time_to_refresh = self.get_time_to_refresh()
+        if time_to_refresh is None or time_to_refresh > 0:
+            return False
+
+        import httplib2
+        self.credentials.refresh(httplib2.Http())
+        self.refreshes += 1
+        return True
+
+    def start(self):
+        """ Start refreshing the credentials in a background thread
+
+        Returns:
+            :obj:`TokenRefresher`: this refresher
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='gdoc_down-token-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop refreshing the credentials """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """ Refresh the credentials whenever their token is about to expire """
+        while not self._stopped.is_set():
+            try:
+                self.refresh_if_expiring()
+                timeout = self.get_time_to_refresh()
+            except Exception as error:
+                self.error = error
+                timeout = self.retry_interval
+            if timeout is None:
+                return
+            self._stopped.wait(timeout if timeout > 0 else self.retry_interval)
@@ -0,0 +1,156 @@
+"""
+Pool of authorized HTTP transports, which lets the threads of a process share one downloader
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+import threading
+import time
+import weakref
+
+
+class HttpPool(object):
+    """ Pool of :obj:`httplib2.Http` transports authorized with the same credentials
+
+    :obj:`httplib2.Http` isn't thread-safe, so each thread is leased its own transport the first time it makes a
+    request, and keeps it until the thread exits. Transports are then returned to the pool, so that the next
+    thread, e.g., the next worker of :obj:`GDocDown.download_many`, reuses the transport and its keep-alive
+    connections rather than opening new connections. Like :obj:`urllib3`'s pools, the pool never blocks: when
+    more threads than :obj:`size` make requests concurrently, additional transports are created, and only
+    :obj:`size` transports are kept when they are returned.
+
+    Keep-alive connections which have been idle for longer than :obj:`keep_alive` seconds are closed before their
+    transport is used again, because servers close idle connections and the first request on such a connection
+    would fail and have to be retried.
+
+    Attributes:
+        credentials (:obj:`oauth2client.client.OAuth2Credentials`): credentials to authorize the transports with
+        size (:obj:`int`): maximum number of idle transports to keep
+        timeout (:obj:`float`): timeout in seconds of each socket operation, or :obj:`None` for no timeout
+        keep_alive (:obj:`float`): number of seconds to keep idle connections open; `0` closes the connections of a
+            transport before each request
+        created (:obj:`int`): number of transports which were created
+        reused (:obj:`int`): number of transports which were leased to a thread from the pool
+    """
+
+    SIZE = 8
+
+    TIMEOUT = 60.
+
+    # Google's front ends close idle connections after several minutes
+    KEEP_ALIVE = 120.
+
+    def __init__(self, credentials, size=None, timeout=None, keep_alive=None):
+        """
+        Args:
+            credentials (:obj:`oauth2client.client.OAuth2Credentials`): credentials to authorize the transports with
+            size (:obj:`int`, optional): maximum number of idle transports to keep
+            timeout (:obj:`float`, optional): timeout in seconds of each socket operation
+            keep_alive (:obj:`float`, optional): number of seconds to keep idle connections open
+        """
+        self.credentials = credentials
+        self.size = self.SIZE if size is None else size
+        self.timeout = self.TIMEOUT if timeout is None else timeout
+        self.keep_alive = self.KEEP_ALIVE if keep_alive is None else keep_alive
+        self.created = 0
+        self.reused = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self):
+        """ Get the transport leased to the current thread, leasing it a transport if it doesn't have one
+
+        Returns:
+            :obj:`httplib2.Http`: authorized HTTP transport
+        """
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            lease = self._local.lease = _Lease(self._checkout())
+            # return the transport to the pool when the thread exits and its thread-local data is discarded
+            finalizer = weakref.finalize(lease, self._checkin, lease.http, lease.last_used)
+            finalizer.atexit = False
+
+        now = time.monotonic()
+        if now - lease.last_used[0] > self.keep_alive:
+            close_connections(lease.http)
+        lease.last_used[0] = now
+        return lease.http
+
+    def release(self):
+        """ Return the transport leased to the current thread to the pool, e.g., before a long-lived thread becomes
+        idle """
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            del self._local.lease
+
+    def close(self):
+        """ Close the connections of the idle transports """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for http, _ in idle:
+            close_connections(http)
+
+    def _checkout(self):
+        """ Take the most recently used idle transport, whose connections are the most likely to still be open, or
+        create a transport
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`httplib2.Http`: authorized HTTP transport
+                * :obj:`float`: time when the transport was last used
+        """
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.created += 1
+
+        import httplib2
+        return (self.credentials.authorize(httplib2.Http(timeout=self.timeout)), time.monotonic())
+
+    def _checkin(self, http, last_used):
+        """ Return a transport to the pool, or close its connections if the pool is full
+
+        Args:
+            http (:obj:`httplib2.Http`): authorized HTTP transport
+            last_used (:obj:`list` of :obj:`float`): time when the transport was last used
+        """
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((http, last_used[0]))
+                return
+        close_connections(http)
+
+
+class _Lease(object):
+    """ Lease of a transport to a thread
+
+    Attributes:
+        http (:obj:`httplib2.Http`): authorized HTTP transport
+        last_used (:obj:`list` of :obj:`float`): time when the transport was last used, in a list so that it can be
+            read after the lease is discarded
+    """
+
+    def __init__(self, http_last_used):
+        """
+        Args:
+            http_last_used (:obj:`tuple`): authorized HTTP transport and the time when it was last used
+        """
+        self.http = http_last_used[0]
+        self.last_used = [http_last_used[1]]
+
+
+def close_connections(http):
+    """ Close the keep-alive connections of a transport, without discarding its credentials
+
+    Args:
+        http (:obj:`httplib2.Http`): HTTP transport
+    """
+    connections, http.connections = http.connections, {}
+    for connection in connections.values():
+        connection.close()
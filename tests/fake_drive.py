@@ -0,0 +1,450 @@
+""" Local stand-in for the Google Drive API used to test gdoc_down without Google credentials
+
+:Author: Karr Lab
+:Date: 2026-10-18
+:Copyright: 2026, Karr Lab
+:License: MIT
+"""
+
+import googleapiclient.errors
+import httplib2
+import json
+import re
+import threading
+import time
+
+
+class FakeDriveService(object):
+    """ Fake Google Drive service which serves exports of in-memory documents
+
+    Attributes:
+        documents (:obj:`dict`): dictionary which maps the id of each document to a dictionary which maps
+            MIME types to the content of each export
+        metadata (:obj:`dict`): dictionary which maps the id of each document to its metadata such as its
+            `modifiedTime` and `version`
+        latency (:obj:`float`): seconds to wait before responding to each request
+        barrier (:obj:`threading.Barrier`): barrier which each request must pass before responding, or :obj:`None`
+        calls (:obj:`list` of :obj:`tuple`): method name and arguments of each request
+        max_concurrent_calls (:obj:`int`): maximum number of requests that were executed concurrently
+        errors (:obj:`list` of :obj:`tuple`): method name, response, and content of each error that the next requests
+            to the methods should fail with
+        change_log (:obj:`list` of :obj:`str`): id of the changed file of each change; the changes page tokens are
+            indices into the log
+        sheets (:obj:`dict`): dictionary which maps the id of each workbook to a list of its sheets, each of which is
+            a dictionary with its `sheetId`, `title`, and a dictionary which maps MIME types to the content of each
+            export (`exports`); the service is also a fake Google Sheets service, whose sheets are exported through
+            :obj:`_http`
+        export_size_limit (:obj:`int`): maximum size in bytes of the exports of the Drive API; larger exports fail,
+            and can only be downloaded from their export links or, for workbooks, sheet by sheet
+    """
+
+    def __init__(self, documents=None, latency=0., n_concurrent_calls=None):
+        """
+        Args:
+            documents (:obj:`dict`, optional): dictionary which maps the id of each document to a dictionary
+                which maps MIME types to the content of each export
+            latency (:obj:`float`, optional): seconds to wait before responding to each request
+            n_concurrent_calls (:obj:`int`, optional): if set, requests are held until this many requests
+                are in flight at once; if the client never makes this many concurrent requests, the requests
+                fail with :obj:`threading.BrokenBarrierError`
+        """
+        self.documents = documents or {}
+        self.metadata = {}
+        self.latency = latency
+        self.barrier = threading.Barrier(n_concurrent_calls, timeout=10.) if n_concurrent_calls else None
+        self.calls = []
+        self.max_concurrent_calls = 0
+        self.errors = []
+        self.change_log = []
+        self.sheets = {}
+        self.export_size_limit = None
+        self._http = FakeDocsHttp(self)
+        self._n_concurrent_calls = 0
+        self._lock = threading.Lock()
+
+    def files(self):
+        return FakeFilesResource(self)
+
+    def changes(self):
+        return FakeChangesResource(self)
+
+    def spreadsheets(self):
+        return FakeSpreadsheetsResource(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchHttpRequest(self, callback=callback)
+
+    def modify(self, file_id, exports=None):
+        """ Modify a document, incrementing its version and recording the change
+
+        Args:
+            file_id (:obj:`str`): id of the document
+            exports (:obj:`dict`, optional): dictionary which maps MIME types to the new content of each export
+        """
+        if exports:
+            self.documents.setdefault(file_id, {}).update(exports)
+        metadata = self.metadata.setdefault(file_id, {'modifiedTime': '2026-01-01T00:00:00.000Z', 'version': '1'})
+        metadata['version'] = str(int(metadata['version']) + 1)
+        self.change_log.append(file_id)
+
+    def call(self, method, **kwargs):
+        """ Record a request and wait for the configured latency
+
+        Args:
+            method (:obj:`str`): name of the method
+            **kwargs: arguments to the method
+        """
+        with self._lock:
+            self.calls.append((method, kwargs))
+            self._n_concurrent_calls += 1
+            self.max_concurrent_calls = max(self.max_concurrent_calls, self._n_concurrent_calls)
+        try:
+            if self.barrier:
+                self.barrier.wait()
+            time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self._n_concurrent_calls -= 1
+
+    def fail(self, method, status, reason=None, retry_after=None):
+        """ Make the next request to a method fail
+
+        Args:
+            method (:obj:`str`): name of the method (`batch`, `get`, `export_chunk`, `get_spreadsheet`,
+                `export_sheet`, or `export_link`)
+            status (:obj:`int`): HTTP status of the response
+            reason (:obj:`str`, optional): reason for the error reported in the body of the response
+            retry_after (:obj:`str`, optional): value of the `Retry-After` header of the response
+        """
+        headers = {'status': status}
+        if retry_after is not None:
+            headers['retry-after'] = retry_after
+        content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason or 'backendError'}]}})
+        self.errors.append((method, httplib2.Response(headers), content.encode('utf-8')))
+
+    def pop_error(self, method):
+        """ Get the next error that a request to a method should fail with
+
+        Args:
+            method (:obj:`str`): name of the method
+
+        Returns:
+            :obj:`tuple`: response and content of the error, or :obj:`None` if the request should succeed
+        """
+        with self._lock:
+            for i_error, (error_method, resp, content) in enumerate(self.errors):
+                if error_method == method:
+                    self.errors.pop(i_error)
+                    return (resp, content)
+        return None
+
+    def get_calls(self, method):
+        """ Get the arguments of each request to a method
+
+        Args:
+            method (:obj:`str`): name of the method
+
+        Returns:
+            :obj:`list` of :obj:`dict`: arguments of each request to the method
+        """
+        return [kwargs for call_method, kwargs in self.calls if call_method == method]
+
+
+class FakeFilesResource(object):
+    """ Fake Google Drive files resource """
+
+    def __init__(self, service):
+        self.service = service
+
+    def export_media(self, fileId, mimeType):
+        return FakeMediaRequest(self.service, fileId, mimeType)
+
+    def get(self, fileId, fields=None):
+        def execute():
+            self.service.call('get', fileId=fileId, fields=fields)
+            error = self.service.pop_error('get')
+            if error:
+                raise googleapiclient.errors.HttpError(*error)
+            if fileId not in self.service.documents:
+                raise Exception('File not found: {}'.format(fileId))
+            metadata = dict(self.service.metadata.get(fileId, {'modifiedTime': '2026-01-01T00:00:00.000Z',
+                                                               'version': '1'}))
+            metadata['exportLinks'] = {mime_type: FakeDocsHttp.EXPORT_LINK.format(fileId, mime_type)
+                                       for mime_type in self.service.documents[fileId]}
+            return {field: metadata[field] for field in (fields or 'modifiedTime,version').split(',') if field in metadata}
+        return FakeRequest(execute)
+
+
+class FakeChangesResource(object):
+    """ Fake Google Drive changes resource """
+
+    def __init__(self, service):
+        self.service = service
+
+    def getStartPageToken(self, **kwargs):
+        def execute():
+            self.service.call('getStartPageToken', **kwargs)
+            return {'startPageToken': str(len(self.service.change_log))}
+        return FakeRequest(execute)
+
+    def list(self, pageToken, pageSize=100, fields=None, **kwargs):
+        def execute():
+            self.service.call('list_changes', pageToken=pageToken, pageSize=pageSize)
+            start = int(pageToken)
+            end = min(start + pageSize, len(self.service.change_log))
+            response = {'changes': [{'fileId': file_id} for file_id in self.service.change_log[start:end]]}
+            if end < len(self.service.change_log):
+                response['nextPageToken'] = str(end)
+            else:
+                response['newStartPageToken'] = str(end)
+            return response
+        return FakeRequest(execute)
+
+
+class FakeSpreadsheetsResource(object):
+    """ Fake Google Sheets spreadsheets resource """
+
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, fields=None):
+        def execute():
+            self.service.call('get_spreadsheet', spreadsheetId=spreadsheetId, fields=fields)
+            error = self.service.pop_error('get_spreadsheet')
+            if error:
+                raise googleapiclient.errors.HttpError(*error)
+            return {'sheets': [{'properties': {'sheetId': sheet['sheetId'], 'title': sheet['title'], 'index': i_sheet}}
+                               for i_sheet, sheet in enumerate(self.service.sheets[spreadsheetId])]}
+        return FakeRequest(execute)
+
+
+class FakeDocsHttp(object):
+    """ Fake HTTP transport which serves byte ranges of the exports of `docs.google.com`, i.e., of sheets and of
+    export links, which aren't limited by :obj:`FakeDriveService.export_size_limit`
+
+    Attributes:
+        service (:obj:`FakeDriveService`): service
+    """
+
+    EXPORT_LINK = 'https://docs.google.com/feeds/download/export/{}?mimeType={}'
+
+    MIME_TYPES = {
+        'csv': 'text/csv',
+        'tsv': 'text/tab-separated-values',
+    }
+
+    def __init__(self, service):
+        self.service = service
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        start, end = (int(val) for val in re.match(r'^bytes=(\d+)-(\d+)$', headers['range']).groups())
+
+        match = re.match(r'^https://docs\.google\.com/spreadsheets/d/([^/]+)/export\?format=(\w+)&gid=(\d+)$', uri)
+        if match:
+            file_id, format, sheet_id = match.groups()
+            method = 'export_sheet'
+            if start == 0:
+                self.service.call(method, fileId=file_id, format=format, sheetId=int(sheet_id))
+            sheet = [sheet for sheet in self.service.sheets[file_id] if sheet['sheetId'] == int(sheet_id)][0]
+            content = sheet['exports'][self.MIME_TYPES[format]]
+        else:
+            file_id, mime_type = re.match(r'^https://docs\.google\.com/feeds/download/export/([^?]+)\?mimeType=(.+)$',
+                                          uri).groups()
+            method = 'export_link'
+            if start == 0:
+                self.service.call(method, fileId=file_id, mimeType=mime_type)
+            content = self.service.documents[file_id][mime_type]
+
+        error = self.service.pop_error(method)
+        if error:
+            return error
+
+        chunk = content[start:end + 1]
+        return (httplib2.Response({
+            'status': 206,
+            'content-range': 'bytes {}-{}/{}'.format(start, start + len(chunk) - 1, len(content)),
+        }), chunk)
+
+
+class FakeBatchHttpRequest(object):
+    """ Fake Google API batch request, which is recorded as one request and which executes each of its requests
+
+    Attributes:
+        service (:obj:`FakeDriveService`): service
+        callback (:obj:`callable`): function which is called with the id, response, and error of each request
+        requests (:obj:`list` of :obj:`tuple`): id, request, and callback of each request
+    """
+
+    MAX_REQUESTS = 100
+
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self.requests) >= self.MAX_REQUESTS:
+            raise Exception('Batch requests can contain at most {} requests'.format(self.MAX_REQUESTS))
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self, http=None):
+        self.service.call('batch', n_requests=len(self.requests))
+        error = self.service.pop_error('batch')
+        if error:
+            raise googleapiclient.errors.HttpError(*error)
+        for request_id, request, callback in self.requests:
+            try:
+                response = request.execute()
+            except Exception as error:
+                callback(request_id, None, error)
+            else:
+                callback(request_id, response, None)
+
+
+class FakeRequest(object):
+    """ Fake Google API request """
+
+    def __init__(self, execute):
+        self._execute = execute
+
+    def execute(self, http=None, num_retries=0):
+        return self._execute()
+
+
+class FakeMediaRequest(object):
+    """ Fake Google API media request which can be downloaded in chunks with
+    :obj:`googleapiclient.http.MediaIoBaseDownload`
+
+    Attributes:
+        uri (:obj:`str`): URI of the media
+        http (:obj:`FakeHttp`): HTTP transport
+        headers (:obj:`dict`): HTTP headers
+    """
+
+    def __init__(self, service, file_id, mime_type):
+        self.uri = 'https://www.googleapis.com/drive/v3/files/{}/export?mimeType={}'.format(file_id, mime_type)
+        self.http = FakeHttp(service, file_id, mime_type)
+        self.headers = {}
+
+
+class FakeHttp(object):
+    """ Fake HTTP transport which serves byte ranges of an export
+
+    Attributes:
+        service (:obj:`FakeDriveService`): service
+        file_id (:obj:`str`): id of the document
+        mime_type (:obj:`str`): MIME type of the export
+    """
+
+    def __init__(self, service, file_id, mime_type):
+        self.service = service
+        self.file_id = file_id
+        self.mime_type = mime_type
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        start, end = (int(val) for val in re.match(r'^bytes=(\d+)-(\d+)$', headers['range']).groups())
+        if start == 0:
+            self.service.call('export', fileId=self.file_id, mimeType=self.mime_type)
+        self.service.call('export_chunk', fileId=self.file_id, mimeType=self.mime_type, start=start)
+        error = self.service.pop_error('export_chunk')
+        if error:
+            return error
+
+        content = self.service.documents[self.file_id][self.mime_type]
+        if self.service.export_size_limit is not None and len(content) > self.service.export_size_limit:
+            return (httplib2.Response({'status': 403}), json.dumps({'error': {'code': 403, 'errors': [
+                {'reason': 'exportSizeLimitExceeded', 'message': 'This file is too large to be exported.'}]}}).encode('utf-8'))
+        chunk = content[start:end + 1]
+        return (httplib2.Response({
+            'status': 206,
+            'content-range': 'bytes {}-{}/{}'.format(start, start + len(chunk) - 1, len(content)),
+        }), chunk)
+
+
+class FakeAiohttpSession(object):
+    """ Fake `aiohttp` session which sends the requests of :obj:`gdoc_down.aio.AsyncGDocDown` to a
+    :obj:`FakeDriveService`
+
+    Attributes:
+        service (:obj:`FakeDriveService`): service
+        latency (:obj:`float`): seconds to wait asynchronously before responding to each request
+        requests (:obj:`list` of :obj:`tuple`): URL, query parameters, and headers of each request
+        max_in_flight (:obj:`int`): maximum number of requests that were awaited concurrently
+    """
+
+    API_URL = 'https://www.googleapis.com/drive/v3/files'
+
+    def __init__(self, service, latency=0.):
+        """
+        Args:
+            service (:obj:`FakeDriveService`): service
+            latency (:obj:`float`, optional): seconds to wait asynchronously before responding to each request
+        """
+        self.service = service
+        self.latency = latency
+        self.requests = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append((url, params, headers))
+        return FakeAiohttpResponse(self, url, params or {}, {key.lower(): value for key, value in (headers or {}).items()})
+
+    def respond(self, url, params, headers):
+        """ Get the response to a request
+
+        Args:
+            url (:obj:`str`): URL
+            params (:obj:`dict`): query parameters
+            headers (:obj:`dict`): HTTP headers, with lower case names
+
+        Returns:
+            :obj:`tuple`: HTTP status, headers, and body of the response
+        """
+        file_id, _, action = url[len(self.API_URL) + 1:].partition('/')
+        if action == 'export':
+            resp, content = FakeHttp(self.service, file_id, params['mimeType']).request(url, headers=headers)
+            return (resp.status, {key: value for key, value in resp.items() if key != 'status'}, content)
+
+        try:
+            metadata = FakeFilesResource(self.service).get(fileId=file_id, fields=params.get('fields', None)).execute()
+        except googleapiclient.errors.HttpError as error:
+            return (error.resp.status, {key: value for key, value in error.resp.items() if key != 'status'},
+                    error.content)
+        except Exception as error:
+            return (404, {}, json.dumps({'error': {'message': str(error)}}).encode('utf-8'))
+        return (200, {'content-type': 'application/json'}, json.dumps(metadata).encode('utf-8'))
+
+
+class FakeAiohttpResponse(object):
+    """ Fake `aiohttp` response
+
+    Attributes:
+        status (:obj:`int`): HTTP status
+        headers (:obj:`dict`): HTTP headers, with lower case names
+    """
+
+    def __init__(self, session, url, params, headers):
+        self._session = session
+        self._request = (url, params, headers)
+        self.status = None
+        self.headers = None
+        self._content = None
+
+    async def __aenter__(self):
+        import asyncio
+        session = self._session
+        session._in_flight += 1
+        session.max_in_flight = max(session.max_in_flight, session._in_flight)
+        try:
+            await asyncio.sleep(session.latency)
+            self.status, self.headers, self._content = session.respond(*self._request)
+        finally:
+            session._in_flight -= 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    async def read(self):
+        return self._content
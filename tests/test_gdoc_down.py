@@ -8,21 +8,48 @@
 
 from docx import Document as DocxDocument
 from PyPDF2 import PdfFileReader
+from fake_drive import FakeAiohttpSession, FakeDriveService
 from gdoc_down.__main__ import App as cli
-from gdoc_down.core import GDocDown
-from oauth2client.client import GoogleCredentials
+from gdoc_down.aio import AsyncGDocDown
+from gdoc_down.core import BomStrippingWriter, Format, GDocDown, HtmlToLatexParser
+from gdoc_down.discovery_cache import DiscoveryCache
+from gdoc_down.manifest import Manifest
+from gdoc_down.metrics import Metrics
+from gdoc_down.output import OutputLock
+from gdoc_down.retry import RetryPolicy, TokenBucket
+from gdoc_down.server import GDocDownClient, GDocDownServer
+from gdoc_down.store import ExportStore, parse_size
+from gdoc_down.stub_index import StubIndex
+from gdoc_down.token_cache import TokenRefresher, TokenStorage
+from gdoc_down.transport import HttpPool
+from oauth2client.client import GoogleCredentials, OAuth2Credentials
 from odf import opendocument
 from odf import text as odf_text
 from xml.etree import ElementTree
 import base64
+import datetime
+import contextlib
+import apiclient
+import asyncio
+import email.utils
 import gdoc_down
+import hashlib
+import httplib2
+import io
+import json
 import mock
 import oauth2client.tools
 import os
 import sys
+import re
 import shutil
+import socket
+import subprocess
 import tempfile
+import threading
+import time
 import unittest
+import zipfile
 
 if sys.version_info < (3, 0, 0):
     import rtf2xml.ParseRtf
@@ -260,3 +287,1768 @@ class TestGDocDown(unittest.TestCase):
 
     def test_api(self):
         self.assertIsInstance(gdoc_down.GDocDown, type)
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class TestImportTime(unittest.TestCase):
+
+    HEAVY_MODULES = ('apiclient', 'googleapiclient', 'oauth2client', 'httplib2', 'bs4')
+
+    # maximum cumulative time (seconds) to import the gdoc_down package (excluding cement)
+    IMPORT_TIME_BUDGET = 0.25
+
+    def run_python(self, code, *args):
+        return subprocess.run([sys.executable] + list(args) + ['-c', code], check=True,
+                              capture_output=True, universal_newlines=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    def test_heavy_modules_not_imported(self):
+        code = ('import sys\n'
+                'sys.argv = ["gdoc-down", "--version"]\n'
+                'import gdoc_down.__main__\n'
+                'try:\n'
+                '    gdoc_down.__main__.main()\n'
+                'except SystemExit:\n'
+                '    pass\n'
+                'print("imported:", *sorted(module for module in sys.modules if module.split(".")[0] in {}))\n'
+                ).format(repr(set(self.HEAVY_MODULES)))
+        result = self.run_python(code)
+        self.assertEqual(result.stdout.strip().split('\n')[-1], 'imported:')
+
+    def test_import_time(self):
+        result = self.run_python('import gdoc_down.__main__', '-X', 'importtime')
+        cumulative_times = {}
+        for line in result.stderr.split('\n'):
+            match = re.match(r'^import time: +\d+ \| +(\d+) \| +(.*?)$', line)
+            if match:
+                cumulative_times[match.group(2).strip()] = int(match.group(1)) * 1e-6
+        self.assertLess(cumulative_times['gdoc_down'], self.IMPORT_TIME_BUDGET)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_downloads(self):
+        dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=dirname)
+        result = subprocess.run([sys.executable, os.path.join(dirname, 'benchmarks', 'downloads.py'), '--quick'],
+                                check=True, capture_output=True, universal_newlines=True, env=env)
+        report = json.loads(result.stdout.strip().split('\n')[-1])
+        self.assertEqual(sorted(report['results'].keys()), ['batch_throughput', 'convert_latex', 'download_latency'])
+        self.assertEqual([run['max_workers'] for run in report['results']['batch_throughput']['runs']], [1, 4])
+        self.assertEqual([run['size'] for run in report['results']['convert_latex']['runs']], [1024, 10240])
+        self.assertGreater(report['results']['download_latency']['peak_rss_bytes'], 0)
+
+
+class TestConvertHtmlToLatex(unittest.TestCase):
+
+    def test_convert_html_to_latex(self):
+        with open(os.path.join(FIXTURES_DIR, 'example.html.zip'), 'rb') as file:
+            html_zip_content = file.read()
+        with open(os.path.join(FIXTURES_DIR, 'example.tex'), 'rb') as file:
+            tex_content = file.read()
+
+        self.assertEqual(GDocDown.convert_html_to_latex(html_zip_content), tex_content)
+        self.assertEqual(GDocDown.convert_html_to_latex(io.BytesIO(html_zip_content)), tex_content)
+
+    def test_parser(self):
+        def convert(html, n_chars=None):
+            parser = HtmlToLatexParser()
+            if n_chars:
+                for i_char in range(0, len(html), n_chars):
+                    parser.feed(html[i_char:i_char + n_chars])
+            else:
+                parser.feed(html)
+            parser.close()
+            return ''.join(parser.tex_content)
+
+        html = ('<html><head><title>ignored</title><style>p{color:red}</style></head>'
+                '<body><p><span>a<br>b</span></p>'
+                '<p><span>c<img src="x.png">d</span></p>'
+                '<hr style="page-break-before:always;display:none;">'
+                '<p>e<span>f</span>not collected</p>'
+                '<p><span>&nbsp;&nbsp;</span><span>&amp;&#8212;\r\n</span></p>'
+                '<pre>  \n  </pre>'
+                '<p>unclosed</body></html>')
+        expected = 'a\nb\n\ncd\n\n\n\nef\n\n &\u2014\n\n\n  \n  \n\nunclosed\n\n'
+        self.assertEqual(convert(html), expected)
+        self.assertEqual(convert(html, n_chars=3), expected)
+
+
+class TestAuthenticate(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patchers = [
+            mock.patch.object(GDocDown, '_services', {}),
+            mock.patch.object(GDocDown, 'DISCOVERY_CACHE_DIR', self.cache_dir),
+            mock.patch.object(GDocDown, 'MANIFEST_PATH', os.path.join(self.cache_dir, 'manifest.json')),
+            mock.patch.object(GDocDown, 'STUB_INDEX_PATH', os.path.join(self.cache_dir, 'stubs.json')),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_discovery_cache(self):
+        cache = DiscoveryCache(os.path.join(self.cache_dir, 'discovery'), 60.)
+        self.assertEqual(cache.get('https://example.com/discovery'), None)
+
+        cache.set('https://example.com/discovery', '{"name": "drive"}')
+        self.assertEqual(cache.get('https://example.com/discovery'), '{"name": "drive"}')
+        self.assertEqual(cache.get('https://example.com/other'), None)
+
+        mtime = os.path.getmtime(cache.get_filename('https://example.com/discovery')) - 120.
+        os.utime(cache.get_filename('https://example.com/discovery'), (mtime, mtime))
+        self.assertEqual(cache.get('https://example.com/discovery'), None)
+
+    def test_share_service(self):
+        credentials = mock.Mock()
+        with mock.patch.object(apiclient.discovery, 'build', side_effect=lambda *args, **kwargs: object()) as build:
+            service = GDocDown(credentials=credentials).service
+            self.assertIs(GDocDown(credentials=credentials).service, service)
+            self.assertEqual(build.call_count, 1)
+            self.assertIsInstance(build.call_args[1]['cache'], DiscoveryCache)
+            self.assertEqual(build.call_args[1]['cache'].dirname, self.cache_dir)
+
+            self.assertIsNot(GDocDown(credentials=mock.Mock()).service, service)
+            self.assertIsNot(GDocDown(credentials=credentials, static_discovery=True).service, service)
+            self.assertEqual(build.call_count, 3)
+
+    def test_offline(self):
+        service = object()
+        with mock.patch.object(apiclient.discovery, 'build',
+                               side_effect=[httplib2.ServerNotFoundError('offline'), service]) as build:
+            self.assertIs(GDocDown(credentials=mock.Mock()).service, service)
+        self.assertEqual(build.call_args[1]['static_discovery'], True)
+
+    def test_discovery_service_unavailable(self):
+        import googleapiclient.discovery_cache
+
+        unavailable = (httplib2.Response({'status': 503}), b'unavailable')
+
+        # the bundled discovery document is used if no discovery document is cached
+        with mock.patch.object(httplib2.Http, 'request', return_value=unavailable) as request:
+            with mock.patch('time.sleep'):
+                service = GDocDown(credentials=mock.Mock()).service
+        self.assertGreater(request.call_count, 0)
+        self.assertTrue(hasattr(service.files(), 'export_media'))
+
+        # an expired cached discovery document is preferred to the bundled document
+        document = json.loads(googleapiclient.discovery_cache.get_static_doc('drive', 'v3'))
+        document['revision'] = 'cached'
+        cache = DiscoveryCache(self.cache_dir, 60.)
+        url = apiclient.discovery.DISCOVERY_URI.format(api='drive', apiVersion='v3')
+        cache.set(url, json.dumps(document))
+        mtime = os.path.getmtime(cache.get_filename(url)) - 120.
+        os.utime(cache.get_filename(url), (mtime, mtime))
+
+        GDocDown._services.clear()
+        with mock.patch.object(httplib2.Http, 'request', return_value=unavailable):
+            with mock.patch('time.sleep'):
+                service = GDocDown(credentials=mock.Mock()).service
+        self.assertEqual(service._rootDesc['revision'], 'cached')
+
+    def test_static_discovery(self):
+        with mock.patch.object(httplib2.Http, 'request', side_effect=AssertionError('no requests expected')):
+            service = GDocDown(credentials=mock.Mock(), static_discovery=True).service
+        self.assertTrue(hasattr(service.files(), 'export_media'))
+
+
+class TestHttpPool(unittest.TestCase):
+
+    def setUp(self):
+        self.credentials = mock.Mock()
+        self.credentials.authorize.side_effect = lambda http: http
+
+    def get_in_thread(self, pool):
+        https = []
+        thread = threading.Thread(target=lambda: https.append(pool.get()))
+        thread.start()
+        thread.join()
+        return https[0]
+
+    def test_lease_per_thread(self):
+        pool = HttpPool(self.credentials, size=2, timeout=5.)
+        http = pool.get()
+        self.assertIsInstance(http, httplib2.Http)
+        self.assertEqual(http.timeout, 5.)
+        self.assertIs(pool.get(), http)
+        self.credentials.authorize.assert_called_once_with(http)
+
+        https = []
+        barrier = threading.Barrier(3)
+
+        def get():
+            https.append(pool.get())
+            barrier.wait()
+
+        threads = [threading.Thread(target=get) for i_thread in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, https + [http]))), 4)
+        self.assertEqual(pool.created, 4)
+
+        # transports of exited threads are reused, and at most `size` are kept
+        self.assertEqual(len(pool._idle), 2)
+        self.assertIn(self.get_in_thread(pool), https)
+        self.assertEqual(pool.created, 4)
+        self.assertEqual(pool.reused, 1)
+
+    def test_release(self):
+        pool = HttpPool(self.credentials)
+        http = pool.get()
+        pool.release()
+        self.assertIs(self.get_in_thread(pool), http)
+        self.assertIs(pool.get(), http)
+        self.assertEqual(pool.created, 1)
+        self.assertEqual(pool.reused, 2)
+
+    def test_keep_alive(self):
+        pool = HttpPool(self.credentials, keep_alive=60.)
+        http = pool.get()
+        connection = mock.Mock()
+        http.connections['https:www.googleapis.com'] = connection
+        self.assertIs(pool.get(), http)
+        connection.close.assert_not_called()
+
+        pool.keep_alive = 0.
+        time.sleep(0.01)
+        self.assertIs(pool.get(), http)
+        connection.close.assert_called_once_with()
+        self.assertEqual(http.connections, {})
+
+    def test_close(self):
+        pool = HttpPool(self.credentials)
+        connection = mock.Mock()
+        self.get_in_thread(pool).connections['https:www.googleapis.com'] = connection
+        pool.close()
+        connection.close.assert_called_once_with()
+        self.assertEqual(pool._idle, [])
+
+    def test_gdoc_down(self):
+        with mock.patch.object(GDocDown, 'authenticate', return_value=mock.Mock()):
+            downloader = GDocDown(credentials=self.credentials, max_workers=3, http_timeout=10., http_keep_alive=30.)
+        self.assertEqual(downloader.http_pool.size, 3)
+        self.assertEqual(downloader.http_pool.timeout, 10.)
+        self.assertEqual(downloader.http_pool.keep_alive, 30.)
+        self.assertIs(downloader.get_http(), downloader.http_pool.get())
+
+        self.assertIsNone(GDocDown(credentials=self.credentials, service=mock.Mock()).get_http())
+
+
+class TestRetry(unittest.TestCase):
+
+    def make_error(self, status, reason=None, retry_after=None):
+        headers = {'status': status}
+        if retry_after is not None:
+            headers['retry-after'] = retry_after
+        content = json.dumps({'error': {'errors': [{'reason': reason or 'backendError'}]}}).encode('utf-8')
+        return apiclient.errors.HttpError(httplib2.Response(headers), content)
+
+    def test_is_retryable(self):
+        self.assertTrue(RetryPolicy.is_retryable(self.make_error(429)))
+        self.assertTrue(RetryPolicy.is_retryable(self.make_error(503)))
+        self.assertTrue(RetryPolicy.is_retryable(self.make_error(403, reason='userRateLimitExceeded')))
+        self.assertTrue(RetryPolicy.is_retryable(ConnectionResetError()))
+        self.assertFalse(RetryPolicy.is_retryable(self.make_error(403, reason='insufficientPermissions')))
+        self.assertFalse(RetryPolicy.is_retryable(self.make_error(404)))
+        self.assertFalse(RetryPolicy.is_retryable(ValueError()))
+
+        self.assertTrue(RetryPolicy.is_rate_limited(self.make_error(429)))
+        self.assertFalse(RetryPolicy.is_rate_limited(self.make_error(503)))
+
+    def test_get_retry_after(self):
+        self.assertEqual(RetryPolicy.get_retry_after(self.make_error(429)), None)
+        self.assertEqual(RetryPolicy.get_retry_after(self.make_error(429, retry_after='7')), 7.)
+        retry_after = email.utils.formatdate(time.time() + 60., usegmt=True)
+        self.assertAlmostEqual(RetryPolicy.get_retry_after(self.make_error(429, retry_after=retry_after)), 60., delta=2.)
+        self.assertEqual(RetryPolicy.get_retry_after(ValueError()), None)
+
+    def test_get_delay(self):
+        policy = RetryPolicy(initial_delay=1., max_delay=4., multiplier=2.)
+        for i_attempt, max_delay in enumerate([1., 2., 4., 4.]):
+            for i_sample in range(20):
+                self.assertLessEqual(policy.get_delay(i_attempt), max_delay)
+        self.assertGreaterEqual(policy.get_delay(0, retry_after=10.), 10.)
+
+    def test_call(self):
+        func = mock.Mock(side_effect=[self.make_error(429, retry_after='3'), self.make_error(500), 'response'])
+        policy = RetryPolicy(initial_delay=1.)
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(policy.call(func), 'response')
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(policy.retries, 2)
+        self.assertEqual(sleep.call_args_list[0][0][0], 3.)
+        self.assertLessEqual(sleep.call_args_list[1][0][0], 2.)
+
+        # rate limit errors pause the rate limiter, so that concurrent requests also back off
+        func = mock.Mock(side_effect=[self.make_error(429, retry_after='3'), 'response'])
+        rate_limiter = TokenBucket(1000.)
+        with mock.patch('time.sleep'):
+            self.assertEqual(policy.call(func, rate_limiter=rate_limiter), 'response')
+        self.assertEqual(rate_limiter.throttled, 1)
+        self.assertGreater(rate_limiter.throttled_time, 2.)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(20., capacity=2)
+        start = time.monotonic()
+        for i_request in range(4):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(bucket.throttled, 2)
+
+        bucket.pause(0.1)
+        self.assertGreater(bucket.acquire(), 0.05)
+
+        bucket = TokenBucket(20., capacity=2)
+        self.assertEqual(bucket.reserve(2), 0.)
+        self.assertAlmostEqual(bucket.reserve(2), 0.1, delta=0.01)
+
+    def test_shared_rate_limiter(self):
+        self.assertIs(GDocDown(credentials=mock.Mock(), service=mock.Mock()).rate_limiter,
+                      GDocDown(credentials=mock.Mock(), service=mock.Mock()).rate_limiter)
+
+
+class TestStubIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.path = os.path.join(self.dirname, 'stubs.json')
+        self.google_file = os.path.join(self.dirname, 'example.gdoc')
+        self.write_stub('doc-0')
+        self.lock_patcher = mock.patch.object(OutputLock, 'DIRNAME', os.path.join(self.dirname, 'locks'))
+        self.lock_patcher.start()
+
+    def tearDown(self):
+        self.lock_patcher.stop()
+        shutil.rmtree(self.dirname)
+
+    def write_stub(self, google_id):
+        with open(self.google_file, 'w') as file:
+            json.dump({'doc_id': google_id}, file)
+
+    def test_get_google_id(self):
+        index = StubIndex(self.path)
+        self.assertEqual(index.get_google_id(self.google_file), 'doc-0')
+        self.assertEqual(index.get_google_id(self.google_file), 'doc-0')
+        self.assertEqual((index.hits, index.misses), (1, 1))
+
+        # the index is persisted, and stubs are only read again when they change
+        index.save()
+        index = StubIndex(self.path)
+        with mock.patch.object(StubIndex, 'read_google_id', side_effect=Exception('stub was read')):
+            self.assertEqual(index.get_google_id(self.google_file), 'doc-0')
+
+        self.write_stub('doc-1-with-a-longer-id')
+        self.assertEqual(index.get_google_id(self.google_file), 'doc-1-with-a-longer-id')
+        self.assertEqual((index.hits, index.misses), (1, 1))
+
+        # entries of deleted stubs are removed
+        os.remove(self.google_file)
+        with self.assertRaises(IOError):
+            index.get_google_id(self.google_file)
+        index.save()
+        self.assertEqual(StubIndex(self.path).entries, {})
+
+    def test_save_only_if_changed(self):
+        index = StubIndex(self.path)
+        index.save()
+        self.assertFalse(os.path.isfile(self.path))
+
+        index.get_google_id(self.google_file)
+        index.save()
+        mtime = os.stat(self.path).st_mtime_ns
+        index.get_google_id(self.google_file)
+        index.save()
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+    def test_download_many(self):
+        service = FakeDriveService({'doc-0': {'text/plain': b'document 0'}})
+        downloader = GDocDown(credentials=mock.Mock(), service=service,
+                              manifest_path=os.path.join(self.dirname, 'manifest.json'), stub_index_path=self.path)
+        downloader.download_many([self.google_file], format='txt', out_path=self.dirname)
+        self.assertEqual(StubIndex(self.path).entries[os.path.realpath(self.google_file)]['doc_id'], 'doc-0')
+
+
+class TestOutputLock(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.out_file = os.path.join(self.dirname, 'example.txt')
+        self.lock_patcher = mock.patch.object(OutputLock, 'DIRNAME', os.path.join(self.dirname, 'locks'))
+        self.lock_patcher.start()
+
+    def tearDown(self):
+        self.lock_patcher.stop()
+        shutil.rmtree(self.dirname)
+
+    def test_threads(self):
+        n_writers = [0]
+        max_writers = [0]
+        lock = threading.Lock()
+
+        def write(file):
+            with lock:
+                n_writers[0] += 1
+                max_writers[0] = max(max_writers[0], n_writers[0])
+            for i_chunk in range(5):
+                file.write(threading.current_thread().name.encode('utf-8'))
+                time.sleep(0.01)
+            with lock:
+                n_writers[0] -= 1
+
+        threads = [threading.Thread(target=GDocDown.write_atomically, args=(self.out_file, write), name=str(i_thread))
+                   for i_thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max_writers[0], 1)
+        with open(self.out_file, 'r') as file:
+            self.assertRegex(file.read(), r'^(\d)\1{4}$')
+        self.assertEqual(OutputLock._thread_locks, {})
+        self.assertEqual(sorted(os.listdir(self.dirname)), ['example.txt', 'locks'])
+
+    def test_processes(self):
+        lock = OutputLock(self.out_file)
+        script = ('import fcntl, sys, time\n'
+                  'file = open(sys.argv[1], "a")\n'
+                  'fcntl.flock(file.fileno(), fcntl.LOCK_EX)\n'
+                  'print("locked", flush=True)\n'
+                  'time.sleep(0.3)\n')
+        os.makedirs(OutputLock.DIRNAME)
+        process = subprocess.Popen([sys.executable, '-c', script, lock.lock_path], stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(process.stdout.readline(), b'locked\n')
+            start = time.monotonic()
+            GDocDown.write_atomically(self.out_file, lambda file: file.write(b'content'))
+            self.assertGreater(time.monotonic() - start, 0.1)
+        finally:
+            process.wait()
+            process.stdout.close()
+
+    def test_fsync(self):
+        with mock.patch('os.fsync') as fsync:
+            GDocDown.write_atomically(self.out_file, lambda file: file.write(b'content'))
+            self.assertEqual(fsync.call_count, 0)
+            GDocDown.write_atomically(self.out_file, lambda file: file.write(b'content'), fsync=True)
+            self.assertEqual(fsync.call_count, 2)
+
+            store = ExportStore(os.path.join(self.dirname, 'store'), link_modes=('copy',), fsync=True)
+            fsync.reset_mock()
+            store.link(store.put('doc', 'txt', {'version': '1'}, lambda file: file.write(b'content')), self.out_file)
+            # content, entry, and output files and their directories
+            self.assertEqual(fsync.call_count, 6)
+
+            fsync.reset_mock()
+            manifest = Manifest(os.path.join(self.dirname, 'manifest.json'), fsync=True)
+            manifest.set('doc', 'txt', self.out_file, {'version': '1'})
+            manifest.save()
+            self.assertEqual(fsync.call_count, 2)
+        with open(self.out_file, 'rb') as file:
+            self.assertEqual(file.read(), b'content')
+
+    def test_stripes(self):
+        with mock.patch.object(OutputLock, 'N_STRIPES', 8):
+            for i_file in range(50):
+                GDocDown.write_atomically(os.path.join(self.dirname, '{}.txt'.format(i_file)),
+                                          lambda file: file.write(b'content'))
+            self.assertLessEqual(len(os.listdir(OutputLock.DIRNAME)), 8)
+
+            # a thread can hold the locks of several files in the same stripe
+            lock = OutputLock(self.out_file)
+            other_lock = next(OutputLock(os.path.join(self.dirname, '{}.txt'.format(i_file)))
+                              for i_file in range(50)
+                              if OutputLock(os.path.join(self.dirname, '{}.txt'.format(i_file))).lock_path
+                              == lock.lock_path)
+            with lock:
+                with other_lock:
+                    GDocDown.write_atomically(self.out_file + '.other', lambda file: file.write(b'content'))
+            self.assertEqual(OutputLock._thread_locks, {})
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.credential_path = os.path.join(self.dirname, 'auth.json')
+        self.patchers = [
+            mock.patch.object(OutputLock, 'DIRNAME', os.path.join(self.dirname, 'locks')),
+            mock.patch.object(GDocDown, 'CREDENTIAL_PATH', self.credential_path),
+            mock.patch.object(GDocDown, '_credentials', {}),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.n_token_requests = 0
+
+    def tearDown(self):
+        for _, refresher in GDocDown._credentials.values():
+            refresher.stop()
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.dirname)
+
+    def make_credentials(self, expires_in):
+        return OAuth2Credentials('token-0', 'client-id', 'client-secret', 'refresh-token',
+                                 datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in),
+                                 'https://oauth2.googleapis.com/token', 'gdoc_down')
+
+    def do_refresh_request(self, credentials, http):
+        """ Fake the request of a new token """
+        time.sleep(0.05)
+        self.n_token_requests += 1
+        credentials.access_token = 'token-{}'.format(self.n_token_requests)
+        credentials.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+        credentials.store.locked_put(credentials)
+
+    def test_storage(self):
+        TokenStorage(self.credential_path).put(self.make_credentials(3600))
+        self.assertEqual(os.stat(self.credential_path).st_mode & 0o777, 0o600)
+        self.assertEqual(sorted(os.listdir(self.dirname)), ['auth.json', 'locks'])
+
+        credentials = TokenStorage(self.credential_path).get()
+        self.assertEqual(credentials.access_token, 'token-0')
+        self.assertIsInstance(credentials.store, TokenStorage)
+
+    def test_refresh_once(self):
+        """ Concurrent refreshes of a token which is about to expire request one new token """
+        TokenStorage(self.credential_path).put(self.make_credentials(60))
+        refreshers = [TokenRefresher(TokenStorage(self.credential_path).get()) for i_refresher in range(4)]
+        self.assertTrue(all(refresher.get_time_to_refresh() < 0 for refresher in refreshers))
+
+        with mock.patch.object(OAuth2Credentials, '_do_refresh_request', autospec=True,
+                               side_effect=self.do_refresh_request):
+            threads = [threading.Thread(target=refresher.refresh_if_expiring) for refresher in refreshers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(self.n_token_requests, 1)
+            self.assertEqual([refresher.credentials.access_token for refresher in refreshers], ['token-1'] * 4)
+            self.assertEqual(TokenStorage(self.credential_path).get().access_token, 'token-1')
+
+            # fresh tokens aren't refreshed
+            self.assertFalse(refreshers[0].refresh_if_expiring())
+        self.assertEqual(self.n_token_requests, 1)
+
+    def test_refresh_in_background(self):
+        TokenStorage(self.credential_path).put(self.make_credentials(60))
+        with mock.patch.object(OAuth2Credentials, '_do_refresh_request', autospec=True,
+                               side_effect=self.do_refresh_request):
+            refresher = TokenRefresher(TokenStorage(self.credential_path).get()).start()
+            for i_wait in range(100):
+                if refresher.refreshes:
+                    break
+                time.sleep(0.05)
+            refresher.stop()
+        self.assertEqual(refresher.refreshes, 1)
+        self.assertEqual(refresher.credentials.access_token, 'token-1')
+        self.assertGreater(refresher.get_time_to_refresh(), 3000.)
+
+    def test_refresh_error(self):
+        refresher = TokenRefresher(self.make_credentials(60), retry_interval=60.)
+        with mock.patch.object(OAuth2Credentials, 'refresh', side_effect=httplib2.ServerNotFoundError('offline')):
+            refresher.start()
+            for i_wait in range(100):
+                if refresher.error:
+                    break
+                time.sleep(0.05)
+            refresher.stop()
+        self.assertIsInstance(refresher.error, httplib2.ServerNotFoundError)
+
+    def test_get_credentials(self):
+        TokenStorage(self.credential_path).put(self.make_credentials(3600))
+        credentials = GDocDown.get_credentials()
+        self.assertEqual(credentials.access_token, 'token-0')
+        self.assertIs(GDocDown.get_credentials(), credentials)
+        _, refresher = GDocDown._credentials[self.credential_path]
+        self.assertIs(refresher.credentials, credentials)
+        self.assertEqual(refresher.margin, GDocDown.TOKEN_REFRESH_MARGIN)
+
+
+class TestExportStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.store = ExportStore(os.path.join(self.dirname, 'store'), max_size=25, link_modes=('copy',))
+        self.lock_patcher = mock.patch.object(OutputLock, 'DIRNAME', os.path.join(self.dirname, 'locks'))
+        self.lock_patcher.start()
+
+    def tearDown(self):
+        self.lock_patcher.stop()
+        shutil.rmtree(self.dirname)
+
+    def put(self, google_id, content, version='1'):
+        return self.store.put(google_id, 'txt', {'version': version}, lambda file: file.write(content))
+
+    def test_put_get(self):
+        metadata = {'modifiedTime': '2026-01-01T00:00:00.000Z', 'version': '1'}
+        self.assertEqual(self.store.get('doc', 'txt', metadata), None)
+
+        object_path = self.store.put('doc', 'txt', metadata, lambda file: file.write(b'content'))
+        self.assertEqual(self.store.get('doc', 'txt', metadata), object_path)
+        self.assertEqual(os.path.basename(object_path), hashlib.sha256(b'content').hexdigest())
+        self.assertEqual(self.store.get('doc', 'pdf', metadata), None)
+        self.assertEqual(self.store.get('doc', 'txt', dict(metadata, version='2')), None)
+
+        # identical content is stored once
+        self.assertEqual(self.store.put('other', 'txt', metadata, lambda file: file.write(b'content')), object_path)
+        self.assertEqual(self.store.get_stats()['objects'], 1)
+        self.assertEqual(self.store.get_stats()['entries'], 2)
+
+        # versions which can't be identified aren't stored
+        self.store.put('doc', 'txt', {}, lambda file: file.write(b'content'))
+        self.assertEqual(self.store.get('doc', 'txt', {}), None)
+
+    def test_materialize(self):
+        out_file = os.path.join(self.dirname, 'doc.txt')
+        self.assertFalse(self.store.materialize('doc', 'txt', {'version': '1'}, out_file))
+        self.put('doc', b'content')
+        self.assertTrue(self.store.materialize('doc', 'txt', {'version': '1'}, out_file))
+        with open(out_file, 'rb') as file:
+            self.assertEqual(file.read(), b'content')
+        self.assertEqual((self.store.hits, self.store.misses), (1, 1))
+
+        # content evicted by another process is a miss
+        os.remove(self.store.get('doc', 'txt', {'version': '1'}))
+        self.assertFalse(self.store.materialize('doc', 'txt', {'version': '1'}, out_file))
+
+    def test_evict_least_recently_used(self):
+        paths = [self.put('doc-{}'.format(i_doc), '{}'.format(i_doc).encode() * 10) for i_doc in range(2)]
+        for i_doc in range(2):
+            entry_path = self.store.get_entry_path('doc-{}'.format(i_doc), 'txt', {'version': '1'})
+            os.utime(entry_path, (i_doc + 1., i_doc + 1.))
+        self.store.get('doc-0', 'txt', {'version': '1'})
+
+        paths.append(self.put('doc-2', b'2' * 10))
+        self.assertTrue(os.path.isfile(paths[0]))
+        self.assertFalse(os.path.isfile(paths[1]))
+        self.assertTrue(os.path.isfile(paths[2]))
+        self.assertEqual(self.store.get('doc-1', 'txt', {'version': '1'}), None)
+        self.assertEqual(self.store.get_size(), 20)
+
+        self.assertEqual(self.store.prune(max_size=0), (2, 20))
+        self.assertEqual(self.store.get_stats()['entries'], 0)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('100'), 100)
+        self.assertEqual(parse_size('2K'), 2048)
+        self.assertEqual(parse_size('1.5M'), 1536 * 1024)
+        self.assertEqual(parse_size('2GiB'), 2 * 1024 ** 3)
+        with self.assertRaisesRegex(Exception, 'Invalid size'):
+            parse_size('big')
+
+
+class TestGetElementText(unittest.TestCase):
+
+    def test_get_element_text(self):
+        root = ElementTree.fromstring('<a>1<b>2<c>3</c>tail<d/><e>4</e></b><f>5</f>tail</a>')
+        self.assertEqual(GDocDown.get_element_text(root), '12345')
+        self.assertEqual(list(GDocDown.iter_element_text(root)), ['1', '2', '3', '4', '5'])
+        self.assertEqual(GDocDown.get_element_text(ElementTree.fromstring('<a/>')), '')
+
+    def test_deeply_nested(self):
+        depth = 5 * sys.getrecursionlimit()
+        root = element = ElementTree.Element('div')
+        for i_level in range(depth):
+            element = ElementTree.SubElement(element, 'div')
+            element.text = 'x'
+        self.assertEqual(GDocDown.get_element_text(root), 'x' * depth)
+
+
+class TestDownloadMany(unittest.TestCase):
+
+    def setUp(self):
+        self.in_dir = tempfile.mkdtemp()
+        self.out_dir = tempfile.mkdtemp()
+
+        self.service = FakeDriveService()
+        self.google_files = []
+        for i_doc in range(6):
+            doc_id = 'doc-{}'.format(i_doc)
+            self.service.documents[doc_id] = {'text/plain': '\ufeffdocument {}'.format(i_doc).encode('utf-8')}
+            google_file = os.path.join(self.in_dir, 'doc-{}.gdoc'.format(i_doc))
+            with open(google_file, 'w') as file:
+                json.dump({'doc_id': doc_id}, file)
+            self.google_files.append(google_file)
+
+        self.manifest_patcher = mock.patch.object(GDocDown, 'MANIFEST_PATH', os.path.join(self.in_dir, 'manifest.json'))
+        self.manifest_patcher.start()
+        self.stub_index_patcher = mock.patch.object(GDocDown, 'STUB_INDEX_PATH', os.path.join(self.in_dir, 'stubs.json'))
+        self.stub_index_patcher.start()
+        self.lock_patcher = mock.patch.object(OutputLock, 'DIRNAME', os.path.join(self.in_dir, 'locks'))
+        self.lock_patcher.start()
+
+    def tearDown(self):
+        self.manifest_patcher.stop()
+        self.stub_index_patcher.stop()
+        self.lock_patcher.stop()
+        shutil.rmtree(self.in_dir)
+        shutil.rmtree(self.out_dir)
+
+    @contextlib.contextmanager
+    def patch_service(self):
+        """ Make the command line program use the fake service """
+        with mock.patch.object(GDocDown, 'authenticate', return_value=self.service):
+            with mock.patch.object(GDocDown, 'get_http', return_value=None):
+                yield
+
+    def test_download_many(self):
+        # request the metadata file by file, so that every request passes through the barrier concurrently
+        self.service.barrier = threading.Barrier(3, timeout=10.)
+        with mock.patch.object(GDocDown, 'get_metadata_many', return_value={}):
+            results = GDocDown(credentials=mock.Mock(), service=self.service).download_many(
+                self.google_files, format='txt', out_path=self.out_dir, max_workers=3)
+
+        self.assertEqual([result.google_file for result in results], self.google_files)
+        for i_doc, result in enumerate(results):
+            self.assertTrue(result.success)
+            self.assertEqual(result.out_file, os.path.join(self.out_dir, 'doc-{}.txt'.format(i_doc)))
+            with open(result.out_file, 'r') as file:
+                self.assertEqual(file.read(), 'document {}'.format(i_doc))
+
+        self.assertEqual(self.service.max_concurrent_calls, 3)
+
+    def test_download_many_reports_errors(self):
+        os.remove(self.google_files[1])
+        results = GDocDown(credentials=mock.Mock(), service=self.service).download_many(
+            self.google_files[0:3], format='txt', out_path=self.out_dir)
+
+        self.assertEqual([result.success for result in results], [True, False, True])
+        self.assertIsInstance(results[1].error, IOError)
+
+    def test_download_many_requires_out_dir(self):
+        with self.assertRaisesRegex(Exception, 'must be a directory'):
+            GDocDown(credentials=mock.Mock(), service=self.service).download_many(
+                self.google_files, format='txt', out_path=os.path.join(self.out_dir, 'example.txt'))
+
+    def test_download_many_drops_duplicates(self):
+        results = GDocDown(credentials=mock.Mock(), service=self.service).download_many(
+            [self.google_files[0], self.google_files[1], self.google_files[0]], format='txt', out_path=self.out_dir)
+
+        self.assertEqual([result.google_file for result in results], self.google_files[0:2])
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual(len(self.service.get_calls('export')), 2)
+
+    def test_download_many_reports_conflicting_outputs(self):
+        other_dir = os.path.join(self.in_dir, 'other')
+        os.mkdir(other_dir)
+        other_file = os.path.join(other_dir, 'doc-0.gdoc')
+        shutil.copyfile(self.google_files[1], other_file)
+
+        results = GDocDown(credentials=mock.Mock(), service=self.service).download_many(
+            [self.google_files[0], other_file], format='txt', out_path=self.out_dir)
+
+        self.assertTrue(results[0].success)
+        self.assertFalse(results[1].success)
+        self.assertRegex(str(results[1].error), 'is also the output of')
+        self.assertEqual(len(self.service.get_calls('export')), 1)
+        with open(results[0].out_file, 'r') as file:
+            self.assertEqual(file.read(), 'document 0')
+
+    def test_skip_unchanged(self):
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        out_file = downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(downloader.download(self.google_files[0], format='txt', out_path=self.out_dir), out_file)
+        self.assertEqual(len(self.service.get_calls('export')), 1)
+        self.assertEqual(self.service.get_calls('get')[0]['fields'], 'modifiedTime,version')
+        self.assertEqual((downloader.manifest.hits, downloader.manifest.misses), (1, 1))
+
+        # the manifest persists between instances
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(len(self.service.get_calls('export')), 1)
+
+        # other formats and output paths are tracked separately
+        downloader.download(self.google_files[0], format='txt', out_path=os.path.join(self.out_dir, 'other.txt'))
+        self.assertEqual(len(self.service.get_calls('export')), 2)
+
+        # changes in Google Drive are exported
+        self.service.metadata['doc-0'] = {'modifiedTime': '2026-01-02T00:00:00.000Z', 'version': '2'}
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(len(self.service.get_calls('export')), 3)
+
+        # local changes are overwritten
+        with open(out_file, 'w') as file:
+            file.write('local edit')
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(len(self.service.get_calls('export')), 4)
+        with open(out_file, 'r') as file:
+            self.assertEqual(file.read(), 'document 0')
+
+        os.remove(out_file)
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(len(self.service.get_calls('export')), 5)
+
+        # force
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir, force=True)
+        self.assertEqual(len(self.service.get_calls('export')), 6)
+
+    def test_manifest_saved_once_per_run(self):
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        with mock.patch('gdoc_down.manifest.write_atomically',
+                        side_effect=gdoc_down.output.write_atomically) as write_atomically:
+            results = downloader.download_many(self.google_files, format='txt', out_path=self.out_dir)
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual(write_atomically.call_count, 1)
+        self.assertEqual(len(Manifest(GDocDown.MANIFEST_PATH).entries), 6)
+
+    def test_manifest_merges_instances(self):
+        manifests = [Manifest(GDocDown.MANIFEST_PATH), Manifest(GDocDown.MANIFEST_PATH)]
+        for i_manifest, manifest in enumerate(manifests):
+            out_file = os.path.join(self.out_dir, 'doc-{}.txt'.format(i_manifest))
+            with open(out_file, 'w') as file:
+                file.write('document')
+            manifest.set('doc-{}'.format(i_manifest), 'txt', out_file, {'version': '1'})
+        for manifest in manifests:
+            manifest.save()
+
+        self.assertEqual(sorted(Manifest(GDocDown.MANIFEST_PATH).entries.keys()), ['doc-0', 'doc-1'])
+        self.assertEqual(sorted(manifests[1].entries.keys()), ['doc-0', 'doc-1'])
+
+    def test_manifest_corrupt(self):
+        with open(GDocDown.MANIFEST_PATH, 'w') as file:
+            file.write('{"doc-0": {"txt"')
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        self.assertEqual(downloader.manifest.entries, {})
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(list(Manifest(GDocDown.MANIFEST_PATH).entries.keys()), ['doc-0'])
+
+    def test_download_in_chunks(self):
+        content = b'x' * 100
+        self.service.documents['doc-0']['application/pdf'] = content
+        out_file = GDocDown(credentials=mock.Mock(), service=self.service, chunk_size=16).download(
+            self.google_files[0], format='pdf', out_path=self.out_dir)
+
+        with open(out_file, 'rb') as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(len(self.service.get_calls('export')), 1)
+        self.assertEqual(len(self.service.get_calls('export_chunk')), 7)
+        self.assertEqual(os.listdir(self.out_dir), ['doc-0.pdf'])
+
+    def test_download_txt_strips_bom_once(self):
+        self.service.documents['doc-0']['text/plain'] = '\ufeffabc\ufeffdef'.encode('utf-8')
+        out_file = GDocDown(credentials=mock.Mock(), service=self.service, chunk_size=2).download(
+            self.google_files[0], format='txt', out_path=self.out_dir)
+        with open(out_file, 'rb') as file:
+            self.assertEqual(file.read(), 'abc\ufeffdef'.encode('utf-8'))
+
+        self.service.documents['doc-1']['text/plain'] = b'abcdef'
+        out_file = GDocDown(credentials=mock.Mock(), service=self.service, chunk_size=2).download(
+            self.google_files[1], format='txt', out_path=self.out_dir)
+        with open(out_file, 'rb') as file:
+            self.assertEqual(file.read(), b'abcdef')
+
+    def test_bom_stripping_writer(self):
+        for content in [b'', b'\xef', b'\xef\xbb', b'\xef\xbb\xbf', b'\xef\xbb\xbfa', b'ab', b'a\xef\xbb\xbf']:
+            file = io.BytesIO()
+            writer = BomStrippingWriter(file)
+            for i_byte in range(len(content)):
+                writer.write(content[i_byte:i_byte + 1])
+            writer.flush()
+            expected = content[3:] if content.startswith(b'\xef\xbb\xbf') else content
+            self.assertEqual(file.getvalue(), expected)
+
+    def test_failed_download_keeps_existing_file(self):
+        out_file = os.path.join(self.out_dir, 'doc-0.txt')
+        with open(out_file, 'w') as file:
+            file.write('previous version')
+        del self.service.documents['doc-0']['text/plain']
+
+        with self.assertRaises(KeyError):
+            GDocDown(credentials=mock.Mock(), service=self.service).download(
+                self.google_files[0], format='txt', out_path=self.out_dir)
+
+        with open(out_file, 'r') as file:
+            self.assertEqual(file.read(), 'previous version')
+        self.assertEqual(os.listdir(self.out_dir), ['doc-0.txt'])
+
+    def test_download_tex(self):
+        with open(os.path.join(FIXTURES_DIR, 'example.html.zip'), 'rb') as file:
+            self.service.documents['doc-0']['application/zip'] = file.read()
+        out_file = GDocDown(credentials=mock.Mock(), service=self.service, chunk_size=1024).download(
+            self.google_files[0], format='tex', out_path=self.out_dir)
+
+        with open(out_file, 'rb') as file:
+            content = file.read()
+        with open(os.path.join(FIXTURES_DIR, 'example.tex'), 'rb') as file:
+            self.assertEqual(content, file.read())
+
+    def test_download_many_tex_in_processes(self):
+        with open(os.path.join(FIXTURES_DIR, 'example.html.zip'), 'rb') as file:
+            html_zip_content = file.read()
+        for i_doc in range(3):
+            self.service.documents['doc-{}'.format(i_doc)]['application/zip'] = html_zip_content
+
+        records = []
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, convert_workers=2,
+                              metrics=Metrics(callbacks=[records.append]))
+        results = downloader.download_many(self.google_files[0:3], format='tex', out_path=self.out_dir)
+
+        with open(os.path.join(FIXTURES_DIR, 'example.tex'), 'rb') as file:
+            expected_content = file.read()
+        for result in results:
+            self.assertTrue(result.success, result.error)
+            with open(result.out_file, 'rb') as file:
+                self.assertEqual(file.read(), expected_content)
+
+        converts = [record for record in records if record['event'] == 'convert']
+        self.assertEqual(len(converts), 3)
+        self.assertTrue(all(record.get('process') for record in converts))
+
+        # the processes are reused by later batches until the downloader is closed
+        convert_executor = downloader.get_convert_executor()
+        records.clear()
+        downloader.download_many(self.google_files[0:2], format='tex', out_path=self.out_dir, force=True)
+        self.assertTrue(all(record.get('process') for record in records if record['event'] == 'convert'))
+        self.assertIs(downloader.get_convert_executor(), convert_executor)
+        downloader.close()
+        self.assertIsNot(downloader.get_convert_executor(), convert_executor)
+        downloader.close()
+
+        # single downloads, and batches which can't use processes, convert on the downloading thread
+        records.clear()
+        downloader.download(self.google_files[0], format='tex', out_path=self.out_dir, force=True)
+        downloader.convert_workers = 0
+        downloader.download_many(self.google_files[1:3], format='tex', out_path=self.out_dir, force=True)
+        converts = [record for record in records if record['event'] == 'convert']
+        self.assertEqual(len(converts), 3)
+        self.assertFalse(any(record.get('process') for record in converts))
+
+    def test_download_formats(self):
+        with open(os.path.join(FIXTURES_DIR, 'example.html.zip'), 'rb') as file:
+            html_zip_content = file.read()
+        self.service.documents['doc-0']['application/zip'] = html_zip_content
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, chunk_size=1024)
+
+        out_files = downloader.download(self.google_files[0], formats=['tex', 'html.zip', 'txt', 'tex'],
+                                        out_path=self.out_dir)
+        self.assertEqual(out_files, [os.path.join(self.out_dir, 'doc-0.' + format) for format in ['tex', 'html.zip', 'txt']])
+        self.assertEqual(sorted((call['mimeType'] for call in self.service.get_calls('export'))),
+                         ['application/zip', 'text/plain'])
+        self.assertEqual(len(self.service.get_calls('get')), 1)
+
+        with open(out_files[0], 'rb') as file:
+            with open(os.path.join(FIXTURES_DIR, 'example.tex'), 'rb') as tex_file:
+                self.assertEqual(file.read(), tex_file.read())
+        with open(out_files[1], 'rb') as file:
+            self.assertEqual(file.read(), html_zip_content)
+        with open(out_files[2], 'r') as file:
+            self.assertEqual(file.read(), 'document 0')
+
+        # only the formats which aren't up to date are exported
+        os.remove(out_files[1])
+        downloader.download(self.google_files[0], formats=['tex', 'html.zip', 'txt'], out_path=self.out_dir)
+        self.assertEqual(len(self.service.get_calls('export')), 3)
+        with open(out_files[1], 'rb') as file:
+            self.assertEqual(file.read(), html_zip_content)
+
+        with self.assertRaisesRegex(Exception, 'must be a directory'):
+            downloader.download(self.google_files[0], formats=['tex', 'txt'], out_path=out_files[0])
+        with self.assertRaisesRegex(Exception, 'Extension cannot be specified'):
+            downloader.download(self.google_files[0], formats=['tex', 'txt'], out_path=self.out_dir, extension='x')
+        with self.assertRaisesRegex(Exception, 'Unknown format'):
+            downloader.download(self.google_files[0], formats=['tex', 'xlsx'], out_path=self.out_dir)
+
+    def test_retry(self):
+        self.service.fail('get', 503)
+        self.service.fail('export_chunk', 429, retry_after='0')
+        self.service.fail('export_chunk', 403, reason='userRateLimitExceeded')
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, chunk_size=4,
+                              retry_policy=RetryPolicy(initial_delay=0.), rate_limiter=TokenBucket(1000.))
+        out_file = downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+
+        with open(out_file, 'r') as file:
+            self.assertEqual(file.read(), 'document 0')
+        self.assertEqual(downloader.retry_policy.retries, 3)
+        self.assertEqual(len(self.service.get_calls('get')), 2)
+        self.assertEqual([call['start'] for call in self.service.get_calls('export_chunk')], [0, 0, 0, 4, 8, 12])
+
+    def test_retry_gives_up(self):
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service,
+                              retry_policy=RetryPolicy(max_retries=1, initial_delay=0.))
+
+        self.service.fail('get', 404)
+        with self.assertRaises(apiclient.errors.HttpError):
+            downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(downloader.retry_policy.retries, 0)
+
+        self.service.fail('export_chunk', 500)
+        self.service.fail('export_chunk', 500)
+        with self.assertRaises(apiclient.errors.HttpError):
+            downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(downloader.retry_policy.retries, 1)
+        self.assertEqual(os.listdir(self.out_dir), [])
+
+    def test_store(self):
+        store = ExportStore(os.path.join(self.in_dir, 'store'), link_modes=('hardlink',))
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, store=store)
+        out_dirs = [os.path.join(self.out_dir, 'checkout-{}'.format(i_checkout)) for i_checkout in range(2)]
+        for out_dir in out_dirs:
+            os.mkdir(out_dir)
+
+        out_files = [downloader.download(self.google_files[0], format='txt', out_path=out_dir) for out_dir in out_dirs]
+        self.assertEqual(len(self.service.get_calls('export')), 1)
+        self.assertEqual((store.hits, store.misses), (1, 1))
+        for out_file in out_files:
+            with open(out_file, 'r') as file:
+                self.assertEqual(file.read(), 'document 0')
+        self.assertEqual(os.stat(out_files[0]).st_ino, os.stat(out_files[1]).st_ino)
+        self.assertEqual(os.stat(out_files[0]).st_mode & 0o222, 0)
+
+        # files saved from the store are up to date
+        self.assertEqual(downloader._download(self.google_files[0], format='txt', out_path=out_dirs[1]), (out_files[1], False))
+
+        # new versions and forced downloads are exported
+        self.service.metadata['doc-0'] = {'modifiedTime': '2026-01-02T00:00:00.000Z', 'version': '2'}
+        self.service.documents['doc-0']['text/plain'] = b'version 2'
+        downloader.download(self.google_files[0], format='txt', out_path=out_dirs[0])
+        downloader.download(self.google_files[0], format='txt', out_path=out_dirs[1], force=True)
+        self.assertEqual(len(self.service.get_calls('export')), 3)
+        for out_file in out_files:
+            with open(out_file, 'r') as file:
+                self.assertEqual(file.read(), 'version 2')
+        self.assertEqual(store.get_stats()['objects'], 2)
+
+    def test_store_copy(self):
+        store = ExportStore(os.path.join(self.in_dir, 'store'), link_modes=('reflink', 'copy'))
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, store=store)
+        out_file = downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertNotEqual(os.stat(out_file).st_ino, os.stat(store.get('doc-0', 'txt', {'version': '1', 'modifiedTime': '2026-01-01T00:00:00.000Z'})).st_ino)
+        with open(out_file, 'a') as file:
+            file.write(' edited')
+
+        os.remove(os.path.join(self.in_dir, 'manifest.json'))
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, store=store)
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+        with open(out_file, 'r') as file:
+            self.assertEqual(file.read(), 'document 0')
+        self.assertEqual(len(self.service.get_calls('export')), 1)
+
+    def test_cli_store(self):
+        store_dir = os.path.join(self.in_dir, 'store')
+        with self.patch_service():
+            for out_dir in ['checkout-0', 'checkout-1']:
+                os.mkdir(os.path.join(self.out_dir, out_dir))
+                stdout = io.StringIO()
+                with contextlib.redirect_stdout(stdout):
+                    with cli(argv=['-f', 'txt', '--cache-dir', store_dir, '-o', os.path.join(self.out_dir, out_dir)]
+                             + self.google_files[0:2], credentials=mock.Mock()) as app:
+                        app.run()
+        self.assertIn('2 saved from the cache', stdout.getvalue())
+        self.assertEqual(len(self.service.get_calls('export')), 2)
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            with cli(argv=['cache', 'stats', '--cache-dir', store_dir]) as app:
+                app.run()
+            with cli(argv=['cache', 'prune', '--cache-dir', store_dir, '--max-size', '0']) as app:
+                app.run()
+        self.assertIn('Files: 2', stdout.getvalue())
+        self.assertIn('Evicted 2 files (20 bytes)', stdout.getvalue())
+        self.assertEqual(ExportStore(store_dir).get_stats()['entries'], 0)
+
+    def test_get_metadata_many(self):
+        for i_doc in range(6, 250):
+            self.service.documents['doc-{}'.format(i_doc)] = {'text/plain': b''}
+        self.service.metadata['doc-1'] = {'modifiedTime': '2026-02-01T00:00:00.000Z', 'version': '7'}
+        google_ids = ['doc-{}'.format(i_doc) for i_doc in range(250)] + ['missing', 'doc-1']
+
+        metadata = GDocDown(credentials=mock.Mock(), service=self.service,
+                            rate_limiter=TokenBucket(1e6)).get_metadata_many(google_ids)
+        self.assertEqual(sorted(metadata.keys()), sorted(google_ids[0:250]))
+        self.assertEqual(metadata['doc-1'], {'modifiedTime': '2026-02-01T00:00:00.000Z', 'version': '7'})
+        self.assertEqual([kwargs['n_requests'] for kwargs in self.service.get_calls('batch')], [100, 100, 51])
+
+        # batches which fail are left to be requested file by file
+        self.service.fail('batch', 500)
+        self.service.fail('batch', 400)
+        metadata = GDocDown(credentials=mock.Mock(), service=self.service,
+                            retry_policy=RetryPolicy(initial_delay=0.)).get_metadata_many(google_ids[0:3])
+        self.assertEqual(metadata, {})
+
+    def test_download_many_batches_metadata(self):
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        os.remove(self.google_files[5])
+        results = downloader.download_many(self.google_files, format='txt', out_path=self.out_dir)
+        self.assertEqual([result.success for result in results], [True] * 5 + [False])
+        self.assertEqual([kwargs['n_requests'] for kwargs in self.service.get_calls('batch')], [5])
+        self.assertEqual(len(self.service.get_calls('get')), 5)
+
+        # metadata which couldn't be batched is requested file by file
+        self.service.fail('get', 404, reason='notFound')
+        results = downloader.download_many(self.google_files[0:3], format='txt', out_path=self.out_dir)
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual(len(self.service.get_calls('get')), 5 + 3 + 1)
+
+    def test_register_format(self):
+        def convert_to_markdown(payload, file):
+            file.write(b'# ' + payload.read())
+
+        markdown = Format('.gdoc', 'markdown', 'text/plain', extension='md', converter=convert_to_markdown,
+                          description='Markdown')
+        with mock.patch.dict(GDocDown.FORMATS):
+            GDocDown.register_format(markdown)
+            self.assertIs(GDocDown.get_format(self.google_files[0], 'markdown'), markdown)
+            self.assertIn(markdown, GDocDown.get_formats())
+
+            out_files = GDocDown(credentials=mock.Mock(), service=self.service).download(
+                self.google_files[0], formats=['markdown', 'txt'], out_path=self.out_dir)
+            self.assertEqual(out_files, [os.path.join(self.out_dir, 'doc-0.md'),
+                                         os.path.join(self.out_dir, 'doc-0.txt')])
+            with open(out_files[0], 'rb') as file:
+                self.assertEqual(file.read(), '# \ufeffdocument 0'.encode('utf-8'))
+            self.assertEqual(len(self.service.get_calls('export')), 1)
+
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with cli(argv=['formats']) as app:
+                    app.run()
+            self.assertRegex(stdout.getvalue(), r'\.gdoc +markdown +md +text/plain +Markdown')
+            self.assertRegex(stdout.getvalue(), r'\.gsheet +xlsx +xlsx ')
+
+        with self.assertRaisesRegex(Exception, 'Unknown format "markdown"'):
+            GDocDown.get_format(self.google_files[0], 'markdown')
+        with self.assertRaisesRegex(Exception, 'Unknown Google document extension ".gdraw"'):
+            GDocDown.get_format('example.gdraw', 'pdf')
+
+    def test_sync(self):
+        sub_dir = os.path.join(self.in_dir, 'a', 'b')
+        os.makedirs(sub_dir)
+        sub_file = os.path.join(sub_dir, 'sub.gdoc')
+        shutil.copyfile(self.google_files[0], sub_file)
+        with open(os.path.join(self.in_dir, 'notes.txt'), 'w') as file:
+            file.write('not a stub')
+        dst_dir = os.path.join(self.in_dir, 'dst')
+        for exports in self.service.documents.values():
+            exports['text/html'] = b'<p>document</p>'
+
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        results, removed = downloader.sync(self.in_dir, dst_dir, format_map={'.gdoc': ['txt', 'html']}, max_workers=3)
+        self.assertEqual(len(results), 14)
+        self.assertTrue(all(result.success and not result.up_to_date for result in results))
+        self.assertEqual(removed, [])
+        self.assertEqual(sorted(os.listdir(os.path.join(dst_dir, 'a', 'b'))), ['sub.html', 'sub.txt'])
+        with open(os.path.join(dst_dir, 'a', 'b', 'sub.txt'), 'r') as file:
+            self.assertEqual(file.read(), 'document 0')
+        self.assertFalse(os.path.exists(os.path.join(dst_dir, 'notes.txt')))
+        self.assertFalse(os.path.exists(os.path.join(dst_dir, 'dst')))
+
+        # outputs which are up to date are skipped
+        results, removed = downloader.sync(self.in_dir, dst_dir, format_map={'.gdoc': ['txt', 'html']})
+        self.assertTrue(all(result.up_to_date for result in results))
+        self.assertEqual(len(self.service.get_calls('export')), 14)
+
+        # outputs of deleted stubs are removed, but other files aren't
+        with open(os.path.join(dst_dir, 'a', 'user.txt'), 'w') as file:
+            file.write('created by the user')
+        os.remove(sub_file)
+        os.remove(self.google_files[1])
+        results, removed = downloader.sync(self.in_dir, dst_dir, format_map={'.gdoc': ['txt', 'html']})
+        self.assertEqual(len(results), 10)
+        self.assertEqual(sorted(removed), sorted([
+            os.path.join(dst_dir, 'a', 'b', 'sub.html'), os.path.join(dst_dir, 'a', 'b', 'sub.txt'),
+            os.path.join(dst_dir, 'doc-1.html'), os.path.join(dst_dir, 'doc-1.txt'),
+        ]))
+        self.assertFalse(os.path.exists(os.path.join(dst_dir, 'a', 'b')))
+        self.assertTrue(os.path.isfile(os.path.join(dst_dir, 'a', 'user.txt')))
+
+        # the state of the sync is flushed to disk with the outputs
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, fsync=True)
+        with mock.patch.object(GDocDown, 'write_atomically', side_effect=GDocDown.write_atomically) as write:
+            downloader.sync(self.in_dir, dst_dir, format_map={'.gdoc': ['txt', 'html']})
+        self.assertEqual(write.call_args_list[-1][0][0], os.path.join(dst_dir, GDocDown.SYNC_STATE_FILENAME))
+        self.assertEqual(write.call_args_list[-1][1], {'fsync': True})
+
+    def test_sync_incremental(self):
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        format_map = {'.gdoc': ['txt']}
+
+        # the first sync checks every file
+        results, _ = downloader.sync(self.in_dir, self.out_dir, format_map=format_map, incremental=True)
+        self.assertTrue(all(result.success and not result.up_to_date for result in results))
+        self.assertEqual(len(self.service.get_calls('get')), 6)
+        self.assertEqual(len(self.service.get_calls('getStartPageToken')), 1)
+
+        # a sync without changes only lists the changes
+        n_calls = len(self.service.calls)
+        results, _ = downloader.sync(self.in_dir, self.out_dir, format_map=format_map, incremental=True)
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(result.up_to_date for result in results))
+        self.assertEqual([method for method, _ in self.service.calls[n_calls:]], ['list_changes'])
+
+        # only changed files, new stubs, and missing outputs are checked
+        self.service.modify('doc-2', {'text/plain': b'document 2, revised'})
+        self.service.modify('unrelated')
+        new_file = os.path.join(self.in_dir, 'new.gdoc')
+        shutil.copyfile(self.google_files[4], new_file)
+        os.remove(os.path.join(self.out_dir, 'doc-5.txt'))
+        n_calls = len(self.service.calls)
+        with mock.patch.object(GDocDown, 'CHANGES_PAGE_SIZE', 1):
+            results, _ = downloader.sync(self.in_dir, self.out_dir, format_map=format_map, incremental=True)
+        self.assertEqual(sorted(result.google_file for result in results if not result.up_to_date),
+                         sorted([self.google_files[2], self.google_files[5], new_file]))
+        self.assertEqual(sorted(kwargs['fileId'] for method, kwargs in self.service.calls[n_calls:] if method == 'get'),
+                         ['doc-2', 'doc-4', 'doc-5'])
+        self.assertEqual(len(self.service.get_calls('list_changes')), 3)
+        with open(os.path.join(self.out_dir, 'doc-2.txt'), 'r') as file:
+            self.assertEqual(file.read(), 'document 2, revised')
+
+        # failed files are checked again by the next sync
+        self.service.fail('get', 404, reason='notFound')
+        self.service.modify('doc-3')
+        results, _ = downloader.sync(self.in_dir, self.out_dir, format_map=format_map, incremental=True)
+        self.assertEqual([result.google_file for result in results if not result.success], [self.google_files[3]])
+        n_gets = len(self.service.get_calls('get'))
+        results, _ = downloader.sync(self.in_dir, self.out_dir, format_map=format_map, incremental=True)
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual([kwargs['fileId'] for kwargs in self.service.get_calls('get')[n_gets:]], ['doc-3'])
+
+    def test_parse_format_map(self):
+        self.assertEqual(GDocDown.parse_format_map('gdoc=docx+pdf, .gsheet=xlsx'),
+                         {'.gdoc': ['docx', 'pdf'], '.gsheet': ['xlsx']})
+        with self.assertRaisesRegex(Exception, 'Invalid format map'):
+            GDocDown.parse_format_map('gdoc')
+
+    def test_cli_sync(self):
+        with self.patch_service():
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with cli(argv=['sync', self.in_dir, self.out_dir, '--format-map', 'gdoc=txt', '-j', '2'],
+                         credentials=mock.Mock()) as app:
+                    app.run()
+            self.assertIn('0 up to date, 6 exported, 0 removed', stdout.getvalue())
+
+            os.remove(self.google_files[0])
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with cli(argv=['sync', self.in_dir, self.out_dir, '--format-map', 'gdoc=txt', '--incremental'],
+                         credentials=mock.Mock()) as app:
+                    app.run()
+            self.assertIn('5 up to date, 0 exported, 1 removed', stdout.getvalue())
+        self.assertEqual(sorted(os.listdir(self.out_dir)),
+                         ['.gdoc_down_sync.json'] + ['doc-{}.txt'.format(i_doc) for i_doc in range(1, 6)])
+
+    def test_download_many_skips_unchanged(self):
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+
+        results = downloader.download_many(self.google_files[0:3], format='txt', out_path=self.out_dir)
+        self.assertEqual([result.up_to_date for result in results], [True, False, False])
+        self.assertEqual(len(self.service.get_calls('export')), 3)
+
+        results = downloader.download_many(self.google_files[0:3], format='txt', out_path=self.out_dir, force=True)
+        self.assertEqual([result.up_to_date for result in results], [False, False, False])
+        self.assertEqual(len(self.service.get_calls('export')), 6)
+
+    def test_cli_glob(self):
+        with self.patch_service():
+            with cli(argv=['-f', 'txt', '-j', '2', '-o', self.out_dir, os.path.join(self.in_dir, '*.gdoc')],
+                     credentials=mock.Mock()) as app:
+                app.run()
+
+        self.assertEqual(sorted(os.listdir(self.out_dir)), ['doc-{}.txt'.format(i_doc) for i_doc in range(6)])
+        self.assertLessEqual(self.service.max_concurrent_calls, 2)
+
+    def test_cli_overlapping_globs(self):
+        with self.patch_service():
+            with cli(argv=['-f', 'txt', '-o', self.out_dir, os.path.join(self.in_dir, '*.gdoc'), self.google_files[1]],
+                     credentials=mock.Mock()) as app:
+                app.run()
+
+        self.assertEqual(len(self.service.get_calls('export')), 6)
+
+    def test_cli_force(self):
+        argv = ['-f', 'txt', '-o', self.out_dir] + self.google_files[0:2]
+        with self.patch_service():
+            with cli(argv=argv, credentials=mock.Mock()) as app:
+                app.run()
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with cli(argv=argv, credentials=mock.Mock()) as app:
+                    app.run()
+            self.assertIn('2 up to date (manifest hits), 0 exported (manifest misses)', stdout.getvalue())
+            with cli(argv=argv + ['--force'], credentials=mock.Mock()) as app:
+                app.run()
+        self.assertEqual(len(self.service.get_calls('export')), 4)
+
+    def add_workbook(self):
+        self.service.documents['book-0'] = {'text/csv': b'a,1\n'}
+        self.service.sheets['book-0'] = [
+            {'sheetId': 0, 'title': 'Summary', 'exports': {'text/csv': b'a,1\n', 'text/tab-separated-values': b'a\t1\n'}},
+            {'sheetId': 17, 'title': 'Q1/Q2', 'exports': {'text/csv': b'b,2\n' * 1000}},
+            {'sheetId': 23, 'title': 'Summary', 'exports': {'text/csv': b'c,3\n'}},
+        ]
+        google_file = os.path.join(self.in_dir, 'book-0.gsheet')
+        with open(google_file, 'w') as file:
+            json.dump({'doc_id': 'book-0'}, file)
+        return google_file
+
+    def test_download_sheets(self):
+        google_file = self.add_workbook()
+        with mock.patch.object(GDocDown, 'get_http', return_value=None):
+            downloader = GDocDown(credentials=mock.Mock(), service=self.service, sheets_service=self.service,
+                                  chunk_size=1024)
+            sheets = downloader.get_sheets('book-0')
+            self.assertEqual(sheets, [{'sheetId': 0, 'title': 'Summary', 'index': 0},
+                                      {'sheetId': 17, 'title': 'Q1/Q2', 'index': 1},
+                                      {'sheetId': 23, 'title': 'Summary', 'index': 2}])
+
+            # hold the exports of the sheets until all of them are in flight
+            self.service.barrier = threading.Barrier(3, timeout=10.)
+            with mock.patch.object(downloader, 'get_metadata', return_value={'version': '1'}):
+                with mock.patch.object(downloader, 'get_sheets', return_value=sheets):
+                    out_file = downloader.download(google_file, format='csv.zip', out_path=self.out_dir)
+
+        self.assertEqual(out_file, os.path.join(self.out_dir, 'book-0.csv.zip'))
+        self.assertEqual(sorted(call['sheetId'] for call in self.service.get_calls('export_sheet')), [0, 17, 23])
+        self.assertEqual(self.service.max_concurrent_calls, 3)
+        self.assertEqual(self.service.get_calls('export'), [])
+
+        with zipfile.ZipFile(out_file) as archive:
+            self.assertEqual(archive.namelist(), ['Summary.csv', 'Q1_Q2.csv', 'Summary (23).csv'])
+            self.assertEqual(archive.read('Summary.csv'), b'a,1\n')
+            self.assertEqual(archive.read('Q1_Q2.csv'), b'b,2\n' * 1000)
+            self.assertEqual(archive.read('Summary (23).csv'), b'c,3\n')
+
+    def test_download_sheets_tsv_from_store(self):
+        google_file = self.add_workbook()
+        self.service.sheets['book-0'] = self.service.sheets['book-0'][0:1]
+        store = ExportStore(os.path.join(self.in_dir, 'store'), link_modes=('copy',))
+        with mock.patch.object(GDocDown, 'get_http', return_value=None):
+            downloader = GDocDown(credentials=mock.Mock(), service=self.service, sheets_service=self.service,
+                                  store=store)
+            out_file = downloader.download(google_file, format='tsv.zip', out_path=self.out_dir)
+            with open(out_file, 'rb') as file:
+                content = file.read()
+
+            # the archive only changes when the sheets change
+            downloader.download(google_file, format='tsv.zip', out_path=self.out_dir, force=True)
+            with open(out_file, 'rb') as file:
+                self.assertEqual(file.read(), content)
+
+        with zipfile.ZipFile(out_file) as archive:
+            self.assertEqual(archive.namelist(), ['Summary.tsv'])
+            self.assertEqual(archive.read('Summary.tsv'), b'a\t1\n')
+        self.assertEqual(self.service.get_calls('export_sheet')[0]['format'], 'tsv')
+
+    def test_download_above_export_size_limit(self):
+        self.service.export_size_limit = 3
+        metrics = Metrics()
+        with mock.patch.object(GDocDown, 'get_http', return_value=None):
+            downloader = GDocDown(credentials=mock.Mock(), service=self.service, sheets_service=self.service,
+                                  chunk_size=4, metrics=metrics)
+
+            # documents are downloaded from their export links
+            out_file = downloader.download(self.google_files[0], format='txt', out_path=self.out_dir)
+            with open(out_file, 'r') as file:
+                self.assertEqual(file.read(), 'document 0')
+            self.assertEqual(self.service.get_calls('export_link'), [{'fileId': 'doc-0', 'mimeType': 'text/plain'}])
+            self.assertEqual(metrics.totals['export'], {'count': 1, 'seconds': mock.ANY,
+                                                        'bytes': len(self.service.documents['doc-0']['text/plain'])})
+
+            # workbooks are exported to CSV sheet by sheet
+            google_file = self.add_workbook()
+            out_file = downloader.download(google_file, format='csv', out_path=self.out_dir)
+            with open(out_file, 'rb') as file:
+                self.assertEqual(file.read(), b'a,1\n')
+            self.assertEqual(self.service.get_calls('export_sheet'), [{'fileId': 'book-0', 'format': 'csv', 'sheetId': 0}])
+
+            # files without an export link for the format can't be exported
+            with mock.patch.object(downloader, 'execute', return_value={'exportLinks': {}}):
+                with self.assertRaisesRegex(Exception, 'too large to export'):
+                    downloader.download(self.google_files[1], format='txt', out_path=self.out_dir)
+
+    def test_is_export_size_limit_error(self):
+        self.service.fail('export_chunk', 403, reason='exportSizeLimitExceeded')
+        self.service.fail('export_chunk', 403, reason='insufficientPermissions')
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service)
+        for is_export_size_limit_error in [True, False]:
+            with self.assertRaises(apiclient.errors.HttpError) as context:
+                downloader.download_media(self.service.files().export_media(fileId='doc-0', mimeType='text/plain'),
+                                          io.BytesIO())
+            self.assertEqual(GDocDown.is_export_size_limit_error(context.exception), is_export_size_limit_error)
+
+    def test_get_sheets_service(self):
+        with mock.patch.object(GDocDown, 'authenticate', side_effect=lambda credentials, api='drive': api):
+            downloader = GDocDown(credentials=mock.Mock())
+            self.assertEqual(downloader.service, 'drive')
+            self.assertIsNone(downloader.sheets_service)
+            self.assertEqual(downloader.get_sheets_service(), 'sheets')
+
+    def test_cli_reports_errors(self):
+        os.remove(self.google_files[1])
+        with self.patch_service():
+            with self.assertRaisesRegex(Exception, '1 of 3 files could not be downloaded'):
+                with cli(argv=['-f', 'txt', '-o', self.out_dir] + self.google_files[0:3], credentials=mock.Mock()) as app:
+                    app.run()
+            with self.assertRaises(IOError):
+                with cli(argv=['-f', 'txt', '-o', self.out_dir, self.google_files[1]], credentials=mock.Mock()) as app:
+                    app.run()
+
+    def test_metrics(self):
+        with open(os.path.join(FIXTURES_DIR, 'example.html.zip'), 'rb') as file:
+            self.service.documents['doc-0']['application/zip'] = file.read()
+        records = []
+        stats_file = io.StringIO()
+        metrics = Metrics(file=stats_file, callbacks=[records.append])
+        downloader = GDocDown(credentials=mock.Mock(), service=self.service, metrics=metrics)
+
+        downloader.download(self.google_files[0], formats=['tex', 'html.zip', 'txt'], out_path=self.out_dir)
+        self.assertEqual([record['event'] for record in records[0:2]], ['stub', 'metadata'])
+        self.assertEqual(sorted(record['event'] for record in records[2:-1]),
+                         ['convert', 'convert', 'export', 'export', 'save', 'save', 'save'])
+        self.assertEqual(records[-1]['event'], 'download')
+        self.assertEqual([json.loads(line) for line in stats_file.getvalue().splitlines()], records)
+        self.assertTrue(all(record['seconds'] >= 0 for record in records))
+
+        export_records = [record for record in records if record['event'] == 'export']
+        self.assertEqual(sorted((record['export_type'], record['bytes']) for record in export_records), [
+            ('application/zip', len(self.service.documents['doc-0']['application/zip'])),
+            ('text/plain', len(self.service.documents['doc-0']['text/plain'])),
+        ])
+        for record in records:
+            if record['event'] == 'save':
+                self.assertEqual(record['bytes'], os.path.getsize(record['out_file']))
+        self.assertEqual(records[-1]['google_id'], 'doc-0')
+        self.assertEqual(records[-1]['exported'], ['html.zip', 'tex', 'txt'])
+
+        self.assertEqual(metrics.totals['export']['count'], 2)
+        self.assertEqual(metrics.totals['export']['bytes'], sum(record['bytes'] for record in export_records))
+        self.assertEqual(metrics.totals['convert']['count'], 2)
+
+        # errors are recorded
+        os.remove(self.google_files[1])
+        with self.assertRaises(IOError):
+            downloader.download(self.google_files[1], format='txt', out_path=self.out_dir)
+        self.assertEqual([record['event'] for record in records[-2:]], ['stub', 'download'])
+        self.assertIn('error', records[-1])
+
+    def test_metrics_disabled(self):
+        metrics = Metrics(enabled=False, callbacks=[mock.Mock()])
+        GDocDown(credentials=mock.Mock(), service=self.service, metrics=metrics).download(
+            self.google_files[0], format='txt', out_path=self.out_dir)
+        self.assertEqual(metrics.totals, {})
+        metrics.callbacks[0].assert_not_called()
+
+    def test_metrics_authenticate(self):
+        metrics = Metrics()
+        with mock.patch.object(GDocDown, 'get_credentials', return_value=mock.Mock()):
+            with mock.patch.object(GDocDown, 'authenticate', return_value=self.service):
+                GDocDown(metrics=metrics)
+        self.assertEqual(sorted(metrics.totals.keys()), ['authenticate', 'get_credentials'])
+
+    def test_cli_stats(self):
+        stats_filename = os.path.join(self.in_dir, 'stats.jsonl')
+        with self.patch_service():
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with cli(argv=['-f', 'txt', '-o', self.out_dir, '--stats', '--stats-file', stats_filename]
+                         + self.google_files[0:2], credentials=mock.Mock()) as app:
+                    app.run()
+            self.assertRegex(stdout.getvalue(), r'\nexport +2 +[0-9.]+ +{}\n'.format(
+                sum(len(self.service.documents['doc-{}'.format(i_doc)]['text/plain']) for i_doc in range(2))))
+
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with cli(argv=['sync', self.in_dir, self.out_dir, '--format-map', 'gdoc=txt', '--stats'],
+                         credentials=mock.Mock()) as app:
+                    app.run()
+            self.assertRegex(stdout.getvalue(), r'\ndownload +6 ')
+
+        with open(stats_filename, 'r') as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(len([record for record in records if record['event'] == 'download']), 2)
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.in_dir = tempfile.mkdtemp()
+        self.out_dir = tempfile.mkdtemp()
+
+        self.service = FakeDriveService()
+        self.google_files = []
+        for i_doc in range(3):
+            doc_id = 'doc-{}'.format(i_doc)
+            self.service.documents[doc_id] = {'text/plain': 'document {}'.format(i_doc).encode('utf-8')}
+            google_file = os.path.join(self.in_dir, 'doc-{}.gdoc'.format(i_doc))
+            with open(google_file, 'w') as file:
+                json.dump({'doc_id': doc_id}, file)
+            self.google_files.append(google_file)
+
+        self.manifest_patcher = mock.patch.object(GDocDown, 'MANIFEST_PATH', os.path.join(self.in_dir, 'manifest.json'))
+        self.manifest_patcher.start()
+        self.stub_index_patcher = mock.patch.object(GDocDown, 'STUB_INDEX_PATH', os.path.join(self.in_dir, 'stubs.json'))
+        self.stub_index_patcher.start()
+        self.lock_patcher = mock.patch.object(OutputLock, 'DIRNAME', os.path.join(self.in_dir, 'locks'))
+        self.lock_patcher.start()
+
+        self.socket_path = os.path.join(self.in_dir, 'server.sock')
+        self.server = GDocDownServer(GDocDown(credentials=mock.Mock(), service=self.service),
+                                     socket_path=self.socket_path, max_workers=2)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        self.manifest_patcher.stop()
+        self.stub_index_patcher.stop()
+        self.lock_patcher.stop()
+        shutil.rmtree(self.in_dir)
+        shutil.rmtree(self.out_dir)
+
+    def test_download_many(self):
+        client = GDocDownClient(socket_path=self.socket_path)
+        results = client.download_many(self.google_files, format='txt', out_path=self.out_dir)
+        self.assertEqual([result.google_file for result in results], self.google_files)
+        self.assertTrue(all(result.success and not result.up_to_date for result in results))
+        for i_doc, result in enumerate(results):
+            with open(result.out_file, 'r') as file:
+                self.assertEqual(file.read(), 'document {}'.format(i_doc))
+
+        results = client.download_many(self.google_files, format='txt', out_path=self.out_dir)
+        self.assertTrue(all(result.up_to_date for result in results))
+        self.assertEqual(len(self.service.get_calls('export')), 3)
+        self.assertLessEqual(self.service.max_concurrent_calls, 2)
+
+        status = client.status()
+        self.assertEqual((status['hits'], status['misses']), (3, 3))
+
+    def test_relative_paths(self):
+        cwd = os.getcwd()
+        os.chdir(self.in_dir)
+        try:
+            results = GDocDownClient(socket_path=self.socket_path).download_many(
+                ['doc-0.gdoc', 'missing.gdoc'], format='txt', out_path=os.path.relpath(self.out_dir))
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual([result.google_file for result in results], ['doc-0.gdoc', 'missing.gdoc'])
+        self.assertEqual(results[0].out_file, os.path.join(self.out_dir, 'doc-0.txt'))
+        self.assertFalse(results[1].success)
+        self.assertRegex(str(results[1].error), 'No such file')
+
+    def test_rejected_downloads(self):
+        with self.assertRaisesRegex(Exception, 'must be a directory'):
+            GDocDownClient(socket_path=self.socket_path).download_many(
+                self.google_files, format='txt', out_path=os.path.join(self.out_dir, 'example.txt'))
+
+    def test_socket(self):
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o077, 0)
+
+        with self.assertRaisesRegex(Exception, 'already listening'):
+            GDocDownServer(self.server.downloader, socket_path=self.socket_path)
+
+        stale_socket_path = os.path.join(self.in_dir, 'stale.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(stale_socket_path)
+        sock.close()
+        GDocDownServer.remove_stale_socket(stale_socket_path)
+        self.assertFalse(os.path.exists(stale_socket_path))
+
+    def test_reuse_convert_processes(self):
+        with open(os.path.join(FIXTURES_DIR, 'example.html.zip'), 'rb') as file:
+            html_zip_content = file.read()
+        for exports in self.service.documents.values():
+            exports['application/zip'] = html_zip_content
+
+        client = GDocDownClient(socket_path=self.socket_path)
+        self.assertTrue(all(result.success for result in client.download_many(
+            self.google_files[0:2], format='tex', out_path=self.out_dir)))
+        convert_executor = self.server.downloader._convert_executor
+        self.assertIsNotNone(convert_executor)
+        self.assertTrue(all(result.success for result in client.download_many(
+            self.google_files[0:2], format='tex', out_path=self.out_dir, force=True)))
+        self.assertIs(self.server.downloader._convert_executor, convert_executor)
+
+        with mock.patch.object(self.server.downloader, 'close', wraps=self.server.downloader.close) as close:
+            self.server.shutdown()
+            self.server.server_close()
+        close.assert_called_once_with()
+        self.assertIsNone(self.server.downloader._convert_executor)
+
+    def test_cli(self):
+        argv = ['--server', '--socket', self.socket_path, '-f', 'txt', '-o', self.out_dir] + self.google_files
+        with mock.patch.object(GDocDown, '__init__', side_effect=AssertionError('the client should not authenticate')):
+            with cli(argv=argv) as app:
+                app.run()
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                with cli(argv=['download'] + argv) as app:
+                    app.run()
+        self.assertIn('3 up to date (manifest hits), 0 exported (manifest misses)', stdout.getvalue())
+        self.assertEqual(sorted(os.listdir(self.out_dir)), ['doc-0.txt', 'doc-1.txt', 'doc-2.txt'])
+
+        os.remove(self.google_files[1])
+        with self.assertRaisesRegex(Exception, 'No such file'):
+            with cli(argv=['--server', '--socket', self.socket_path, '-o', self.out_dir, self.google_files[1]]) as app:
+                app.run()
+
+        # options of the downloads of the server are rejected rather than ignored
+        for options, message in [(['--cache'], '--cache cannot'), (['--fsync', '--stats'], '--fsync, --stats cannot'),
+                                 (['-j', '2'], '--max-workers cannot')]:
+            with self.assertRaisesRegex(Exception, message):
+                with cli(argv=['--server', '--socket', self.socket_path] + options + self.google_files[0:1]) as app:
+                    app.run()
+
+    def test_cli_serve(self):
+        socket_path = os.path.join(self.in_dir, 'other.sock')
+        with mock.patch.object(GDocDown, 'authenticate', return_value=self.service):
+            with mock.patch.object(GDocDownServer, 'serve_forever', side_effect=KeyboardInterrupt) as serve_forever:
+                with cli(argv=['serve', '--socket', socket_path, '-j', '3'], credentials=mock.Mock()) as app:
+                    app.run()
+        serve_forever.assert_called_once_with()
+        self.assertFalse(os.path.exists(socket_path))
+
+
+class TestAsyncGDocDown(unittest.TestCase):
+
+    def setUp(self):
+        self.in_dir = tempfile.mkdtemp()
+        self.out_dir = tempfile.mkdtemp()
+
+        self.service = FakeDriveService()
+        self.google_files = []
+        for i_doc in range(6):
+            doc_id = 'doc-{}'.format(i_doc)
+            self.service.documents[doc_id] = {'text/plain': '\ufeffdocument {}'.format(i_doc).encode('utf-8')}
+            google_file = os.path.join(self.in_dir, 'doc-{}.gdoc'.format(i_doc))
+            with open(google_file, 'w') as file:
+                json.dump({'doc_id': doc_id}, file)
+            self.google_files.append(google_file)
+
+        self.session = FakeAiohttpSession(self.service, latency=0.01)
+        self.credentials = mock.Mock(access_token='token', access_token_expired=False)
+        self.manifest_patcher = mock.patch.object(GDocDown, 'MANIFEST_PATH', os.path.join(self.in_dir, 'manifest.json'))
+        self.manifest_patcher.start()
+        self.stub_index_patcher = mock.patch.object(GDocDown, 'STUB_INDEX_PATH', os.path.join(self.in_dir, 'stubs.json'))
+        self.stub_index_patcher.start()
+        self.lock_patcher = mock.patch.object(OutputLock, 'DIRNAME', os.path.join(self.in_dir, 'locks'))
+        self.lock_patcher.start()
+
+    def tearDown(self):
+        self.manifest_patcher.stop()
+        self.stub_index_patcher.stop()
+        self.lock_patcher.stop()
+        shutil.rmtree(self.in_dir)
+        shutil.rmtree(self.out_dir)
+
+    def get_downloader(self, **kwargs):
+        kwargs.setdefault('rate_limiter', TokenBucket(1e6))
+        return AsyncGDocDown(credentials=self.credentials, session=self.session, **kwargs)
+
+    def test_download_many(self):
+        downloader = self.get_downloader(max_workers=3)
+        results = asyncio.run(downloader.download_many(self.google_files, format='txt', out_path=self.out_dir))
+
+        self.assertEqual([result.google_file for result in results], self.google_files)
+        for i_doc, result in enumerate(results):
+            self.assertTrue(result.success)
+            self.assertFalse(result.up_to_date)
+            self.assertEqual(result.out_file, GDocDown.get_out_file(self.google_files[i_doc], format='txt',
+                                                                    out_path=self.out_dir))
+            with open(result.out_file, 'r') as file:
+                self.assertEqual(file.read(), 'document {}'.format(i_doc))
+        self.assertGreater(self.session.max_in_flight, 1)
+        self.assertLessEqual(self.session.max_in_flight, 3)
+        self.assertTrue(all(headers['Authorization'] == 'Bearer token' for _, _, headers in self.session.requests))
+
+        # unchanged files are skipped
+        results = asyncio.run(downloader.download_many(self.google_files[0:2], format='txt', out_path=self.out_dir))
+        self.assertTrue(all(result.up_to_date for result in results))
+        self.assertEqual(len(self.service.get_calls('export')), 6)
+
+    def test_download_many_reports_errors(self):
+        os.remove(self.google_files[1])
+        del self.service.documents['doc-2']
+        results = asyncio.run(self.get_downloader().download_many(
+            self.google_files[0:3] + [self.google_files[0]], format='txt', out_path=self.out_dir))
+
+        self.assertEqual([result.success for result in results], [True, False, False])
+        self.assertIsInstance(results[1].error, IOError)
+        self.assertRegex(str(results[2].error), 'HTTP 404')
+
+        with self.assertRaisesRegex(Exception, 'must be a directory'):
+            asyncio.run(self.get_downloader().download_many(
+                self.google_files, format='txt', out_path=os.path.join(self.out_dir, 'example.txt')))
+
+    def test_download(self):
+        with open(os.path.join(FIXTURES_DIR, 'example.html.zip'), 'rb') as file:
+            self.service.documents['doc-0']['application/zip'] = file.read()
+        downloader = self.get_downloader(chunk_size=1024)
+
+        out_files = asyncio.run(downloader.download(self.google_files[0], formats=['tex', 'html.zip', 'txt'],
+                                                    out_path=self.out_dir))
+        self.assertEqual(sorted((call['mimeType'] for call in self.service.get_calls('export'))),
+                         ['application/zip', 'text/plain'])
+        with open(out_files[0], 'rb') as file:
+            with open(os.path.join(FIXTURES_DIR, 'example.tex'), 'rb') as tex_file:
+                self.assertEqual(file.read(), tex_file.read())
+
+        out_file = os.path.join(self.out_dir, 'other.txt')
+        self.assertEqual(asyncio.run(downloader.download(self.google_files[1], format='txt', out_path=out_file)),
+                         out_file)
+        with open(out_file, 'r') as file:
+            self.assertEqual(file.read(), 'document 1')
+
+    def test_disk_io_off_event_loop(self):
+        threads = {}
+
+        def record_thread(cls, name):
+            method = getattr(cls, name)
+
+            def wrapper(*args, **kwargs):
+                threads.setdefault(name, set()).add(threading.current_thread())
+                return method(*args, **kwargs)
+            return mock.patch.object(cls, name, autospec=True, side_effect=wrapper)
+
+        store = ExportStore(os.path.join(self.in_dir, 'store'), link_modes=('copy',))
+        downloader = self.get_downloader(store=store)
+        other_dir = os.path.join(self.out_dir, 'other')
+        os.mkdir(other_dir)
+        with contextlib.ExitStack() as stack:
+            for cls, name in [(StubIndex, 'get_google_id'), (StubIndex, 'save'), (Manifest, 'is_current'),
+                              (Manifest, 'set'), (Manifest, 'save'), (ExportStore, 'materialize')]:
+                stack.enter_context(record_thread(cls, name))
+            asyncio.run(downloader.download_many(self.google_files[0:2], format='txt', out_path=self.out_dir))
+            asyncio.run(downloader.download(self.google_files[0], format='txt', out_path=other_dir))
+
+        self.assertEqual(store.hits, 1)
+        self.assertEqual(sorted(threads.keys()), ['get_google_id', 'is_current', 'materialize', 'save', 'set'])
+        for name, name_threads in threads.items():
+            self.assertNotIn(threading.main_thread(), name_threads, name)
+
+    def test_retry(self):
+        self.service.fail('get', 503)
+        self.service.fail('export_chunk', 429, retry_after='0')
+        downloader = self.get_downloader(chunk_size=4, retry_policy=RetryPolicy(initial_delay=0.))
+        out_file = asyncio.run(downloader.download(self.google_files[0], format='txt', out_path=self.out_dir))
+
+        with open(out_file, 'r') as file:
+            self.assertEqual(file.read(), 'document 0')
+        self.assertEqual(downloader.retry_policy.retries, 2)
+        self.assertEqual([call['start'] for call in self.service.get_calls('export_chunk')], [0, 0, 4, 8, 12])
+
+    def test_refresh_expired_token(self):
+        self.service.fail('get', 401)
+        downloader = self.get_downloader()
+        asyncio.run(downloader.download(self.google_files[0], format='txt', out_path=self.out_dir))
+        self.assertEqual(self.credentials.refresh.call_count, 1)
+
+        self.credentials.access_token_expired = True
+        self.credentials.refresh.side_effect = lambda http: setattr(self.credentials, 'access_token_expired', False)
+        asyncio.run(downloader.download(self.google_files[1], format='txt', out_path=self.out_dir))
+        self.assertEqual(self.credentials.refresh.call_count, 2)